@@ -11,10 +11,76 @@ OUTPUT_DIR = "./output"
 FINAL_CSV_NAME = "receipt_summary.csv"
 
 
+# --- OCR 설정 ---
+# tesseract 1회 실행으로 처리할 이미지 수 (1이면 이미지마다 tesseract 실행)
+# 값을 늘리면 프로세스 시작 및 언어 데이터 로딩 비용이 배치 단위로 줄어듦
+OCR_BATCH_SIZE = 1
+
+# 영역(ROI) OCR 사용 여부: 축소한 상단 헤더로 유형을 먼저 판별한 뒤 그 유형의 영역만 OCR
+# 필드를 찾지 못하면 전체 이미지 OCR로 대체됨
+USE_ROI_OCR = False
+
+# 유형 판별용 헤더 영역 (이미지 상단 비율) 및 축소 배율
+ROI_HEADER_FRACTION = 0.2
+ROI_HEADER_SCALE = 0.5
+
+# 유형별 OCR 영역: (왼쪽, 위, 오른쪽, 아래) 이미지 크기 대비 비율
+# 금액, 날짜/시간이 찍히는 띠만 지정 (앱 화면 배치가 바뀌면 조정 필요)
+# 헤더와 겹치는 부분은 잘라내고, 한 유형의 영역들은 이어 붙여 tesseract 한 번으로 OCR
+ROI_TEMPLATES = {
+    '커피빈': [(0.0, 0.3, 1.0, 0.42), (0.0, 0.6, 1.0, 0.7)],
+    '스타벅스': [(0.0, 0.3, 1.0, 0.42), (0.0, 0.6, 1.0, 0.7)],
+    '하나카드': [(0.0, 0.2, 1.0, 0.32), (0.0, 0.42, 1.0, 0.52)],
+    '신한카드': [(0.0, 0.2, 1.0, 0.32), (0.0, 0.42, 1.0, 0.52)],
+    '삼성카드': [(0.0, 0.2, 1.0, 0.32), (0.0, 0.42, 1.0, 0.52)],
+}
+
+# 다중 해상도 OCR 사용 여부: 축소 이미지로 먼저 OCR 하고,
+# 날짜/시간/정상 범위 금액을 모두 찾으면 원본 해상도 OCR을 생략
+USE_OCR_CASCADE = False
+
+# 다중 해상도 OCR 단계별 이미지 너비 (픽셀, 작은 값부터 시도 후 원본 해상도)
+OCR_CASCADE_WIDTHS = [720]
+
+# 이미지 1장당 tesseract 실행 제한 시간 (초). 초과하면 프로세스를 종료하고 다음 이미지로 넘어감
+OCR_TIMEOUT = 60
+
+# asyncio 기반 OCR 사용 여부 (이미지마다 별도 tesseract, 시간 초과/실패 시 축소 이미지로 재시도)
+USE_ASYNC_OCR = False
+
+# asyncio OCR 재시도 시 사용할 축소 너비 (픽셀, 재시도 횟수 = 이미지보다 작은 너비의 수)
+OCR_RETRY_WIDTHS = [1600, 1000]
+
+# 이 픽셀 수를 넘는 이미지는 축소해서 디코딩 (JPEG 은 디코더에서 바로 축소, 0이면 축소 안 함)
+DECODE_MAX_PIXELS = 20_000_000
+
+# 동시에 디코딩 중인 이미지가 사용할 수 있는 메모리 (MB, 0이면 제한 없음)
+# 제한을 넘으면 다른 이미지의 디코딩이 끝날 때까지 대기하므로 작업 수와 관계없이 최대 메모리가 일정함
+MEMORY_BUDGET_MB = 0
+
+
+# --- OCR 캐시 설정 ---
+# OCR 결과 캐시 사용 여부 (이미지 내용 기준이므로 파일 이름이 바뀌어도 재사용됨)
+USE_OCR_CACHE = True
+
+# 출력 디렉토리에 저장될 OCR 캐시 파일의 이름
+OCR_CACHE_NAME = "ocr_cache.sqlite3"
+
+# 추출 파이프라인 단계 사이 대기열 크기 (동시에 메모리에 머무는 작업 수의 상한)
+PIPELINE_QUEUE_DEPTH = 16
+
+
 # --- 계산기 설정 ---
 # 계산기에서 사용할 최대 한도 금액
 BILL_LIMIT = 100000
 
+# 영수증 1건의 정상 금액 범위 (벗어나면 금액 검증에서 중단)
+MIN_AMOUNT = 1000
+MAX_AMOUNT = 99999
+
+# 최적 합계 계산 시간 제한 (초). 초과 시 그때까지 찾은 최선의 조합을 사용 (0이면 제한 없음)
+SOLVER_TIME_BUDGET = 30
+
 
 # --- 로깅 설정 ---
 # 로그 파일이 저장될 디렉토리
@@ -33,3 +99,84 @@ BACKUP_ORIGINAL = True
 
 # 원본 파일 백업 디렉토리
 BACKUP_DIR = "./receipt_images_backup"
+
+# 백업 방식: "auto"(하드링크 → reflink → 복사 순으로 시도), "link", "reflink", "copy"
+# 원본은 이름만 바뀌고 내용은 수정되지 않으므로 하드링크만으로도 완전한 백업이 됨
+BACKUP_METHOD = "auto"
+
+# 출력 디렉토리에 저장될 파일 이름 변경 저널 (--resume / --rollback 에 사용)
+RENAME_JOURNAL_NAME = "rename_journal.jsonl"
+
+# batch 명령에서 출력 루트 디렉토리에 저장될 폴더별 결과 요약
+BATCH_SUMMARY_NAME = "batch_summary.csv"
+
+# --- 감시 모드 설정 (--watch) ---
+# 출력 디렉토리에 저장될 처리 완료 이미지 목록 (이미지 내용 기준)
+MANIFEST_NAME = "processed_manifest.json"
+
+# 새 파일이 들어온 뒤 추가 변경이 없을 때까지 기다리는 시간 (초)
+WATCH_DEBOUNCE = 1.0
+
+# Linux 에서 inotify 로 변경을 감지할지 여부 (False 이거나 사용할 수 없으면 주기적으로 확인)
+WATCH_USE_INOTIFY = True
+
+# inotify 를 사용하지 않을 때 디렉토리를 확인하는 간격 (초)
+WATCH_POLL_INTERVAL = 2.0
+
+# --- 중복 영수증 감지 설정 (--dedupe) ---
+# OCR 전에 같은 영수증을 다시 찍거나 저장한 이미지를 찾아 OCR 과 합계 계산에서 제외할지 여부
+DEDUPE = False
+
+# 지각 해시(dHash 64비트)가 이 비트 수 이하로 다르면 중복 후보로 봄
+DEDUPE_MAX_DISTANCE = 4
+
+# 중복 후보를 확정할 때 허용하는 8x8 블록 평균 밝기 차이 (0-255, 작을수록 엄격)
+DEDUPE_TOLERANCE = 40
+
+# --- 로컬 HTTP 서비스 설정 (serve 명령) ---
+# 서비스 주소 (외부에 노출하지 않도록 기본값은 localhost)
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8765
+
+# OCR 대기열 크기. 가득 차면 새 요청은 기다리지 않고 503 으로 거절됨
+SERVE_QUEUE_DEPTH = 32
+
+# 업로드 가능한 요청 본문 최대 크기 (MB)
+SERVE_MAX_UPLOAD_MB = 20
+
+# 동시에 실행할 최적 합계 계산 요청 수. 넘치면 503 으로 거절됨
+SERVE_KNAPSACK_SLOTS = 2
+
+# 최적 합계 계산 요청 1건의 최대 항목 수와 최대 한도 금액. 넘으면 413 으로 거절됨
+SERVE_KNAPSACK_MAX_ITEMS = 1000
+SERVE_KNAPSACK_MAX_LIMIT = 1_000_000_000
+
+# 최적 합계 계산 요청 1건의 최대 계산 시간 (초). --time-budget 이 0(제한 없음)이거나 더 길어도 이 값으로 제한됨
+SERVE_KNAPSACK_MAX_SECONDS = 10
+
+# JSON {"path": ...} 요청으로 읽을 수 있는 이미지 디렉토리 (None 이면 경로 요청 거부)
+SERVE_PATH_ROOT = None
+
+# --- OCR 말뭉치 재생 설정 (replay 명령) ---
+# 기록과 다른 필드를 최대 몇 개까지 출력할지
+REPLAY_MAX_DIFFS = 20
+
+# --- 영수증 원장 설정 ---
+# 실행할 때마다 결과를 출력 디렉토리의 원장(월별 JSONL)에 추가할지 여부 (query 명령으로 조회)
+USE_LEDGER = True
+
+# 출력 디렉토리 내 원장 디렉토리 이름
+LEDGER_DIR_NAME = "ledger"
+
+# --- 차선 조합 설정 (--alternatives) ---
+# 최적 조합 외에 찾을 차선 조합 수 (0이면 찾지 않음)
+ALTERNATIVES = 0
+
+# 출력 디렉토리 내 차선 조합 CSV 파일 이름
+ALTERNATIVES_CSV_NAME = "receipt_alternatives.csv"
+
+# 차선 조합 계산 표를 저장할 파일 이름 (다음 실행의 --must-include/--must-exclude 가 재사용)
+KNAPSACK_TABLE_NAME = "knapsack_table.npz"
+
+# 이보다 큰 계산 표는 저장하지 않음 (MB)
+KNAPSACK_TABLE_MAX_SAVE_MB = 32
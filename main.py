@@ -3,21 +3,38 @@ import os
 import sys
 import logging
 import argparse
+import re
+import time
 from datetime import datetime
-import pandas as pd
-import shutil
-from src.receipt_parser import (
-    extract_text_from_image,
-    classify_receipt,
-    find_date,
-    find_time,
-    find_amount
+from src import receipt_parser
+from src.receipt_parser import cascade_stats, ocr_settings_key, parse_receipt_text, PARSER_VERSION
+from src.pipeline import OcrOptions, list_image_files, ocr_options_key, recognize_receipts, stream_receipts
+from src.receipt_record import ReceiptRecord, write_alternatives_csv, write_summary_csv
+from src.backup import backup_file
+from src.rename_journal import apply_renames, resume_renames, rollback_renames
+from src.manifest import Manifest
+from src.batch import (
+    FOLDER_DONE, FOLDER_EMPTY, FOLDER_FAILED, FOLDER_INVALID_AMOUNTS, FOLDER_RENAME_CONFLICT,
+    BatchFolder, FolderSummary, batch_folders, write_batch_summary
 )
-from src.bill_calculator import solve_knapsack
+from src.dedupe import find_duplicates
+from src.watcher import directory_snapshot, open_watcher, wait_until_settled
+from src.ocr_cache import OcrCache, hash_image_file
+from src.ledger import STATUS_DUPLICATE, STATUSES, append_run, ledger_row, new_run_id, query_ledger
+from src.ocr_corpus import FIELDS, CorpusWriter, parse_reference, read_corpus, replay_corpus
+from src.metrics import METRICS
+from src.bill_calculator import (
+    DP_MAX_TABLE_BYTES, KnapsackTable, knapsack_table_bytes, solve_knapsack_auto, solve_knapsack_constrained,
+    solve_knapsack_periods
+)
+from src.periods import describe_period, eligible_periods, parse_period
 import config
 
 __version__ = "1.0.0"
 
+# File names given to included receipts: '3.PNG', or '2-3.PNG' with --period
+NUMBERED_NAME = re.compile(r"\d+(-\d+)?\.\w+")
+
 
 def parse_args():
     """Parse command line arguments."""
@@ -33,6 +50,22 @@ def parse_args():
   python main.py -i ./images -o ./out 사용자 지정 디렉토리
   python main.py --no-rename          파일 이름 변경 건너뛰기
   python main.py --limit 50000        한도 금액 설정
+  python main.py -j 8                 OCR 작업자 8개로 병렬 처리
+  python main.py --rollback           마지막 파일 이름 변경 되돌리기
+  python main.py --watch              새 영수증이 들어올 때마다 결과 갱신
+  python main.py --dedupe             중복 영수증 이미지 제외
+  python main.py --memory-budget 512  이미지 디코딩 메모리를 512MB 이내로 제한
+  python main.py --alternatives 5      차선 조합 5개와 파레토 조합을 receipt_alternatives.csv 로 저장
+  python main.py --must-include IMG_6203.PNG --must-exclude IMG_6210.PNG
+                                      특정 영수증을 반드시 포함/제외하고 최적 합계 계산
+  python main.py --period 100000::2026-01-31 --period 100000::2026-02-28
+                                      1월, 2월 한도에 영수증을 한 번에 배분 (1월 잔여분은 2월로 이월)
+  python main.py -j 8 batch a b c     여러 폴더를 한 번에 처리 (공통 옵션은 batch 앞에 지정)
+  python main.py -j 4 serve           로컬 HTTP API 로 영수증 인식/최적 합계 제공
+  python main.py --record corpus.jsonl.gz   OCR 원문과 추출 결과를 말뭉치에 기록
+  python main.py replay corpus.jsonl.gz     기록된 OCR 원문으로 파서 회귀 검사
+  python main.py query --from 2026-07-01 --to 2026-09-30 --status included
+                                      지난 분기에 청구한 영수증 조회
         """
     )
 
@@ -90,6 +123,149 @@ def parse_args():
         metavar="AMOUNT",
         help=f"최대 한도 금액 (기본값: {config.BILL_LIMIT})"
     )
+    parser.add_argument(
+        "--period",
+        dest="periods",
+        action="append",
+        type=period_arg,
+        metavar="LIMIT[:START[:END]]",
+        help="기간별 한도와 영수증 날짜 범위(YYYY-MM-DD, 생략 가능). 여러 번 지정하면 영수증을 "
+             "기간들에 한 번에 배분하며 -l 은 무시됩니다"
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        default=config.SOLVER_TIME_BUDGET,
+        metavar="SECONDS",
+        help=f"최적 합계 계산 시간 제한, 0이면 제한 없음 (기본값: {config.SOLVER_TIME_BUDGET})"
+    )
+    parser.add_argument(
+        "--alternatives",
+        type=int,
+        default=config.ALTERNATIVES,
+        metavar="K",
+        help="최적 조합 다음으로 좋은 조합 K개와 (합계, 영수증 수) 파레토 조합을 찾아 "
+             f"{config.ALTERNATIVES_CSV_NAME} 에 저장합니다 (기본값: {config.ALTERNATIVES})"
+    )
+    parser.add_argument(
+        "--must-include",
+        action="append",
+        default=[],
+        metavar="FILE",
+        help="이 영수증 파일을 반드시 포함합니다 (여러 번 지정 가능)"
+    )
+    parser.add_argument(
+        "--must-exclude",
+        action="append",
+        default=[],
+        metavar="FILE",
+        help="이 영수증 파일을 반드시 제외합니다 (여러 번 지정 가능)"
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        metavar="N",
+        help="동시에 실행할 OCR 작업 수 (기본값: CPU 코어 수)"
+    )
+
+    parser.add_argument(
+        "--ocr-batch",
+        type=int,
+        default=config.OCR_BATCH_SIZE,
+        metavar="N",
+        help=f"tesseract 1회 실행으로 처리할 이미지 수 (기본값: {config.OCR_BATCH_SIZE})"
+    )
+    parser.add_argument(
+        "--roi",
+        action="store_true",
+        help="영수증 유형별 영역만 이어 붙여 한 번에 OCR 합니다 (실패 시 전체 OCR)"
+    )
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="축소 해상도로 먼저 OCR 하고 필요할 때만 원본 해상도로 재시도합니다"
+    )
+    parser.add_argument(
+        "--async-ocr",
+        action="store_true",
+        help="asyncio 로 이미지마다 tesseract 를 실행하고, 시간 초과 시 축소 이미지로 재시도합니다"
+    )
+    parser.add_argument(
+        "--ocr-timeout",
+        type=float,
+        default=config.OCR_TIMEOUT,
+        metavar="SECONDS",
+        help=f"이미지 1장당 OCR 제한 시간, 0이면 제한 없음 (기본값: {config.OCR_TIMEOUT})"
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=config.MEMORY_BUDGET_MB,
+        metavar="MB",
+        help=f"동시에 디코딩 중인 이미지의 메모리 한도, 0이면 제한 없음 (기본값: {config.MEMORY_BUDGET_MB})"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="OCR 결과 캐시를 사용하지 않습니다"
+    )
+    parser.add_argument(
+        "--no-ledger",
+        action="store_true",
+        help="출력 디렉토리의 영수증 원장에 이번 결과를 추가하지 않습니다"
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="같은 영수증의 중복 이미지를 찾아 OCR 과 합계 계산에서 제외합니다"
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="비정상 금액이 처음 감지되는 즉시 추출을 중단합니다 (기본값: 모든 문제 파일 수집)"
+    )
+
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="입력 디렉토리를 감시하며 새 영수증이 들어올 때마다 결과를 갱신합니다"
+    )
+
+    # Rename recovery
+    recovery = parser.add_mutually_exclusive_group()
+    recovery.add_argument(
+        "--resume",
+        action="store_true",
+        help="중단된 파일 이름 변경을 저널에 따라 마저 수행합니다"
+    )
+    recovery.add_argument(
+        "--rollback",
+        action="store_true",
+        help="마지막 파일 이름 변경을 저널에 따라 원래대로 되돌립니다"
+    )
+
+    # Instrumentation
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="단계별 시간/자원 사용량 보고서를 저장합니다 (.json 또는 .jsonl)"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="cProfile 통계도 함께 저장합니다 (--metrics 경로의 .prof 파일)"
+    )
+
+    parser.add_argument(
+        "--record",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="새로 인식한 이미지의 OCR 원문과 추출 결과를 말뭉치 파일에 추가합니다 (.jsonl 또는 .jsonl.gz)"
+    )
 
     # Dry run
     parser.add_argument(
@@ -98,7 +274,173 @@ def parse_args():
         help="실제 파일 변경 없이 시뮬레이션만 수행합니다"
     )
 
-    return parser.parse_args()
+    # Commands (common options go before the command name)
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    batch = commands.add_parser(
+        "batch",
+        help="여러 영수증 폴더를 하나의 OCR 작업자 풀과 캐시로 한 번에 처리합니다",
+        description="여러 영수증 폴더의 이미지를 하나의 OCR 작업자 풀과 캐시로 처리하고, 폴더마다 "
+                    "최적 합계 계산, 파일 이름 변경, CSV 생성을 따로 수행합니다. "
+                    "-o 는 출력 루트 디렉토리가 되며, 공통 옵션은 batch 앞에 지정합니다.",
+    )
+    batch.add_argument(
+        "input_dirs",
+        nargs="*",
+        metavar="DIR",
+        help="영수증 이미지 디렉토리 (결과는 <출력 디렉토리>/<폴더 이름>에 저장)"
+    )
+    batch.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="폴더별 입력 디렉토리, 출력 디렉토리, 한도를 지정한 JSON 배치 목록"
+    )
+
+    serve = commands.add_parser(
+        "serve",
+        help="영수증 인식과 최적 합계 계산을 로컬 HTTP API 로 제공합니다",
+        description="OCR 작업자와 캐시를 띄워 둔 채 로컬 HTTP API 를 제공합니다. "
+                    "POST /receipts (이미지), POST /knapsack (JSON), GET /health, GET /metrics. "
+                    "-j 는 OCR 작업자 수, -o 는 캐시 위치이며, 공통 옵션은 serve 앞에 지정합니다.",
+    )
+    serve.add_argument(
+        "--host",
+        type=str,
+        default=config.SERVE_HOST,
+        help=f"서비스 주소 (기본값: {config.SERVE_HOST})"
+    )
+    serve.add_argument(
+        "--port",
+        type=int,
+        default=config.SERVE_PORT,
+        help=f"서비스 포트 (기본값: {config.SERVE_PORT})"
+    )
+    serve.add_argument(
+        "--queue-depth",
+        type=int,
+        default=config.SERVE_QUEUE_DEPTH,
+        metavar="N",
+        help=f"OCR 대기열 크기, 가득 차면 503 으로 거절 (기본값: {config.SERVE_QUEUE_DEPTH})"
+    )
+    serve.add_argument(
+        "--path-root",
+        type=str,
+        default=config.SERVE_PATH_ROOT,
+        metavar="DIR",
+        help="JSON {\"path\": ...} 요청을 이 디렉토리 안의 파일에만 허용합니다 (기본값: 경로 요청 거부)"
+    )
+
+    replay = commands.add_parser(
+        "replay",
+        help="기록된 OCR 원문으로 영수증 파서를 다시 실행해 결과를 비교합니다",
+        description="--record 로 만든 말뭉치의 OCR 원문을 이미지와 tesseract 없이 다시 파싱하고, "
+                    "기록된 값(또는 손으로 고친 expected 값)과 필드별로 비교합니다. "
+                    "차이가 있으면 종료 코드 1을 반환합니다.",
+    )
+    replay.add_argument(
+        "corpus",
+        metavar="CORPUS",
+        help="말뭉치 파일 (.jsonl 또는 .jsonl.gz)"
+    )
+    replay.add_argument(
+        "--engine",
+        choices=("fast", "reference"),
+        default="fast",
+        help="fast: 한 번에 추출하는 parse_receipt_text, reference: classify_receipt/find_date/"
+             "find_time/find_amount 를 차례로 호출 (기본값: fast)"
+    )
+    replay.add_argument(
+        "--max-diffs",
+        type=int,
+        default=config.REPLAY_MAX_DIFFS,
+        metavar="N",
+        help=f"출력할 차이 항목 수 (기본값: {config.REPLAY_MAX_DIFFS})"
+    )
+
+    query = commands.add_parser(
+        "query",
+        help="출력 디렉토리의 영수증 원장에서 지난 결과를 조회합니다",
+        description="출력 디렉토리(-o)의 영수증 원장에서 조건에 맞는 영수증을 조회합니다. "
+                    "같은 이미지가 여러 번 처리되었다면 기본적으로 가장 최근 실행의 결과만 사용합니다.",
+    )
+    query.add_argument(
+        "--from",
+        dest="date_from",
+        type=date_arg,
+        metavar="YYYY-MM-DD",
+        help="이 날짜 이후의 영수증만 (포함)"
+    )
+    query.add_argument(
+        "--to",
+        dest="date_to",
+        type=date_arg,
+        metavar="YYYY-MM-DD",
+        help="이 날짜 이전의 영수증만 (포함)"
+    )
+    query.add_argument(
+        "--type",
+        dest="receipt_type",
+        metavar="TYPE",
+        help="영수증 유형 (예: 하나카드)"
+    )
+    query.add_argument(
+        "--status",
+        choices=STATUSES,
+        help="included: 포함, excluded: 제외, duplicate: 중복"
+    )
+    query.add_argument(
+        "--run",
+        metavar="RUN",
+        help="이 실행 ID 의 결과만"
+    )
+    query.add_argument(
+        "--all-runs",
+        action="store_true",
+        help="이미지마다 가장 최근 실행만이 아니라 모든 실행의 결과를 표시합니다"
+    )
+    query.add_argument(
+        "--csv",
+        metavar="PATH",
+        help="조회 결과를 요약 CSV 와 같은 형식으로 저장합니다"
+    )
+
+    args = parser.parse_args()
+    if args.command in ("replay", "query") and (args.watch or args.resume or args.rollback or args.record):
+        parser.error(f"--watch, --resume, --rollback, --record 는 {args.command} 와 함께 사용할 수 없습니다.")
+    if args.command == "serve" and (args.watch or args.resume or args.rollback):
+        parser.error("--watch, --resume, --rollback 은 serve 와 함께 사용할 수 없습니다.")
+    if args.alternatives < 0:
+        parser.error("--alternatives 는 0 이상이어야 합니다.")
+    if args.periods and (args.alternatives or args.must_include or args.must_exclude):
+        parser.error("--alternatives, --must-include, --must-exclude 는 --period 와 함께 사용할 수 없습니다.")
+    both = sorted(set(args.must_include) & set(args.must_exclude))
+    if both:
+        parser.error(f"--must-include 와 --must-exclude 에 모두 지정된 파일: {', '.join(both)}")
+    if args.command == "batch":
+        if not args.input_dirs and not args.manifest:
+            batch.error("처리할 디렉토리나 --manifest 를 지정하세요.")
+        if (args.watch or args.resume or args.rollback or args.fail_fast or args.periods
+                or args.must_include or args.must_exclude):
+            parser.error("--watch, --resume, --rollback, --fail-fast, --period, --must-include, --must-exclude 는 "
+                         "batch 와 함께 사용할 수 없습니다.")
+    return args
+
+
+def date_arg(value):
+    """argparse type for YYYY-MM-DD dates, normalized so that they compare as strings."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"날짜는 YYYY-MM-DD 형식이어야 합니다: {value}") from None
+
+
+def period_arg(spec):
+    """argparse type for --period."""
+    try:
+        return parse_period(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
 
 def setup_logging(verbose=False, quiet=False):
     """Configures logging with optional console output based on verbosity."""
@@ -158,202 +500,973 @@ def setup_logging(verbose=False, quiet=False):
     root_logger.addHandler(console_handler)
 
 
-def rename_receipt_files(df, input_dir, do_rename=True, do_backup=True, dry_run=False):
-    """Renames receipt files based on their sorted order (1, 2, 3...)."""
+def rename_receipt_files(records, input_dir, journal_path, do_rename=True, do_backup=True, dry_run=False,
+                         excluded=(), backup_dir=config.BACKUP_DIR):
+    """
+    Renames receipt files based on their sorted order (1, 2, 3..., or 1-1, 1-2, 2-1... per
+    period), journalling every step.
+    Excluded receipts still named like a final name (included in an earlier run) are moved
+    aside to excluded_<name> so the included ones can take their numbers.
+    """
     if not do_rename:
         logging.info("  - 파일 이름 변경 기능이 비활성화되어 있습니다.")
-        return df
+        return records
 
     # Backup original files if enabled
     if do_backup:
-        os.makedirs(config.BACKUP_DIR, exist_ok=True)
-        logging.info(f"  - 원본 파일을 {config.BACKUP_DIR}에 백업 중...")
+        os.makedirs(backup_dir, exist_ok=True)
+        logging.info(f"  - 원본 파일을 {backup_dir}에 백업 중...")
         if not dry_run:
-            for _, row in df.iterrows():
-                original_path = os.path.join(input_dir, row['Filename'])
-                backup_path = os.path.join(config.BACKUP_DIR, row['Filename'])
-                if os.path.exists(original_path):
-                    shutil.copy2(original_path, backup_path)
+            with METRICS.stage('backup'):
+                for record in records:
+                    original_path = os.path.join(input_dir, record.filename)
+                    backup_path = os.path.join(backup_dir, record.filename)
+                    if os.path.exists(original_path):
+                        method = backup_file(original_path, backup_path, config.BACKUP_METHOD)
+                        METRICS.add(f'backup_{method}')
+                        if method in ('copy', 'copy_file_range'):
+                            METRICS.add('bytes_written', os.path.getsize(backup_path))
         logging.info("  - 백업 완료")
 
     if dry_run:
         logging.info("  - [DRY-RUN] 파일 이름 변경을 시뮬레이션합니다...")
-        new_filenames = []
-        for idx, row in df.iterrows():
-            _, ext = os.path.splitext(row['Filename'])
-            final_name = f"{row['No.']}{ext}"
-            new_filenames.append(final_name)
-            logging.info(f"  - [DRY-RUN] {row['Filename']} → {final_name}")
-        df['Filename'] = new_filenames
-        return df
-
-    # Step 1: Rename to temporary names to avoid conflicts
-    temp_mappings = []
-    for idx, row in df.iterrows():
-        original_filename = row['Filename']
-        original_path = os.path.join(input_dir, original_filename)
-        _, ext = os.path.splitext(original_filename)
-        temp_name = f"_temp_{row['No.']}{ext}"
-        temp_path = os.path.join(input_dir, temp_name)
-        if os.path.exists(original_path):
-            os.rename(original_path, temp_path)
-            temp_mappings.append((temp_path, row['No.'], ext, original_filename))
-
-    # Step 2: Rename from temporary names to final names
-    new_filenames = []
-    for temp_path, no, ext, original_filename in temp_mappings:
-        final_name = f"{no}{ext}"
-        final_path = os.path.join(input_dir, final_name)
-        os.rename(temp_path, final_path)
-        new_filenames.append(final_name)
-        logging.info(f"  - 파일 이름 변경: {original_filename} → {final_name}")
-
-    # Update the Filename column in DataFrame
-    df['Filename'] = new_filenames
+        for record in records:
+            _, ext = os.path.splitext(record.filename)
+            final_name = record.final_name(ext)
+            logging.info(f"  - [DRY-RUN] {record.filename} → {final_name}")
+            record.filename = final_name
+        return records
+
+    # Plan (original, temp, final) for every file that is still there; temp names avoid conflicts
+    plan = []
+    renamed = []
+    for record in records:
+        if os.path.exists(os.path.join(input_dir, record.filename)):
+            _, ext = os.path.splitext(record.filename)
+            plan.append((record.filename, f"_temp_{record.final_name(ext)}", record.final_name(ext)))
+            renamed.append(record)
+    final_names = {final for _, _, final in plan}
+    for record in excluded:
+        if record.filename in final_names and os.path.exists(os.path.join(input_dir, record.filename)):
+            stem, ext = os.path.splitext(record.filename)
+            aside, n = f"excluded_{stem}{ext}", 1
+            while os.path.exists(os.path.join(input_dir, aside)):
+                aside, n = f"excluded_{stem}-{n}{ext}", n + 1
+            plan.append((record.filename, f"_temp_excluded_{record.filename}", aside))
+            renamed.append(record)
+
+    with METRICS.stage('rename'):
+        apply_renames(journal_path, input_dir, plan)
+
+    for record, (_, _, final_name) in zip(renamed, plan):
+        record.filename = final_name
     logging.info("  - 파일 이름 변경 완료")
 
-    return df
-
-
-def validate_amounts(df):
-    """Validates that all amounts are within a reasonable range."""
-    min_amount = 1000
-    max_amount = 99999
-
-    invalid_amounts_df = df[(df['Amount'] < min_amount) | (df['Amount'] > max_amount)]
-
-    if not invalid_amounts_df.empty:
-        logging.error("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-        logging.error("!!! 경고: 비정상적인 금액이 감지되어 작업을 중단합니다.")
-        logging.error("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-        logging.error("\n아래 파일들의 금액을 확인하고 수동으로 수정해야 합니다.")
-        logging.error("문제가 되는 파일:")
-        for _, row in invalid_amounts_df.iterrows():
-            logging.error(f"  - 파일명: {row['Filename']}, 추출된 금액: {row['Amount']}원")
-        
-        logging.error("\n[조치 방법]")
-        logging.error(f"1. `{config.LOG_DIR}` 폴더에 생성된 최신 로그 파일(*-debug.log)을 열어 OCR로 추출된 전체 텍스트를 확인하세요.")
-        logging.error("2. `src/receipt_parser.py`의 금액 추출 로직을 디버깅하거나 수정하세요.")
-        logging.error("3. 또는, 원본 이미지 파일의 해상도를 개선하거나 노이즈를 제거하세요.")
-        logging.error("4. 수정한 후, 이 스크립트를 다시 실행해주세요.")
+    return records
+
+
+def recover_renames(args):
+    """Handles --resume / --rollback using the rename journal in the output directory."""
+    journal_path = os.path.join(args.output_dir, config.RENAME_JOURNAL_NAME)
+    if args.resume:
+        logging.info(f"--- 중단된 파일 이름 변경 재개: {journal_path} ---")
+        run, done = resume_renames(journal_path)
+    else:
+        logging.info(f"--- 마지막 파일 이름 변경 되돌리기: {journal_path} ---")
+        run, done = rollback_renames(journal_path)
+    if run is None:
+        logging.info("  - 저널에 기록된 파일 이름 변경이 없습니다.")
+        return
+    if not done:
+        state = "이미 되돌렸습니다" if run['status'] == 'rolled_back' else "이미 완료되었습니다"
+        log = logging.info if args.resume else logging.warning
+        log(f"  - 마지막 파일 이름 변경(작업 ID {run['run']})은 {state}. "
+            f"{'재개할' if args.resume else '되돌릴'} 작업이 없습니다.")
+        return
+    logging.info(f"  - 완료: {run['input_dir']} ({len(run['plan'])}개 파일, 작업 ID {run['run']})")
+    if args.resume:
+        logging.info("  - CSV 파일은 다시 실행하여 생성하세요.")
+
+
+def parse_amount(amount):
+    """Converts an extracted amount string to int, treating anything unparsable as 0."""
+    return int(amount) if amount.isascii() and amount.isdigit() else 0
+
+
+def is_valid_amount(amount):
+    """Checks that an amount is within the reasonable range from config."""
+    return config.MIN_AMOUNT <= amount <= config.MAX_AMOUNT
+
+
+def report_invalid_amounts(offenders, aborted=False):
+    """Logs the offending files and how to fix them. offenders is a list of (filename, amount)."""
+    logging.error("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
+    logging.error("!!! 경고: 비정상적인 금액이 감지되어 작업을 중단합니다.")
+    logging.error("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
+    if aborted:
+        logging.error("\n(--fail-fast: 첫 번째 문제 파일에서 추출을 중단했습니다. 나머지 파일은 확인되지 않았습니다.)")
+    logging.error("\n아래 파일들의 금액을 확인하고 수동으로 수정해야 합니다.")
+    logging.error("문제가 되는 파일:")
+    for filename, amount in offenders:
+        logging.error(f"  - 파일명: {filename}, 추출된 금액: {amount}원")
+
+    logging.error("\n[조치 방법]")
+    logging.error(f"1. `{config.LOG_DIR}` 폴더에 생성된 최신 로그 파일(*-debug.log)을 열어 OCR로 추출된 전체 텍스트를 확인하세요.")
+    logging.error("2. `src/receipt_parser.py`의 금액 추출 로직을 디버깅하거나 수정하세요.")
+    logging.error("3. 또는, 원본 이미지 파일의 해상도를 개선하거나 노이즈를 제거하세요.")
+    logging.error("4. 수정한 후, 이 스크립트를 다시 실행해주세요.")
+
+
+def make_receipt_record(filename, parsed):
+    """Builds a record from parsed (receipt_type, date, time, amount), logging bad amounts as they appear."""
+    receipt_type, date, time, amount = parsed
+    amount = parse_amount(amount)
+    logging.debug(f"    {filename} - 날짜: {date}, 시간: {time}, 금액: {amount}, 유형: {receipt_type}")
+    if not is_valid_amount(amount):
+        logging.error(f"  - 비정상 금액 감지: {filename}, 추출된 금액: {amount}원")
+    return ReceiptRecord(filename, date, time, amount, receipt_type)
+
+
+def extract_all_receipts(input_dir, image_files, options, jobs=1, cache=None, fail_fast=False,
+                         queue_depth=config.PIPELINE_QUEUE_DEPTH, recorder=None):
+    """
+    Extracts receipt data from all images through the streaming pipeline, validating each
+    amount as soon as it is parsed. Rows keep the input order regardless of job count.
+    Every recognized text is also added to recorder (a CorpusWriter), if given.
+    Returns (records, offenders); with fail_fast, extraction stops at the first offender.
+    """
+    records = [None] * len(image_files)
+    offenders = []
+    cache_hits = 0
+    stream = stream_receipts(input_dir, image_files, options, jobs, cache, queue_depth)
+    try:
+        for index, filename, result, from_cache, sha256 in stream:
+            cache_hits += from_cache
+            if result is None:
+                continue
+            if recorder is not None:
+                recorder.record(os.path.join(input_dir, filename), filename, *result, sha256)
+            records[index] = make_receipt_record(filename, result[1])
+            if not is_valid_amount(records[index].amount):
+                offenders.append((index, filename, records[index].amount))
+                if fail_fast:
+                    break
+    finally:
+        stream.close()
+
+    if cache is not None:
+        logging.info(f"  - OCR 캐시 적중: {cache_hits}개")
+    if options.cascade_widths:
+        for stage, (attempts, hits) in cascade_stats().items():
+            logging.info(f"  - 해상도 단계 {stage}: {hits}/{attempts} 적중 ({hits / attempts:.0%})")
+
+    offenders = [(filename, amount) for _, filename, amount in sorted(offenders)]
+    return [record for record in records if record is not None], offenders
+
+
+def build_ocr_options(args):
+    """Collects the OCR mode options from the command line and config."""
+    use_roi = args.roi or config.USE_ROI_OCR
+    use_cascade = args.cascade or config.USE_OCR_CASCADE
+    return OcrOptions(
+        batch_size=max(1, args.ocr_batch),
+        roi_templates=config.ROI_TEMPLATES if use_roi else None,
+        roi_header_fraction=config.ROI_HEADER_FRACTION,
+        roi_header_scale=config.ROI_HEADER_SCALE,
+        cascade_widths=config.OCR_CASCADE_WIDTHS if use_cascade else None,
+        amount_range=(config.MIN_AMOUNT, config.MAX_AMOUNT),
+        async_ocr=args.async_ocr or config.USE_ASYNC_OCR,
+        retry_widths=tuple(config.OCR_RETRY_WIDTHS),
+    )
+
+
+def configure_ocr(args):
+    """Applies the process-wide OCR settings (timeout, decode limits) from the command line."""
+    receipt_parser.OCR_TIMEOUT = args.ocr_timeout if args.ocr_timeout > 0 else None
+    receipt_parser.DECODE_MAX_PIXELS = config.DECODE_MAX_PIXELS
+    receipt_parser.set_decode_budget(max(0, args.memory_budget) * 1024 * 1024)
+
+
+def open_ocr_cache(args, options, cache_dir):
+    """Opens the OCR cache in cache_dir. Returns (cache, manifest settings key), both None with --no-cache."""
+    if args.no_cache or not config.USE_OCR_CACHE:
+        return None, None
+    settings_key = ocr_settings_key(ocr_options_key(options))
+    cache_path = os.path.join(cache_dir, config.OCR_CACHE_NAME)
+    logging.info(f"  - OCR 캐시: {cache_path}")
+    return OcrCache(cache_path, settings_key, PARSER_VERSION), f"{settings_key}|parser={PARSER_VERSION}"
+
+
+def open_corpus_writer(args):
+    """Opens the --record corpus, or returns None. Nothing is recorded in a dry run."""
+    if not args.record or args.dry_run:
+        return None
+    logging.info(f"  - OCR 말뭉치 기록: {args.record}")
+    return CorpusWriter(args.record)
+
+
+def close_corpus_writer(recorder):
+    if recorder is not None:
+        recorder.close()
+        logging.info(f"  - 말뭉치에 추가된 영수증: {recorder.added}개")
+
+
+def replay_receipts(args):
+    """
+    The replay command: parses every text in the corpus again and reports field-level
+    differences and parse throughput. Returns False if any field differs.
+    """
+    parse = parse_reference if args.engine == "reference" else parse_receipt_text
+    logging.info(f"--- OCR 말뭉치 재생: {args.corpus} ---")
+    try:
+        start = time.perf_counter()
+        entries = list(read_corpus(args.corpus))
+        load_seconds = time.perf_counter() - start
+    except (OSError, ValueError) as e:
+        logging.error(f"!!! 말뭉치를 읽을 수 없습니다: {e}")
         return False
-    
-    logging.info("--- 1.5. 금액 검증 완료 ---")
-    logging.info("  - 모든 금액이 정상 범위 내에 있습니다. 다음 단계를 계속 진행합니다.")
+    logging.info(f"  - 영수증: {len(entries):,}개 (읽기 {load_seconds:.2f}초)")
+    try:
+        result = replay_corpus(entries, parse)
+    except KeyError as e:
+        logging.error(f"!!! 말뭉치 항목에 {e} 필드가 없습니다.")
+        return False
+
+    rate = result.receipts / result.seconds if result.seconds > 0 else float('inf')
+    logging.info(f"  - 파서: {args.engine}, 파싱 시간: {result.seconds:.3f}초 ({rate:,.0f}개/초)")
+    if not result.diffs:
+        logging.info(">>> 모든 필드가 기록된 값과 일치합니다.")
+        return True
+
+    differing = len({idx for idx, *_ in result.diffs})
+    logging.warning(f"!!! 기록과 다른 영수증: {differing:,}개, 다른 필드: {len(result.diffs):,}개")
+    for field in FIELDS:
+        if result.field_diffs[field]:
+            logging.warning(f"  - {field}: {result.field_diffs[field]:,}개")
+    for idx, filename, field, want, got in result.diffs[:max(0, args.max_diffs)]:
+        logging.warning(f"    #{idx + 1} {filename} {field}: 기대값 {want!r}, 결과 {got!r}")
+    if len(result.diffs) > args.max_diffs:
+        logging.warning(f"    ... 외 {len(result.diffs) - args.max_diffs:,}개 (--max-diffs 로 더 보기)")
+    return False
+
+
+def query_receipts(args):
+    """The query command: lists ledger rows matching the filters, or writes them as a CSV."""
+    ledger_dir = os.path.join(args.output_dir, config.LEDGER_DIR_NAME)
+    if not os.path.isdir(ledger_dir):
+        logging.error(f"!!! 영수증 원장이 없습니다: {ledger_dir}")
+        return False
+    rows = query_ledger(ledger_dir, args.date_from, args.date_to, args.receipt_type, args.status, args.run,
+                        latest=not args.all_runs)
+    if args.csv:
+        # A single run comes back in its own CSV order; anything else stays in date partition order
+        rows = sorted(rows, key=lambda row: row['seq']) if args.run else list(rows)
+        write_summary_csv([ReceiptRecord.from_ledger_row(row) for row in rows], args.csv,
+                          with_duplicates=any(row['status'] == STATUS_DUPLICATE for row in rows),
+                          with_periods=any(row['period'] for row in rows))
+        logging.info(f">>> 조회 결과: {args.csv} ({len(rows):,}건)")
+        return True
+
+    count = total = 0
+    counts = {status: [0, 0] for status in STATUSES}
+    for row in rows:
+        amount = row['amount'] if isinstance(row['amount'], int) else 0
+        count += 1
+        total += amount
+        counts[row['status']][0] += 1
+        counts[row['status']][1] += amount
+        logging.info(f"  {row['date']} {row['time']}  {amount:>10,}원  {row['type']}  {row['status']:<9}  "
+                     f"{row['file']}  ({row['run']}, {row['input_dir']})")
+    logging.info(f">>> {count:,}건, 합계 {total:,}원")
+    for status, (status_count, status_total) in counts.items():
+        if status_count:
+            logging.info(f"  - {status}: {status_count:,}건, {status_total:,}원")
     return True
 
-def process_all_receipts(args):
-    """Main function to orchestrate the entire receipt processing workflow."""
-    input_dir = args.input_dir
-    output_dir = args.output_dir
-    bill_limit = args.limit
+
+def scan_receipt_folder(input_dir, output_dir, image_files, manifest_key, dedupe, jobs, recorder=None):
+    """
+    Sorts out a folder's images before OCR. Returns (known, new_files, duplicates, manifest):
+    records already in the processed manifest, file names still to OCR, and
+    {duplicate: original} near-duplicates. manifest_key None disables the manifest.
+    With a recorder (--record), known images not yet in its corpus are OCRed again.
+    """
+    manifest = None
+    if manifest_key is not None:
+        manifest = Manifest(os.path.join(output_dir, config.MANIFEST_NAME), manifest_key)
+
+    # Near-duplicates are never OCRed; they reuse the fields of the copy they match
+    duplicates = {}
+    unique_files = image_files
+    if dedupe:
+        with METRICS.stage('dedupe'):
+            duplicates = find_duplicate_receipts(input_dir, image_files, jobs, manifest)
+        unique_files = [filename for filename in image_files if filename not in duplicates]
+        logging.info(f"  - 중복 이미지: {len(duplicates)}개")
+
+    # Images already in the manifest are matched by a stat() alone; only new ones enter the pipeline
+    known, new_files = [], unique_files
+    if manifest is not None:
+        known, new_files = split_known_receipts(input_dir, unique_files, manifest)
+        logging.info(f"  - 이미 처리된 이미지: {len(known)}개, 새 이미지: {len(new_files)}개")
+        if recorder is not None:
+            # The manifest keeps no OCR text, so unrecorded known images go through the pipeline
+            # again (normally answered by the OCR cache) to be added to the corpus
+            unrecorded = {record.filename for record in known
+                          if manifest.content_hash(os.path.join(input_dir, record.filename)) not in recorder}
+            if unrecorded:
+                known = [record for record in known if record.filename not in unrecorded]
+                pending = unrecorded.union(new_files)
+                new_files = [filename for filename in unique_files if filename in pending]
+                logging.info(f"  - 말뭉치에 없는 처리된 이미지 {len(unrecorded)}개를 다시 인식합니다 (--record)")
+    return known, new_files, duplicates, manifest
+
+
+def finish_receipts(args, folder, image_files, scan, records, offenders, backup_dir=config.BACKUP_DIR,
+                    run_id=None):
+    """
+    Everything after OCR for one folder: validation, sorting, knapsack, renames, the ledger
+    and the CSV. records/offenders are the newly extracted ones from extract_all_receipts;
+    scan is what scan_receipt_folder returned. Returns a FolderSummary.
+    """
+    input_dir, output_dir, bill_limit = folder
+    known, _, duplicates, manifest = scan
     do_rename = not args.no_rename and config.RENAME_FILES
     do_backup = not args.no_backup and config.BACKUP_ORIGINAL
     dry_run = args.dry_run
+    time_budget = args.time_budget if args.time_budget > 0 else None
+    dedupe = args.dedupe or config.DEDUPE
 
-    os.makedirs(output_dir, exist_ok=True)
+    def summary(status, included=(), excluded=(), duplicate_records=(), best_sum=0):
+        return FolderSummary(input_dir, output_dir, bill_limit, len(image_files), len(included), len(excluded),
+                             len(duplicate_records), best_sum, status)
 
-    if dry_run:
+    duplicates, recovered = recognize_orphaned_duplicates(input_dir, duplicates, records + known,
+                                                          build_ocr_options(args))
+    records = records + recovered
+    offenders += [(record.filename, record.amount) for record in recovered if not is_valid_amount(record.amount)]
+
+    if manifest is not None:
+        for record in records:
+            manifest.add(os.path.join(input_dir, record.filename),
+                         (record.receipt_type, record.date, record.time, record.amount))
+        if not dry_run:
+            manifest.save()
+
+    offenders += [(record.filename, record.amount) for record in known if not is_valid_amount(record.amount)]
+    # Back to directory order, so ties in the date sort below don't depend on what was new
+    position = {filename: idx for idx, filename in enumerate(image_files)}
+    records = sorted(records + known, key=lambda record: position[record.filename])
+    if offenders:
+        report_invalid_amounts(offenders, aborted=args.fail_fast)
+        return summary(FOLDER_INVALID_AMOUNTS)
+    logging.info("--- 1.5. 금액 검증 완료 ---")
+    logging.info("  - 모든 금액이 정상 범위 내에 있습니다. 다음 단계를 계속 진행합니다.")
+
+    logging.info("--- 2. 데이터 정렬 ---")
+    records.sort(key=ReceiptRecord.sort_key)
+    duplicate_records = make_duplicate_records(records, duplicates)
+
+    logging.info("--- 3. 최적 합계 계산 (Knapsack) ---")
+    alternatives, table = [], None
+    if args.periods:
+        best_sum = allocate_periods(records, args.periods, time_budget)
+    else:
+        try:
+            best_sum, alternatives, table = select_receipts(
+                records, bill_limit, time_budget, args.alternatives, args.must_include, args.must_exclude,
+                os.path.join(output_dir, config.KNAPSACK_TABLE_NAME)
+            )
+        except ValueError as e:
+            logging.error(f"!!! {e}")
+            return summary(FOLDER_FAILED)
+    # Split into included (period by period, each in date order) and excluded lists
+    included = sorted((record for record in records if not record.excluded), key=lambda record: record.period or 0)
+    excluded = [record for record in records if record.excluded]
+
+    logging.info("--- 4. 포함 항목 번호 매기기 및 파일 이름 변경 ---")
+    # Number only included items (1, 2, 3..., restarting in every period); excluded items keep
+    # no number and their original filename
+    numbers = {}
+    for record in included:
+        record.no = numbers[record.period] = numbers.get(record.period, 0) + 1
+
+    # Rename only included files
+    journal_path = os.path.join(output_dir, config.RENAME_JOURNAL_NAME)
+    try:
+        rename_receipt_files(included, input_dir, journal_path, do_rename, do_backup, dry_run,
+                             excluded + duplicate_records, backup_dir)
+    except FileExistsError as e:
+        logging.error(f"!!! 파일 이름 변경을 중단합니다: {e}")
+        return summary(FOLDER_RENAME_CONFLICT, included, excluded, duplicate_records, best_sum)
+
+    logging.info("--- 5. 최종 결과 생성 ---")
+
+    # Included first, then excluded, then duplicates at the bottom
+    output_path = os.path.join(output_dir, config.FINAL_CSV_NAME)
+    if not dry_run:
+        final = included + excluded + duplicate_records
+        if not args.no_ledger and config.USE_LEDGER:
+            # The CSV is a view of the rows just appended to the ledger
+            with METRICS.stage('ledger_write'):
+                rows = append_to_ledger(args, folder, final, manifest, best_sum, run_id or new_run_id())
+            final = [ReceiptRecord.from_ledger_row(row) for row in rows]
+        with METRICS.stage('csv_write'):
+            write_summary_csv(final, output_path, with_duplicates=dedupe, with_periods=bool(args.periods))
+        METRICS.add('bytes_written', os.path.getsize(output_path))
+        if alternatives:
+            alternatives_path = os.path.join(output_dir, config.ALTERNATIVES_CSV_NAME)
+            write_alternatives_csv(alternatives, included, alternatives_path)
+            logging.info(f"  - 차선 조합: {alternatives_path}")
+        if table is not None and table.nbytes <= config.KNAPSACK_TABLE_MAX_SAVE_MB * 1024 * 1024:
+            with METRICS.stage('knapsack_table_save'):
+                table.save(os.path.join(output_dir, config.KNAPSACK_TABLE_NAME))
+
+    logging.info(f"\n>>> 작업 완료! 최종 결과가 다음 파일에 저장되었습니다:")
+    logging.info(f">>> {output_path}")
+    return summary(FOLDER_DONE, included, excluded, duplicate_records, best_sum)
+
+
+def append_to_ledger(args, folder, records, manifest, best_sum, run_id):
+    """
+    Appends the folder's finished records (in CSV order) and the run to the ledger in the
+    output directory. Returns the ledger rows.
+    """
+    input_dir, output_dir, bill_limit = folder
+    rows = []
+    for seq, record in enumerate(records):
+        path = os.path.join(input_dir, record.filename)
+        # Files recognized through the manifest are not read again
+        sha = manifest.content_hash(path) if manifest is not None else None
+        if sha is None:
+            try:
+                sha = hash_image_file(path)
+            except OSError as e:
+                logging.warning(f"  - {record.filename} 의 해시를 계산할 수 없습니다: {e}")
+        if args.periods:
+            limit = args.periods[record.period - 1].limit if record.period else None
+        else:
+            limit = bill_limit
+        rows.append(ledger_row(record, run_id, seq, sha, input_dir, limit))
+
+    ledger_dir = os.path.join(output_dir, config.LEDGER_DIR_NAME)
+    counts = {status: sum(row['status'] == status for row in rows) for status in STATUSES}
+    append_run(ledger_dir, {
+        'run': run_id,
+        'finished': datetime.now().isoformat(timespec='seconds'),
+        'input_dir': os.path.abspath(input_dir),
+        'limit': None if args.periods else bill_limit,
+        'periods': [list(period) for period in args.periods] if args.periods else None,
+        'best_sum': best_sum,
+        **counts,
+    }, rows)
+    logging.info(f"  - 영수증 원장에 {len(rows)}행 추가: {ledger_dir}")
+    return rows
+
+
+def select_receipts(records, bill_limit, time_budget, alternatives=0, must_include=(), must_exclude=(),
+                    table_path=None):
+    """
+    Solves the knapsack over the sorted records, with the --must-include/--must-exclude
+    files forced in and out, and sets record.excluded. With alternatives > 0 the solve keeps
+    its DP table (KnapsackTable) and also reads the runner-up selections and the Pareto front
+    of (sum, receipt count) from it, as [(rank, total, records, on_front)] with rank '' for
+    selections only on the front.
+
+    A table saved at table_path by an earlier run over the same amounts and limit is reused:
+    only the rows from the first receipt whose constraint changed are recomputed, so
+    rejecting a receipt after an --alternatives run doesn't solve again from scratch.
+    Returns (best sum, alternatives, the table to save or None); raises ValueError for
+    unknown files or forced receipts over the limit.
+    """
+    # Items are identified by their 1-based position in the sorted list
+    item_ids = list(range(1, 1 + len(records)))
+    amounts = [record.amount for record in records]
+    by_filename = {record.filename: item_id for item_id, record in zip(item_ids, records)}
+    unknown = [filename for filename in must_include + must_exclude if filename not in by_filename]
+    if unknown:
+        raise ValueError(f"--must-include/--must-exclude 의 파일이 입력 디렉토리에 없습니다: {', '.join(unknown)}")
+    include = {by_filename[filename] for filename in must_include}
+    exclude = {by_filename[filename] for filename in must_exclude}
+    forced = sum(amounts[item_id - 1] for item_id in include)
+    if forced > bill_limit:
+        raise ValueError(f"반드시 포함할 영수증의 합계({forced:,}원)가 한도({bill_limit:,}원)를 넘습니다")
+    if include or exclude:
+        logging.info(f"  - 반드시 포함: {len(include)}개, 반드시 제외: {len(exclude)}개")
+
+    ranked, front, table = [], [], None
+    if (alternatives > 0 or include or exclude) and table_path is not None:
+        with METRICS.stage('knapsack_table'):
+            table = KnapsackTable.load(table_path, amounts, item_ids, bill_limit)
+            if table is not None:
+                table = table.constrain(include, exclude)
+                logging.info(f"  - 저장된 계산 표에서 바뀐 조건만 다시 계산: {table_path}")
+    if table is None and alternatives > 0:
+        if knapsack_table_bytes(amounts, bill_limit) > DP_MAX_TABLE_BYTES:
+            logging.warning("  - 계산 표가 너무 커서 차선 조합을 찾지 않습니다")
+        else:
+            with METRICS.stage('knapsack_table'):
+                table = KnapsackTable(amounts, item_ids, bill_limit, include, exclude)
+    if table is not None:
+        with METRICS.stage('knapsack_table'):
+            ranked = table.top(alternatives + 1)
+            front = table.pareto() if alternatives > 0 else []
+        best_sum, included_ids = ranked[0].total, set(ranked[0].item_ids)
+        if alternatives > 0:
+            logging.info(f"  - 계산 방식: table, 차선 조합: {len(ranked) - 1}개, 파레토 조합: {len(front)}개")
+        else:
+            logging.info("  - 계산 방식: table")
+    else:
+        if include or exclude:
+            result = solve_knapsack_constrained(amounts, item_ids, bill_limit, include, exclude, time_budget)
+        else:
+            result = solve_knapsack_auto(amounts, item_ids, bill_limit, time_budget)
+        best_sum, included_ids = result.best_sum, set(result.included_ids)
+        logging.info(f"  - 계산 방식: {result.method}, 최적해 여부: {'예' if result.optimal else '아니오 (시간 제한 도달)'}")
+    logging.info(f"  - 최적 합계: {best_sum:,}원")
+    logging.info(f"  - 제외될 항목: {len(records) - len(included_ids)}개")
+
+    # Mark excluded items
+    for item_id, record in zip(item_ids, records):
+        record.excluded = item_id not in included_ids
+
+    # The applied selection is rank 1; front selections matching a ranked (sum, count) aren't repeated
+    by_id = dict(zip(item_ids, records))
+    front_points = {(selection.total, len(selection.item_ids)) for selection in front}
+    ranked_points = {(selection.total, len(selection.item_ids)) for selection in ranked}
+    rows = [(rank, selection.total, [by_id[item_id] for item_id in selection.item_ids],
+             (selection.total, len(selection.item_ids)) in front_points)
+            for rank, selection in enumerate(ranked, 1)]
+    rows += [('', selection.total, [by_id[item_id] for item_id in selection.item_ids], True)
+             for selection in front if (selection.total, len(selection.item_ids)) not in ranked_points]
+    return best_sum, rows if alternatives > 0 else [], table
+
+
+def allocate_periods(records, periods, time_budget):
+    """
+    Spreads the sorted records over the --period budgets in one solve, each receipt only
+    into periods whose window covers its date. Sets record.period (1-based) and
+    record.excluded; returns the total claimed.
+    """
+    eligible = [eligible_periods(record.date, periods) for record in records]
+    result = solve_knapsack_periods([record.amount for record in records], list(range(len(records))),
+                                    [period.limit for period in periods], eligible, time_budget)
+    for record in records:
+        record.excluded = True
+    for period_no, ids in enumerate(result.period_ids, 1):
+        for idx in ids:
+            records[idx].period = period_no
+            records[idx].excluded = False
+
+    logging.info(f"  - 계산 방식: 기간 {len(periods)}개 배분, 최적해 여부: {'예' if result.optimal else '아니오 (시간 제한 도달)'}")
+    for period_no, (period, period_sum, ids) in enumerate(zip(periods, result.period_sums, result.period_ids), 1):
+        logging.info(f"  - 기간 {period_no} ({describe_period(period)}): {period_sum:,}원 / 한도 {period.limit:,}원, "
+                     f"{len(ids)}개")
+    logging.info(f"  - 최적 합계: {result.best_sum:,}원")
+    logging.info(f"  - 제외될 항목: {sum(record.excluded for record in records)}개")
+    unplaceable = sum(not allowed for allowed in eligible)
+    if unplaceable:
+        logging.warning(f"  - 날짜가 어느 기간에도 속하지 않는 영수증: {unplaceable}개 (제외됨)")
+    return result.best_sum
+
+
+def process_all_receipts(args):
+    """
+    Main function to orchestrate the entire receipt processing workflow.
+    Returns False if invalid amounts or a rename conflict stopped the run.
+    """
+    folder = BatchFolder(args.input_dir, args.output_dir, args.limit)
+    jobs = max(1, args.jobs)
+    dedupe = args.dedupe or config.DEDUPE
+    options = build_ocr_options(args)
+    configure_ocr(args)
+
+    os.makedirs(folder.output_dir, exist_ok=True)
+
+    if args.dry_run:
         logging.info(">>> [DRY-RUN 모드] 실제 파일 변경 없이 시뮬레이션합니다.")
 
     logging.info("--- 1. 영수증 정보 추출 시작 ---")
-    logging.info(f"  - 입력 디렉토리: {input_dir}")
-    logging.info(f"  - 출력 디렉토리: {output_dir}")
-    logging.info(f"  - 한도 금액: {bill_limit:,}원")
+    logging.info(f"  - 입력 디렉토리: {folder.input_dir}")
+    logging.info(f"  - 출력 디렉토리: {folder.output_dir}")
+    if args.periods:
+        for period_no, period in enumerate(args.periods, 1):
+            logging.info(f"  - 기간 {period_no} 한도 금액: {period.limit:,}원 ({describe_period(period)})")
+    else:
+        logging.info(f"  - 한도 금액: {folder.limit:,}원")
 
-    image_files = [f for f in os.listdir(input_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    image_files = list_image_files(folder.input_dir)
 
     if not image_files:
-        logging.warning(f"{input_dir} 에서 이미지 파일을 찾을 수 없습니다.")
-        return
+        logging.warning(f"{folder.input_dir} 에서 이미지 파일을 찾을 수 없습니다.")
+        return True
 
     logging.info(f"  - 발견된 이미지: {len(image_files)}개")
+    logging.info(f"  - OCR 작업 수: {jobs}")
+    if args.memory_budget > 0:
+        logging.info(f"  - 디코딩 메모리 한도: {args.memory_budget}MB")
 
-    all_receipt_data = []
-    for filename in image_files:
-        image_path = os.path.join(input_dir, filename)
-        logging.info(f"  - 처리 중: {filename}")
-        text = extract_text_from_image(image_path)
-        if not text:
-            continue
+    cache, manifest_key = open_ocr_cache(args, options, folder.output_dir)
+    recorder = open_corpus_writer(args)
+    try:
+        scan = scan_receipt_folder(folder.input_dir, folder.output_dir, image_files, manifest_key, dedupe, jobs,
+                                   recorder)
+        records, offenders = extract_all_receipts(
+            folder.input_dir, scan[1], options, jobs, cache, args.fail_fast, recorder=recorder
+        )
+    finally:
+        if cache is not None:
+            cache.close()
+        close_corpus_writer(recorder)
 
-        receipt_type = classify_receipt(text)
-        date = find_date(text)
-        time = find_time(text)
-        amount = find_amount(text, receipt_type)
-        all_receipt_data.append([filename, date, time, amount, receipt_type])
-        logging.debug(f"    날짜: {date}, 시간: {time}, 금액: {amount}, 유형: {receipt_type}")
+    return finish_receipts(args, folder, image_files, scan, records, offenders).status == FOLDER_DONE
 
-    df = pd.DataFrame(all_receipt_data, columns=['Filename', 'Date', 'Time', 'Amount', 'Type'])
-    df['Amount'] = pd.to_numeric(df['Amount'], errors='coerce').fillna(0).astype(int)
 
-    if not validate_amounts(df):
-        sys.exit(1)
+def process_batch(args):
+    """
+    Batch mode: the images of all folders go through one OCR pipeline and cache, and each
+    folder is finished (knapsack, renames, CSV) as soon as its last image is recognized,
+    while OCR continues on the others. Returns one FolderSummary per folder, or None if the
+    batch manifest could not be read.
+    """
+    try:
+        folders = batch_folders(args.input_dirs, args.manifest, args.output_dir, args.limit)
+    except (OSError, ValueError) as e:
+        logging.error(f"!!! 배치 목록을 읽을 수 없습니다: {e}")
+        return None
+    jobs = max(1, args.jobs)
+    dedupe = args.dedupe or config.DEDUPE
+    options = build_ocr_options(args)
+    configure_ocr(args)
 
-    logging.info("--- 2. 데이터 정렬 ---")
-    # Create DateTime column for proper sorting
-    df['DateTime'] = df['Date'] + ' ' + df['Time']
-    df.sort_values(by='DateTime', inplace=True)
-    df.reset_index(drop=True, inplace=True)
-    # Temporary index for knapsack calculation
-    df.insert(0, 'TempIdx', range(1, 1 + len(df)))
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.dry_run:
+        logging.info(">>> [DRY-RUN 모드] 실제 파일 변경 없이 시뮬레이션합니다.")
+    logging.info(f"--- 배치 처리 시작: 폴더 {len(folders)}개 ---")
+    logging.info(f"  - OCR 작업 수: {jobs}")
+    if args.memory_budget > 0:
+        logging.info(f"  - 디코딩 메모리 한도: {args.memory_budget}MB")
 
-    logging.info("--- 3. 최적 합계 계산 (Knapsack) ---")
-    calc_df = df[['TempIdx', 'Amount']].copy()
-    calc_df.rename(columns={'TempIdx': 'Item'}, inplace=True)
+    summaries = [None] * len(folders)
+    run_id = new_run_id()  # one run in every folder's ledger
+    pending = {}   # folder index -> state of a folder whose images are still being OCRed
+    work = []      # (folder index, file name) of every image to OCR, across folders
 
-    best_sum, included_ids = solve_knapsack(calc_df, bill_limit)
-    all_ids = set(df['TempIdx'].tolist())
-    excluded_ids = all_ids - set(included_ids)
+    def finish(idx):
+        folder, state = folders[idx], pending.pop(idx)
+        logging.info(f"--- [{idx + 1}/{len(folders)}] {folder.input_dir} 결과 처리 ---")
+        position = {filename: i for i, filename in enumerate(state['image_files'])}
+        offenders = sorted(state['offenders'], key=lambda offender: position[offender[0]])
+        backup_dir = os.path.join(folder.output_dir, os.path.basename(os.path.normpath(config.BACKUP_DIR)))
+        try:
+            summaries[idx] = finish_receipts(args, folder, state['image_files'], state['scan'],
+                                             state['records'], offenders, backup_dir, run_id)
+        except Exception:
+            logging.exception(f"!!! {folder.input_dir} 처리 중 오류가 발생했습니다.")
+            summaries[idx] = FolderSummary(*folder, len(state['image_files']), 0, 0, 0, 0, FOLDER_FAILED)
 
-    logging.info(f"  - 최적 합계: {best_sum:,}원")
-    logging.info(f"  - 제외될 항목: {len(excluded_ids)}개")
+    cache, manifest_key = open_ocr_cache(args, options, args.output_dir)
+    recorder = open_corpus_writer(args)
+    try:
+        for idx, folder in enumerate(folders):
+            logging.info(f"--- [{idx + 1}/{len(folders)}] {folder.input_dir} → {folder.output_dir} "
+                         f"(한도 {folder.limit:,}원) ---")
+            try:
+                image_files = list_image_files(folder.input_dir)
+                if not image_files:
+                    logging.warning(f"{folder.input_dir} 에서 이미지 파일을 찾을 수 없습니다.")
+                    summaries[idx] = FolderSummary(*folder, 0, 0, 0, 0, 0, FOLDER_EMPTY)
+                    continue
+                logging.info(f"  - 발견된 이미지: {len(image_files)}개")
+                os.makedirs(folder.output_dir, exist_ok=True)
+                scan = scan_receipt_folder(folder.input_dir, folder.output_dir, image_files,
+                                           manifest_key, dedupe, jobs, recorder)
+            except OSError as e:
+                logging.error(f"!!! {folder.input_dir} 을(를) 읽을 수 없습니다: {e}")
+                summaries[idx] = FolderSummary(*folder, 0, 0, 0, 0, 0, FOLDER_FAILED)
+                continue
+            new_files = scan[1]
+            pending[idx] = {'image_files': image_files, 'scan': scan, 'records': [], 'offenders': [],
+                            'remaining': len(new_files)}
+            work += [(idx, filename) for filename in new_files]
 
-    # Mark excluded items
-    df['제외유무'] = df['TempIdx'].apply(lambda x: 'Y' if x in excluded_ids else 'N')
+        logging.info(f"--- 영수증 정보 추출: 폴더 {len(pending)}개, 새 이미지 {len(work)}개 ---")
+        # Folders with nothing new to OCR don't wait for the others
+        for idx in [idx for idx, state in pending.items() if state['remaining'] == 0]:
+            finish(idx)
 
-    # Split into included and excluded DataFrames
-    df_included = df[df['제외유무'] == 'N'].copy()
-    df_excluded = df[df['제외유무'] == 'Y'].copy()
+        cache_hits = 0
+        paths = [os.path.join(folders[idx].input_dir, filename) for idx, filename in work]
+        stream = stream_receipts("", paths, options, jobs, cache, config.PIPELINE_QUEUE_DEPTH)
+        try:
+            for index, _, result, from_cache, sha256 in stream:
+                cache_hits += from_cache
+                idx, filename = work[index]
+                state = pending[idx]
+                if result is not None:
+                    if recorder is not None:
+                        recorder.record(paths[index], filename, *result, sha256)
+                    record = make_receipt_record(filename, result[1])
+                    state['records'].append(record)
+                    if not is_valid_amount(record.amount):
+                        state['offenders'].append((filename, record.amount))
+                state['remaining'] -= 1
+                if state['remaining'] == 0:
+                    finish(idx)
+        finally:
+            stream.close()
+        if cache is not None:
+            logging.info(f"  - OCR 캐시 적중: {cache_hits}개")
+    finally:
+        if cache is not None:
+            cache.close()
+        close_corpus_writer(recorder)
 
-    logging.info("--- 4. 포함 항목 번호 매기기 및 파일 이름 변경 ---")
-    # Number only included items (1, 2, 3...)
-    df_included['No.'] = range(1, 1 + len(df_included))
+    report_batch(args, summaries)
+    return summaries
 
-    # Rename only included files
-    df_included = rename_receipt_files(df_included, input_dir, do_rename, do_backup, dry_run)
 
-    # Excluded items: no number, keep original filename
-    df_excluded['No.'] = ''
+def report_batch(args, summaries):
+    """Logs the per-folder outcome and writes the combined summary CSV."""
+    labels = {
+        FOLDER_DONE: "완료", FOLDER_EMPTY: "이미지 없음", FOLDER_INVALID_AMOUNTS: "비정상 금액",
+        FOLDER_RENAME_CONFLICT: "이름 변경 충돌", FOLDER_FAILED: "오류",
+    }
+    logging.info("--- 배치 처리 결과 ---")
+    for summary in summaries:
+        logging.info(f"  - {summary.input_dir}: 이미지 {summary.images}개, 포함 {summary.included}개, "
+                     f"제외 {summary.excluded}개, 최적 합계 {summary.best_sum:,}원 / 한도 {summary.limit:,}원 "
+                     f"[{labels[summary.status]}]")
+    succeeded = sum(summary.status in (FOLDER_DONE, FOLDER_EMPTY) for summary in summaries)
+    logging.info(f"  - 성공 {succeeded}개, 실패 {len(summaries) - succeeded}개")
+    if not args.dry_run:
+        summary_path = os.path.join(args.output_dir, config.BATCH_SUMMARY_NAME)
+        write_batch_summary(summaries, summary_path)
+        logging.info(f">>> 배치 결과 요약: {summary_path}")
 
-    # Combine: included first, then excluded at bottom
-    df = pd.concat([df_included, df_excluded], ignore_index=True)
 
-    # Drop temporary columns
-    df.drop(columns=['TempIdx', 'DateTime'], inplace=True)
+def serve_receipts(args):
+    """Runs the local HTTP service until Ctrl+C, with warm OCR workers and the OCR cache in the output directory."""
+    # http.server pulls in the email package; only the serve command pays for that import
+    from src.server import ReceiptService, make_server
+    jobs = max(1, args.jobs)
+    options = build_ocr_options(args)
+    configure_ocr(args)
+    os.makedirs(args.output_dir, exist_ok=True)
 
-    # Reorder columns: No. first
-    cols = ['No.', 'Filename', 'Date', 'Time', 'Amount', 'Type', '제외유무']
-    df = df[cols]
+    logging.info("--- 로컬 HTTP 서비스 시작 ---")
+    logging.info(f"  - OCR 작업 수: {jobs}, 대기열 크기: {args.queue_depth}")
+    if args.path_root:
+        logging.info(f"  - 경로 요청 허용 디렉토리: {os.path.realpath(args.path_root)}")
+    # Probe tesseract now, so the first request doesn't pay for it
+    logging.info(f"  - OCR 설정: {ocr_settings_key(ocr_options_key(options))}")
+    # Likewise load the knapsack solver's numpy before the first /knapsack request
+    solve_knapsack_auto([1], [0], 1)
+    cache, _ = open_ocr_cache(args, options, args.output_dir)
+    service = ReceiptService(options, jobs, cache, args.queue_depth)
+    # A request thread must not solve forever, so the service ignores "0 = unlimited"
+    time_budget = config.SERVE_KNAPSACK_MAX_SECONDS
+    if args.time_budget > 0:
+        time_budget = min(args.time_budget, time_budget)
+    try:
+        server = make_server(service, args.host, args.port, config.SERVE_MAX_UPLOAD_MB * 1024 * 1024, time_budget,
+                             knapsack_slots=config.SERVE_KNAPSACK_SLOTS, path_root=args.path_root,
+                             knapsack_max_items=config.SERVE_KNAPSACK_MAX_ITEMS,
+                             knapsack_max_limit=config.SERVE_KNAPSACK_MAX_LIMIT)
+    except OSError as e:
+        logging.error(f"!!! {args.host}:{args.port} 에서 서비스를 시작할 수 없습니다: {e}")
+        service.close()
+        if cache is not None:
+            cache.close()
+        return False
+    logging.info(f">>> http://{args.host}:{server.server_address[1]} 에서 요청을 기다립니다 (종료: Ctrl+C)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info(">>> 서비스를 종료합니다.")
+    finally:
+        server.server_close()
+        service.close()
+        if cache is not None:
+            cache.close()
+    return True
 
-    logging.info("--- 5. 최종 결과 생성 ---")
 
-    # Convert date format to Korean style (1월 6일) for report
-    df['Date'] = pd.to_datetime(df['Date']).apply(lambda x: f"{x.month}월 {x.day}일")
+def find_duplicate_receipts(input_dir, image_files, jobs, manifest=None):
+    """Returns {duplicate file name: original file name} for near-duplicate images in image_files."""
+    paths = [os.path.join(input_dir, filename) for filename in image_files]
 
-    output_path = os.path.join(output_dir, config.FINAL_CSV_NAME)
-    if not dry_run:
-        df.to_csv(output_path, index=False, encoding='utf-8-sig')
+    def original_first(path):
+        # On a rerun the copy an earlier run numbered (or at least processed) stays the original
+        numbered = NUMBERED_NAME.fullmatch(os.path.basename(path)) is not None
+        known = manifest is not None and manifest.content_hash(path) is not None
+        return not numbered, not known, path
 
-    logging.info(f"\n>>> 작업 완료! 최종 결과가 다음 파일에 저장되었습니다:")
-    logging.info(f">>> {output_path}")
+    found = find_duplicates(paths, config.DEDUPE_MAX_DISTANCE, config.DEDUPE_TOLERANCE, jobs, manifest,
+                            original_first)
+    duplicates = {}
+    for duplicate_path, original_path in found.items():
+        duplicate, original = os.path.basename(duplicate_path), os.path.basename(original_path)
+        logging.info(f"  - 중복 이미지: {duplicate} (원본: {original})")
+        duplicates[duplicate] = original
+    return duplicates
+
+
+def recognize_orphaned_duplicates(input_dir, duplicates, records, options):
+    """
+    OCRs the duplicates whose original produced no record (its OCR found no text), so the
+    receipt isn't lost with it. Returns (the remaining {duplicate: original}, new records).
+    """
+    filenames = {record.filename for record in records}
+    orphans = sorted(duplicate for duplicate, original in duplicates.items() if original not in filenames)
+    if not orphans:
+        return duplicates, []
+    logging.warning(f"  - 원본을 인식하지 못한 중복 이미지 {len(orphans)}개를 직접 인식합니다: {', '.join(orphans)}")
+    recovered = []
+    for filename in orphans:
+        result = recognize_receipts([os.path.join(input_dir, filename)], options)[0]
+        if result is not None:
+            recovered.append(make_receipt_record(filename, result[1]))
+    return {duplicate: original for duplicate, original in duplicates.items() if duplicate not in orphans}, recovered
+
+
+def make_duplicate_records(records, duplicates):
+    """Excluded records for the duplicate files, copying the fields of their originals, in date order."""
+    by_filename = {record.filename: record for record in records}
+    duplicate_records = [
+        ReceiptRecord.duplicate(duplicate, by_filename[original])
+        for duplicate, original in duplicates.items() if original in by_filename
+    ]
+    duplicate_records.sort(key=ReceiptRecord.sort_key)
+    return duplicate_records
+
+
+def split_known_receipts(input_dir, image_files, manifest):
+    """Splits image_files into records already in the manifest and file names still to be OCRed."""
+    known, new_files = [], []
+    for filename in image_files:
+        fields = manifest.lookup(os.path.join(input_dir, filename))
+        if fields is None:
+            new_files.append(filename)
+            continue
+        receipt_type, date, time, amount = fields
+        known.append(ReceiptRecord(filename, date, time, amount, receipt_type))
+    return known, new_files
+
+
+def watch_receipts(args):
+    """Processes the input directory, then again whenever receipt images are added, changed or removed."""
+    watcher = open_watcher(args.input_dir, config.WATCH_POLL_INTERVAL, config.WATCH_USE_INOTIFY)
+    logging.info(f">>> 감시 모드: {args.input_dir} ({type(watcher).__name__}, 종료: Ctrl+C)")
+    processed = None
+    try:
+        while True:
+            snapshot = directory_snapshot(args.input_dir)
+            if snapshot != processed:
+                if processed is not None:
+                    snapshot = wait_until_settled(args.input_dir, snapshot, config.WATCH_DEBOUNCE)
+                start = time.perf_counter()
+                if not run_with_metrics(args):
+                    logging.error(">>> 문제가 된 파일이 수정되거나 교체되면 다시 처리합니다.")
+                # Renames keep inode, size and mtime, so the snapshot is unaffected by them
+                processed = snapshot
+                logging.info(f">>> 처리 시간: {time.perf_counter() - start:.2f}초. 새 영수증을 기다립니다...")
+            watcher.wait()
+    except KeyboardInterrupt:
+        logging.info(">>> 감시 모드를 종료합니다.")
+    finally:
+        watcher.close()
+
+
+def start_profiler():
+    """
+    Starts cProfile for every thread, including the OCR workers and the asyncio thread.
+    Where cProfile is built on sys.monitoring (Python 3.12+) one profiler already sees all
+    threads; before that each new thread gets its own profiler through threading.setprofile.
+    Returns the list of profilers, to be passed to stop_profiler.
+    """
+    import cProfile
+    import threading
+    profilers = [cProfile.Profile()]
+    if not hasattr(sys, 'monitoring'):
+        def profile_thread(*_):
+            profiler = cProfile.Profile()
+            profilers.append(profiler)
+            profiler.enable()
+        threading.setprofile(profile_thread)
+    profilers[0].enable()
+    return profilers
+
+
+def stop_profiler(profilers, path):
+    """Stops the profilers from start_profiler and writes their merged stats to path."""
+    import pstats
+    import threading
+    threading.setprofile(None)
+    profilers[0].disable()
+    pstats.Stats(*profilers).dump_stats(path)
+
+
+def run_with_metrics(args, run=process_all_receipts):
+    """Runs `run` (process_all_receipts), writing the --metrics report and --profile stats if requested. Returns its result."""
+    METRICS.enabled = bool(args.metrics or args.profile)
+    METRICS.reset()
+    profilers = start_profiler() if args.profile else None
+    try:
+        with METRICS.stage('total'):
+            return run(args)
+    finally:
+        if profilers is not None:
+            base = os.path.splitext(args.metrics)[0] if args.metrics else os.path.join(args.output_dir, "metrics")
+            profile_path = base + ".prof"
+            stop_profiler(profilers, profile_path)
+            logging.info(f">>> cProfile 통계: {profile_path} (python -m pstats {profile_path})")
+        if args.metrics:
+            report = METRICS.write(args.metrics)
+            logging.info(f">>> 성능 지표: {args.metrics}")
+            for name, summary in sorted(report['stages'].items()):
+                wall = summary['wall']
+                logging.debug(f"    {name}: n={wall['count']}, 합계={wall['total']:.3f}s, p50={wall['p50']:.3f}s, p95={wall['p95']:.3f}s")
 
 
 def main():
     """Entry point for the CLI."""
     args = parse_args()
     setup_logging(verbose=args.verbose, quiet=args.quiet)
-    process_all_receipts(args)
+    if args.resume or args.rollback:
+        recover_renames(args)
+        return
+    if args.watch:
+        watch_receipts(args)
+        return
+    if args.command == "serve":
+        if not serve_receipts(args):
+            sys.exit(1)
+        return
+    if args.command == "replay":
+        if not replay_receipts(args):
+            sys.exit(1)
+        return
+    if args.command == "query":
+        if not query_receipts(args):
+            sys.exit(1)
+        return
+    try:
+        if args.command == "batch":
+            summaries = run_with_metrics(args, process_batch)
+            succeeded = summaries is not None and all(
+                summary.status in (FOLDER_DONE, FOLDER_EMPTY) for summary in summaries
+            )
+        else:
+            succeeded = run_with_metrics(args)
+    except KeyboardInterrupt:
+        # The pipeline has stopped taking work. --async-ocr kills its tesseract children on
+        # cancellation; on the threaded path a running child ends on the terminal's own SIGINT
+        # or its OCR timeout, and subprocess.run reaps it
+        logging.error(">>> 사용자에 의해 중단되었습니다.")
+        sys.exit(130)
+    if not succeeded:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
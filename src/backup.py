@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Copy-free backups of receipt images.
+
+The tool only ever renames originals, never rewrites them, so a hardlink is a complete
+backup at the cost of one directory entry. Where links aren't possible (another
+filesystem, no link support) a reflink shares the data blocks instead, and only after
+that do we fall back to copy_file_range and finally a plain copy.
+"""
+import errno
+import logging
+import os
+import shutil
+import sys
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# ioctl(2) request that clones a whole file on btrfs/XFS/bcachefs (linux/fs.h)
+FICLONE = 0x40049409
+
+BACKUP_METHODS = ('auto', 'link', 'reflink', 'copy')
+
+
+def _link(src, dst):
+    os.link(src, dst)
+
+
+def _reflink(src, dst):
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform")
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+    shutil.copystat(src, dst)
+
+
+def _copy_file_range(src, dst):
+    """In-kernel copy; filesystems that support it turn this into a reflink as well."""
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.EOPNOTSUPP, "copy_file_range is not available")
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        remaining = os.fstat(source.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(source.fileno(), target.fileno(), remaining)
+            if copied == 0:
+                raise OSError(errno.EIO, "copy_file_range stopped early")
+            remaining -= copied
+    shutil.copystat(src, dst)
+
+
+# Strategies tried in order for each BACKUP_METHOD; a plain copy is always the last resort
+_STRATEGIES = {
+    'auto': [('link', _link), ('reflink', _reflink), ('copy_file_range', _copy_file_range)],
+    'link': [('link', _link)],
+    'reflink': [('reflink', _reflink), ('copy_file_range', _copy_file_range)],
+    'copy': [],
+}
+
+
+def backup_file(src, dst, method='auto'):
+    """
+    Backs up src to dst using the cheapest strategy the filesystem allows.
+    Returns the strategy used: 'link', 'reflink', 'copy_file_range' or 'copy'.
+    """
+    if os.path.lexists(dst):
+        if os.path.samefile(src, dst):
+            return 'link'
+        os.remove(dst)
+
+    for name, strategy in _STRATEGIES[method]:
+        try:
+            strategy(src, dst)
+            return name
+        except OSError as e:
+            logger.debug(f"Backup via {name} failed for {src}: {e}")
+            if os.path.lexists(dst):
+                os.remove(dst)
+    shutil.copy2(src, dst)
+    return 'copy'
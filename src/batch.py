@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Folders of a batch run and the combined summary report.
+
+A batch takes many receipt folders at once (one per employee or per month); their
+images share one OCR pipeline and cache, while every folder gets its own limit,
+output directory, renames and CSV. Folders come from the command line or from a
+batch manifest, a JSON list of folders:
+
+    [{"input_dir": "2026-01/kim", "output_dir": "out/kim", "limit": 50000},
+     {"input_dir": "2026-01/lee"}]
+
+input_dir is required; output_dir defaults to <output root>/<folder name> and limit to
+the command line limit. Relative paths are resolved against the manifest's directory.
+"""
+import csv
+import json
+import os
+from collections import namedtuple
+
+BatchFolder = namedtuple('BatchFolder', ['input_dir', 'output_dir', 'limit'])
+
+# Outcome of one folder; status is one of the FOLDER_* values below
+FolderSummary = namedtuple('FolderSummary', [
+    'input_dir', 'output_dir', 'limit', 'images', 'included', 'excluded', 'duplicates', 'best_sum', 'status'
+])
+FOLDER_DONE = 'done'
+FOLDER_EMPTY = 'empty'
+FOLDER_INVALID_AMOUNTS = 'invalid_amounts'
+FOLDER_RENAME_CONFLICT = 'rename_conflict'
+FOLDER_FAILED = 'failed'
+
+BATCH_SUMMARY_COLUMNS = ['입력 디렉토리', '출력 디렉토리', '한도', '이미지', '포함', '제외', '중복', '최적 합계', '상태']
+
+
+def _default_output_dir(output_root, input_dir):
+    return os.path.join(output_root, os.path.basename(os.path.normpath(input_dir)))
+
+
+def load_batch_manifest(path, output_root, default_limit):
+    """Reads a batch manifest into BatchFolders."""
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    if not isinstance(entries, list):
+        raise ValueError(f"배치 목록 {path} 은(는) 폴더 항목의 JSON 배열이어야 합니다.")
+    base = os.path.dirname(os.path.abspath(path))
+    folders = []
+    for entry in entries:
+        if not isinstance(entry, dict) or 'input_dir' not in entry:
+            raise ValueError(f"배치 목록 {path} 의 항목에 input_dir 이 없습니다: {entry!r}")
+        input_dir = os.path.join(base, entry['input_dir'])
+        output_dir = entry.get('output_dir')
+        output_dir = os.path.join(base, output_dir) if output_dir else _default_output_dir(output_root, input_dir)
+        folders.append(BatchFolder(input_dir, output_dir, int(entry.get('limit', default_limit))))
+    return folders
+
+
+def batch_folders(input_dirs, manifest_path, output_root, default_limit):
+    """
+    Folders from the command line followed by those in the batch manifest (if any).
+    Raises ValueError if two folders would share an output directory.
+    """
+    folders = [BatchFolder(input_dir, _default_output_dir(output_root, input_dir), default_limit)
+               for input_dir in input_dirs]
+    if manifest_path:
+        folders += load_batch_manifest(manifest_path, output_root, default_limit)
+    seen = {}
+    for folder in folders:
+        key = os.path.normcase(os.path.abspath(folder.output_dir))
+        if key in seen:
+            raise ValueError(
+                f"{seen[key]} 와(과) {folder.input_dir} 의 출력 디렉토리가 같습니다 ({folder.output_dir}). "
+                "배치 목록에서 output_dir 을 지정하세요."
+            )
+        seen[key] = folder.input_dir
+    return folders
+
+
+def write_batch_summary(summaries, path):
+    """Writes one row per folder (UTF-8 with BOM, like the receipt summary)."""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        writer.writerow(BATCH_SUMMARY_COLUMNS)
+        writer.writerows(list(summary) for summary in summaries)
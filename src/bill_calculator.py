@@ -1,30 +1,665 @@
-
 # -*- coding: utf-8 -*-
+import bisect
+import copy
+import heapq
+import logging
+import math
+import os
+import time
+from collections import namedtuple
+from functools import reduce
+
+from src.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Largest DP table (counts + parent bits) the dispatcher will allocate
+DP_MAX_TABLE_BYTES = 256 * 1024 * 1024
+# Meet-in-the-middle enumerates 2^(n/2) subsets per half, so it only pays off for few items
+MITM_MAX_ITEMS = 36
+# Rough ratio of DP cells per second (NumPy) to enumerated subsets per second (Python)
+_DP_CELLS_PER_SUBSET = 500
+# Up to this many periods, the allocation upper bound checks every subset of periods
+PERIOD_BOUND_MAX_PERIODS = 12
+# Search states remembered by the period allocation before the memo is reset (bounds its memory)
+PERIOD_MAX_SEEN_STATES = 500_000
+# solve_knapsack_batch only starts worker processes for at least this many distinct problems
+BATCH_POOL_MIN_PROBLEMS = 64
+
+KnapsackResult = namedtuple('KnapsackResult', ['best_sum', 'included_ids', 'optimal', 'method'])
+# period_ids[p]: item IDs assigned to period p, in input order
+PeriodResult = namedtuple('PeriodResult', ['best_sum', 'period_sums', 'period_ids', 'optimal'])
+# One selection from a KnapsackTable; item_ids in input order
+Selection = namedtuple('Selection', ['total', 'item_ids'])
+
+# KnapsackTable item constraints
+_FREE, _INCLUDE, _EXCLUDE = 0, 1, 2
+
 
-def solve_knapsack(items_df, max_limit):
+def solve_knapsack(items_df, max_limit, time_budget=None):
     """
     Solves the 0/1 knapsack problem to find the best sum of amounts.
     Returns the best sum and the list of included item IDs.
     """
-    dp = {0: []}  # Key: sum, Value: list of item IDs
+    amounts = [int(amount) for amount in items_df['Amount']]
+    item_ids = [int(item_id) for item_id in items_df['Item']]
+    result = solve_knapsack_auto(amounts, item_ids, max_limit, time_budget)
+    return result.best_sum, result.included_ids
+
+
+def _usable_items(amounts, item_ids, max_limit):
+    """Drops items that can never be part of a selection (non-positive or over the limit)."""
+    return [(int(amount), item_id) for amount, item_id in zip(amounts, item_ids)
+            if 0 < int(amount) <= max_limit]
+
+
+def choose_solver(amounts, max_limit):
+    """Picks 'dp', 'mitm' or 'bnb' from the item count, the limit and the amounts' GCD."""
+    usable = [amount for amount in amounts if 0 < amount <= max_limit]
+    if not usable:
+        return 'dp'
+    n = len(usable)
+    capacity = max_limit // reduce(math.gcd, usable)
+    dp_cells = n * (capacity + 1)
+    dp_bytes = dp_cells // 8 + 4 * (capacity + 1)
+
+    if n <= MITM_MAX_ITEMS and 2 ** ((n + 1) // 2) * _DP_CELLS_PER_SUBSET < dp_cells:
+        return 'mitm'
+    if dp_bytes <= DP_MAX_TABLE_BYTES:
+        return 'dp'
+    if n <= MITM_MAX_ITEMS:
+        return 'mitm'
+    return 'bnb'
+
+
+def solve_knapsack_auto(amounts, item_ids, max_limit, time_budget=None):
+    """
+    Dispatches to the cheapest exact solver for the problem size.
+    time_budget (seconds) bounds the branch-and-bound search, which then returns
+    the best selection found so far with optimal=False.
+    Returns a KnapsackResult.
+    """
+    method = choose_solver([int(amount) for amount in amounts], max_limit)
+    logger.debug(f"Solving knapsack for {len(amounts)} items, limit {max_limit} with '{method}'")
+    with METRICS.stage(f'knapsack_{method}'):
+        if method == 'mitm':
+            best_sum, included = solve_knapsack_mitm(amounts, item_ids, max_limit)
+            return KnapsackResult(best_sum, included, True, method)
+        if method == 'bnb':
+            best_sum, included, optimal = solve_knapsack_bnb(amounts, item_ids, max_limit, time_budget)
+            return KnapsackResult(best_sum, included, optimal, method)
+        best_sum, included = solve_knapsack_dp(amounts, item_ids, max_limit)
+        return KnapsackResult(best_sum, included, True, method)
+
+
+def _solve_problem(amounts, max_limit, time_budget):
+    """solve_knapsack_auto without the per-call logging and metrics, item IDs being positions."""
+    item_ids = range(len(amounts))
+    method = choose_solver(amounts, max_limit)
+    items = _usable_items(amounts, item_ids, max_limit)
+    total = sum(amount for amount, _ in items)
+    if total <= max_limit:
+        # Everything fits: every solver takes all usable items, in input order
+        return KnapsackResult(total, [item_id for _, item_id in items], True, method)
+    if method == 'mitm':
+        return KnapsackResult(*solve_knapsack_mitm(amounts, item_ids, max_limit), True, method)
+    if method == 'bnb':
+        return KnapsackResult(*solve_knapsack_bnb(amounts, item_ids, max_limit, time_budget), method)
+    return KnapsackResult(*solve_knapsack_dp(amounts, item_ids, max_limit), True, method)
+
+
+def _solve_problems(problems, time_budget):
+    return [_solve_problem(amounts, max_limit, time_budget) for amounts, max_limit in problems]
+
+
+def _estimated_cost(problem):
+    amounts, max_limit = problem
+    usable = [amount for amount in amounts if 0 < amount <= max_limit]
+    if not usable:
+        return 0
+    return min(len(usable) * (max_limit // reduce(math.gcd, usable) + 1),
+               2 ** ((len(usable) + 1) // 2) * _DP_CELLS_PER_SUBSET)
+
+
+def solve_knapsack_batch(groups, time_budget=None, jobs=1):
+    """
+    Solves many independent (amounts, max_limit) problems in one call, e.g. one per
+    cardholder at month-end close. Item IDs are positions in each group's amounts.
+    Returns one KnapsackResult per group, in order, equal to what
+    solve_knapsack_auto(amounts, range(len(amounts)), max_limit, time_budget) returns.
+
+    Identical groups are solved once, groups whose usable items all fit skip the solver,
+    and with jobs > 1 the rest is spread over worker processes in chunks, most
+    expensive first.
+    """
+    keys = [(tuple(int(amount) for amount in amounts), int(max_limit)) for amounts, max_limit in groups]
+    problems = list(dict.fromkeys(keys))
+    logger.debug(f"Solving {len(keys)} knapsack groups ({len(problems)} distinct) with {jobs} job(s)")
+
+    with METRICS.stage('knapsack_batch'):
+        if jobs > 1 and len(problems) >= BATCH_POOL_MIN_PROBLEMS:
+            # multiprocessing is a heavy import that a plain CLI run never needs
+            from concurrent.futures import ProcessPoolExecutor
+            problems.sort(key=_estimated_cost, reverse=True)
+            # Several chunks per worker, so one expensive chunk doesn't leave the others idle
+            size = -(-len(problems) // (jobs * 4))
+            chunks = [problems[start:start + size] for start in range(0, len(problems), size)]
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = [result for chunk in executor.map(_solve_problems, chunks, [time_budget] * len(chunks))
+                           for result in chunk]
+        else:
+            results = _solve_problems(problems, time_budget)
+
+    solved = dict(zip(problems, results))
+    # Identical groups get their own copies of the ID list
+    return [solved[key]._replace(included_ids=list(solved[key].included_ids)) for key in keys]
+
+
+def solve_knapsack_dp(amounts, item_ids, max_limit):
+    """
+    Array-backed subset-sum DP over amounts divided by their GCD.
+    Among the combinations reaching the best sum, the one with the fewest items wins.
+    Returns the best sum and the included item IDs in input order.
+    """
+    # numpy is only needed for the DP table; importing it lazily keeps CLI startup fast
+    import numpy as np
+
+    items = _usable_items(amounts, item_ids, max_limit)
+    if not items:
+        return 0, []
+
+    # Receipt amounts are nearly always multiples of 100 (or 10), which shrinks the table
+    scale = reduce(math.gcd, (amount for amount, _ in items))
+    capacity = max_limit // scale
+    weights = [amount // scale for amount, _ in items]
+
+    # counts[s]: fewest items reaching scaled sum s so far (unreachable = len(items) + 1)
+    unreachable = len(items) + 1
+    counts = np.full(capacity + 1, unreachable, dtype=np.int32)
+    counts[0] = 0
+
+    # parents[i]: packed bits over sums s >= weights[i] where item i improved counts[s]
+    parents = []
+    for weight in weights:
+        candidate = counts[:capacity + 1 - weight] + 1
+        improved = candidate < counts[weight:]
+        np.minimum(counts[weight:], candidate, out=counts[weight:])
+        parents.append(np.packbits(improved))
+
+    best_scaled = int(np.flatnonzero(counts < unreachable)[-1])
+
+    included = []
+    remaining = best_scaled
+    for idx in range(len(items) - 1, -1, -1):
+        offset = remaining - weights[idx]
+        if offset >= 0 and parents[idx][offset >> 3] & (0x80 >> (offset & 7)):
+            included.append(items[idx][1])
+            remaining = offset
+    included.reverse()
+
+    return best_scaled * scale, included
+
+
+def solve_knapsack_constrained(amounts, item_ids, max_limit, include=(), exclude=(), time_budget=None):
+    """
+    solve_knapsack_auto with the items in `include` forced into the selection and those in
+    `exclude` kept out of it: the free items are solved against what the forced ones leave
+    of the limit. Raises ValueError if the forced items alone don't fit.
+    Returns a KnapsackResult.
+    """
+    include, exclude = set(include), set(exclude)
+    forced = sum(int(amount) for amount, item_id in zip(amounts, item_ids) if item_id in include)
+    if forced > max_limit or any(int(amount) <= 0 for amount, item_id in zip(amounts, item_ids)
+                                 if item_id in include):
+        raise ValueError(f"Forced items ({forced}) can't be selected within the limit {max_limit}")
+    free = [(amount, item_id) for amount, item_id in zip(amounts, item_ids)
+            if item_id not in include and item_id not in exclude]
+    result = solve_knapsack_auto([amount for amount, _ in free], [item_id for _, item_id in free],
+                                 max_limit - forced, time_budget)
+    chosen = include | set(result.included_ids)
+    return result._replace(best_sum=result.best_sum + forced,
+                           included_ids=[item_id for item_id in item_ids if item_id in chosen])
+
+
+def _table_dtype(item_count):
+    import numpy as np
+    # Counts reach item_count + 2 (unreachable + 1) before being clamped
+    if item_count + 2 <= np.iinfo(np.uint8).max:
+        return np.uint8
+    return np.uint16 if item_count + 2 <= np.iinfo(np.uint16).max else np.int32
+
+
+def knapsack_table_bytes(amounts, max_limit):
+    """Memory a KnapsackTable over these amounts takes, to compare with DP_MAX_TABLE_BYTES."""
+    import numpy as np
+    usable = [int(amount) for amount in amounts if 0 < int(amount) <= max_limit]
+    if not usable:
+        return 0
+    capacity = max_limit // reduce(math.gcd, usable)
+    return (len(usable) + 1) * (capacity + 1) * np.dtype(_table_dtype(len(usable))).itemsize
+
+
+class KnapsackTable:
+    """
+    The fewest-items subset-sum DP of solve_knapsack_dp, keeping the counts row after every
+    item instead of only the last one. One table answers the best selection, the k best
+    distinct selections and the Pareto front of (sum, item count) without solving again;
+    constrain() forces items in or out and recomputes only the rows from the first item
+    whose constraint changed. Items are kept in input order, so constraints on late items
+    are the cheapest. save()/load() keep a table between runs.
+    """
+
+    def __init__(self, amounts, item_ids, max_limit, include=(), exclude=()):
+        import numpy as np
 
-    for _, row in items_df.iterrows():
-        amount = int(row['Amount'])
-        item_id = int(row['Item'])
-        
-        new_dp = {}
-        for current_sum, included_items in dp.items():
-            new_sum = current_sum + amount
+        self._setup(amounts, item_ids, max_limit)
+        self._modes = self._constraint_modes(include, exclude)
+
+        # _rows[i][s]: fewest of the first i items reaching scaled sum s (unreachable = n + 1)
+        first = np.full(self._capacity + 1, self._unreachable, dtype=_table_dtype(len(self._items)))
+        first[0] = 0
+        self._rows = [first]
+        self._extend(0)
+
+    def _setup(self, amounts, item_ids, max_limit):
+        self.max_limit = max_limit
+        self._amounts = [int(amount) for amount in amounts]
+        self._item_ids = list(item_ids)
+        self._items = _usable_items(amounts, item_ids, max_limit)
+        self._scale = reduce(math.gcd, (amount for amount, _ in self._items), 0) or 1
+        self._capacity = max_limit // self._scale
+        self._weights = [amount // self._scale for amount, _ in self._items]
+        self._unreachable = len(self._items) + 1
+
+    @property
+    def nbytes(self):
+        """Size of the rows as save() writes them."""
+        return sum(row.nbytes for row in self._rows)
+
+    def save(self, path):
+        """Writes the table (integer item IDs only) to an .npz file, replacing it atomically."""
+        import numpy as np
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, rows=np.stack(self._rows), amounts=np.array(self._amounts, dtype=np.int64),
+                     item_ids=np.array(self._item_ids, dtype=np.int64),
+                     modes=np.array(self._modes, dtype=np.uint8), max_limit=self.max_limit)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, amounts, item_ids, max_limit):
+        """
+        The table saved at path if it was built over exactly these amounts, item IDs and limit
+        (with whatever constraints it had), else None.
+        """
+        import numpy as np
+
+        try:
+            with np.load(path) as data:
+                if (int(data['max_limit']) != max_limit
+                        or data['amounts'].tolist() != [int(amount) for amount in amounts]
+                        or data['item_ids'].tolist() != list(item_ids)):
+                    return None
+                rows, modes = data['rows'], data['modes'].tolist()
+        except (OSError, ValueError, KeyError):
+            return None
+        table = cls.__new__(cls)
+        table._setup(amounts, item_ids, max_limit)
+        if rows.shape != (len(table._items) + 1, table._capacity + 1):
+            return None
+        table._modes = modes
+        table._rows = list(rows)
+        return table
+
+    def _constraint_modes(self, include, exclude):
+        include, exclude = set(include), set(exclude)
+        usable = {item_id for _, item_id in self._items}
+        if include - usable:
+            raise ValueError(f"Items {sorted(include - usable)} can never be selected within {self.max_limit}")
+        forced = sum(amount for amount, item_id in self._items if item_id in include)
+        if forced > self.max_limit:
+            raise ValueError(f"Forced items ({forced}) exceed the limit {self.max_limit}")
+        return [_INCLUDE if item_id in include else _EXCLUDE if item_id in exclude else _FREE
+                for _, item_id in self._items]
+
+    def _extend(self, start):
+        """Builds the rows after items start.. from the row before item start."""
+        import numpy as np
+
+        for weight, mode in zip(self._weights[start:], self._modes[start:]):
+            prev = self._rows[-1]
+            if mode == _EXCLUDE:
+                # Rows are never written once built, so an excluded item shares its predecessor's
+                self._rows.append(prev)
+                continue
+            candidate = prev[:self._capacity + 1 - weight] + 1
+            if mode == _INCLUDE:
+                row = np.full_like(prev, self._unreachable)
+                np.minimum(candidate, self._unreachable, out=row[weight:])
+            else:
+                row = prev.copy()
+                np.minimum(row[weight:], candidate, out=row[weight:])
+            self._rows.append(row)
+
+    def constrain(self, include=(), exclude=()):
+        """
+        A table over the same items with exactly these item IDs forced in and out, sharing
+        the rows before the first item whose constraint differs from this table's.
+        Raises ValueError if the forced items don't fit.
+        """
+        modes = self._constraint_modes(include, exclude)
+        start = next((idx for idx, (old, new) in enumerate(zip(self._modes, modes)) if old != new),
+                     len(modes))
+        table = copy.copy(self)
+        table._modes = modes
+        table._rows = self._rows[:start + 1]
+        table._extend(start)
+        return table
+
+    def _selections(self, target):
+        """
+        Yields the selections reaching scaled sum `target`, fewest items first. The search is
+        best-first from the last item down, and the table gives the exact fewest items that
+        complete each partial selection, so nothing popped is a dead end.
+        """
+        last = self._rows[-1]
+        # (items so far + fewest to complete, items left, tie-breaker, items so far, scaled sum left,
+        #  chosen item indexes as a linked list); fewer items left first finishes a selection before
+        # opening another one of the same count
+        heap = [(int(last[target]), len(self._items), 0, 0, target, None)]
+        pushed = 1
+        while heap:
+            _, idx, _, count, remaining, chosen = heapq.heappop(heap)
+            if idx == 0:
+                indexes = []
+                while chosen is not None:
+                    position, chosen = chosen
+                    indexes.append(position)
+                yield Selection(target * self._scale, [self._items[position][1] for position in indexes])
+                continue
+            idx -= 1
+            prev, weight, mode = self._rows[idx], self._weights[idx], self._modes[idx]
+            if mode != _INCLUDE and prev[remaining] < self._unreachable:
+                heapq.heappush(heap, (count + int(prev[remaining]), idx, pushed, count, remaining, chosen))
+                pushed += 1
+            if mode != _EXCLUDE and remaining >= weight and prev[remaining - weight] < self._unreachable:
+                heapq.heappush(heap, (count + 1 + int(prev[remaining - weight]), idx, pushed, count + 1,
+                                      remaining - weight, (idx, chosen)))
+                pushed += 1
+
+    def _reachable_sums(self):
+        """Scaled sums some selection reaches, largest first."""
+        import numpy as np
+        return np.flatnonzero(self._rows[-1] < self._unreachable)[::-1]
+
+    def best(self):
+        """The largest sum within the limit, reached with the fewest items."""
+        return next(self._selections(int(self._reachable_sums()[0])))
+
+    def top(self, k):
+        """The k best distinct selections: larger sums first, then fewer items."""
+        selections = []
+        if k <= 0:
+            return selections
+        for target in self._reachable_sums():
+            for selection in self._selections(int(target)):
+                selections.append(selection)
+                if len(selections) == k:
+                    return selections
+        return selections
+
+    def pareto(self):
+        """
+        The Pareto front of (sum, item count), largest sum first: one selection for every
+        sum that no selection of as many items or fewer exceeds. The empty selection is left out.
+        """
+        import numpy as np
+
+        sums = self._reachable_sums()
+        counts = self._rows[-1][sums].astype(np.int64)
+        # Fewest items among the larger sums; a sum is on the front if it needs fewer still
+        fewer_before = np.minimum.accumulate(np.concatenate(([self._unreachable + 1], counts[:-1])))
+        return [next(self._selections(int(target))) for target in sums[counts < fewer_before] if target > 0]
+
+
+def _enumerate_half(weights, max_limit):
+    """Maps every reachable subset sum of weights to (fewest items, bitmask)."""
+    subsets = {0: (0, 0)}
+    for bit, weight in enumerate(weights):
+        for current_sum, (count, mask) in list(subsets.items()):
+            new_sum = current_sum + weight
             if new_sum <= max_limit:
-                if new_sum not in dp or len(included_items) + 1 < len(dp.get(new_sum, [])):
-                    new_dp[new_sum] = included_items + [item_id]
-        
-        dp.update(new_dp)
+                existing = subsets.get(new_sum)
+                if existing is None or count + 1 < existing[0]:
+                    subsets[new_sum] = (count + 1, mask | (1 << bit))
+    return subsets
+
 
-    if not dp:
+def solve_knapsack_mitm(amounts, item_ids, max_limit):
+    """
+    Meet-in-the-middle exact solver, O(2^(n/2) log n) regardless of the limit.
+    Among the combinations reaching the best sum, the one with the fewest items wins.
+    """
+    items = _usable_items(amounts, item_ids, max_limit)
+    if not items:
         return 0, []
 
-    best_sum = max(dp.keys())
-    best_combination_items = dp[best_sum]
+    half = len(items) // 2
+    left = _enumerate_half([amount for amount, _ in items[:half]], max_limit)
+    right = _enumerate_half([amount for amount, _ in items[half:]], max_limit)
+    right_sums = sorted(right)
+
+    best = (0, 0, 0, 0)  # (sum, count, left mask, right mask)
+    for left_sum, (left_count, left_mask) in left.items():
+        right_sum = right_sums[bisect.bisect_right(right_sums, max_limit - left_sum) - 1]
+        right_count, right_mask = right[right_sum]
+        total = left_sum + right_sum
+        count = left_count + right_count
+        if total > best[0] or (total == best[0] and count < best[1]):
+            best = (total, count, left_mask, right_mask)
+
+    best_sum, _, left_mask, right_mask = best
+    mask = left_mask | (right_mask << half)
+    included = [item_id for idx, (_, item_id) in enumerate(items) if mask >> idx & 1]
+    return best_sum, included
+
+
+def solve_knapsack_bnb(amounts, item_ids, max_limit, time_budget=None):
+    """
+    Depth-first branch-and-bound over distinct amounts, largest first.
+    Equal amounts are branched on as a multiplicity to avoid symmetric subtrees.
+    Returns (best_sum, included_ids, optimal); optimal is False when time_budget ran out.
+    """
+    items = _usable_items(amounts, item_ids, max_limit)
+    if not items:
+        return 0, [], True
+
+    ids_by_amount = {}
+    for amount, item_id in items:
+        ids_by_amount.setdefault(amount, []).append(item_id)
+    weights = sorted(ids_by_amount, reverse=True)
+    multiplicity = [len(ids_by_amount[weight]) for weight in weights]
+
+    # suffix_sum[i]/suffix_count[i]: total amount/items of every weight from i onward
+    suffix_sum = [0] * (len(weights) + 1)
+    suffix_count = [0] * (len(weights) + 1)
+    for idx in range(len(weights) - 1, -1, -1):
+        suffix_sum[idx] = suffix_sum[idx + 1] + weights[idx] * multiplicity[idx]
+        suffix_count[idx] = suffix_count[idx + 1] + multiplicity[idx]
+
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    best_sum, best_count, best_path = 0, 0, None
+    optimal = True
+    visited = 0
+
+    # Stack entries: (weight index, current sum, current count, chosen multiplicities as a linked tuple)
+    stack = [(0, 0, 0, None)]
+    while stack:
+        visited += 1
+        if deadline is not None and visited & 0xFFF == 0 and time.perf_counter() > deadline:
+            optimal = False
+            break
+
+        idx, current_sum, current_count, path = stack.pop()
+        if current_sum > best_sum or (current_sum == best_sum and current_count < best_count):
+            best_sum, best_count, best_path = current_sum, current_count, path
+        if idx == len(weights):
+            continue
+
+        bound = current_sum + suffix_sum[idx]
+        if bound < best_sum:
+            continue
+        if bound <= max_limit:
+            # Everything left fits, so taking all of it is the only way to beat the incumbent
+            total_count = current_count + suffix_count[idx]
+            if bound > best_sum or total_count < best_count:
+                all_path = path
+                for rest in range(idx, len(weights)):
+                    all_path = (rest, multiplicity[rest], all_path)
+                best_sum, best_count, best_path = bound, total_count, all_path
+            continue
+        if best_sum == max_limit:
+            # The sum cannot improve, only the count; every further item costs at least one
+            needed = -(-(max_limit - current_sum) // weights[idx])
+            if current_count + needed >= best_count:
+                continue
+
+        weight = weights[idx]
+        max_take = min(multiplicity[idx], (max_limit - current_sum) // weight)
+        # Push the smallest multiplicity first so the greedy (largest) branch is explored first
+        for take in range(max_take + 1):
+            child_path = (idx, take, path) if take else path
+            stack.append((idx + 1, current_sum + take * weight, current_count + take, child_path))
+
+    if not optimal:
+        logger.warning(f"Branch-and-bound stopped after {time_budget}s; returning the best selection found so far.")
+
+    chosen = set()
+    while best_path is not None:
+        idx, take, best_path = best_path
+        chosen.update(ids_by_amount[weights[idx]][:take])
+    included = [item_id for _, item_id in items if item_id in chosen]
+    return best_sum, included, optimal
+
+
+def _allocate_sequentially(amounts, limits, eligible, time_budget):
+    """Fills each period in order with the best selection among the items still unassigned."""
+    period_of = [None] * len(amounts)
+    for period, limit in enumerate(limits):
+        candidates = [idx for idx, periods in enumerate(eligible) if period_of[idx] is None and period in periods]
+        result = solve_knapsack_auto([amounts[idx] for idx in candidates], candidates, limit, time_budget)
+        for idx in result.included_ids:
+            period_of[idx] = period
+    return period_of
+
+
+def _allocation_bound(amounts, order, limits, eligible):
+    """
+    Upper bound on any allocation: the best total if items could be split among their
+    periods (a max flow), i.e. the smallest over period sets S of the limits of S plus
+    the items allowed outside S. Only the two trivial sets are checked for many periods.
+    """
+    window_totals = {}
+    for idx in order:
+        window = tuple(eligible[idx])
+        window_totals[window] = window_totals.get(window, 0) + amounts[idx]
+    count = len(limits)
+    masks = range(1 << count) if count <= PERIOD_BOUND_MAX_PERIODS else (0, (1 << count) - 1)
+    return min(sum(limit for p, limit in enumerate(limits) if mask >> p & 1)
+               + sum(total for window, total in window_totals.items() if any(not mask >> p & 1 for p in window))
+               for mask in masks)
+
+
+def solve_knapsack_periods(amounts, item_ids, limits, eligible, time_budget=None):
+    """
+    Multiple knapsack over consecutive periods: assigns each item to at most one period,
+    only among eligible[i] (period indexes allowed for item i), maximizing the total over
+    all periods without any period exceeding its limit.
+
+    Filling the periods one after another gives the starting selection; a depth-first
+    branch-and-bound over the items, largest first, then searches for a better total
+    until it is proven optimal or time_budget (seconds) runs out.
+    Returns a PeriodResult; optimal is False when time_budget ran out.
+    """
+    amounts = [int(amount) for amount in amounts]
+    eligible = [sorted(set(periods)) for periods in eligible]
+    period_of = _allocate_sequentially(amounts, limits, eligible, time_budget)
+    best_sum = sum(amount for amount, period in zip(amounts, period_of) if period is not None)
+
+    # Items that fit at least one of their periods, largest first, equal items next to each other
+    order = sorted((idx for idx, periods in enumerate(eligible)
+                    if amounts[idx] > 0 and any(amounts[idx] <= limits[p] for p in periods)),
+                   key=lambda idx: (-amounts[idx], eligible[idx]))
+    # same[pos]: the item at pos equals the one before it (same amount, same periods)
+    same = [pos > 0 and amounts[order[pos - 1]] == amounts[idx] and eligible[order[pos - 1]] == eligible[idx]
+            for pos, idx in enumerate(order)]
+    suffix_sum = [0] * (len(order) + 1)
+    for pos in range(len(order) - 1, -1, -1):
+        suffix_sum[pos] = suffix_sum[pos + 1] + amounts[order[pos]]
+    # Periods open to exactly the same items share a class
+    classes = {}
+    period_class = [classes.setdefault(tuple(idx for idx in order if period in eligible[idx]), len(classes))
+                    for period in range(len(limits))]
+
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    optimal = True
+    visited = 0
+    best_path = None
+    seen = set()
+
+    # Stack entries: (position in order, remaining capacities, current sum, period of the previous
+    # item or -1 if it was left out, chosen (position, period) pairs as a linked tuple)
+    upper_bound = _allocation_bound(amounts, order, limits, eligible)
+    stack = [] if best_sum >= upper_bound else [(0, tuple(limits), 0, -1, None)]
+    while stack:
+        visited += 1
+        if deadline is not None and visited & 0xFFF == 0 and time.perf_counter() > deadline:
+            optimal = False
+            break
+
+        pos, capacity, current_sum, previous, path = stack.pop()
+        if current_sum > best_sum:
+            best_sum, best_path = current_sum, path
+            if best_sum >= upper_bound:
+                break
+        if pos == len(order) or current_sum + min(sum(capacity), suffix_sum[pos]) <= best_sum:
+            continue
+        # The sum follows from the capacities left, so a state seen before has nothing new below it
+        state = (pos, capacity, previous if same[pos] else -1)
+        if state in seen:
+            continue
+        if len(seen) >= PERIOD_MAX_SEEN_STATES:
+            seen.clear()
+        seen.add(state)
+
+        idx = order[pos]
+        amount, periods = amounts[idx], eligible[idx]
+        stack.append((pos + 1, capacity, current_sum, -1, path))
+        # Equal items are interchangeable: once one is left out, leave out the rest, and take
+        # the others in period order
+        if same[pos] and previous == -1:
+            continue
+        # Periods of the same class with the same capacity left lead to the same subtree
+        tried = {}
+        for period in periods:
+            if capacity[period] >= amount and not (same[pos] and period < previous):
+                tried.setdefault((capacity[period], period_class[period]), period)
+        # Pushed last, so the earliest period is explored first
+        for period in sorted(tried.values(), reverse=True):
+            child = capacity[:period] + (capacity[period] - amount,) + capacity[period + 1:]
+            stack.append((pos + 1, child, current_sum + amount, period, ((pos, period), path)))
+
+    if not optimal:
+        logger.warning(f"Period allocation stopped after {time_budget}s; returning the best allocation found so far.")
 
-    return best_sum, best_combination_items
+    if best_path is not None:
+        period_of = [None] * len(amounts)
+        while best_path is not None:
+            (pos, period), best_path = best_path
+            period_of[order[pos]] = period
+    period_ids = [[item_id for item_id, assigned in zip(item_ids, period_of) if assigned == period]
+                  for period in range(len(limits))]
+    period_sums = [sum(amount for amount, assigned in zip(amounts, period_of) if assigned == period)
+                   for period in range(len(limits))]
+    return PeriodResult(sum(period_sums), period_sums, period_ids, optimal)
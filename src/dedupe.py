@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Near-duplicate receipt detection ahead of OCR.
+
+Each image gets a 64-bit difference hash (dHash) of a 9x8 grayscale thumbnail, which
+survives re-encoding, rescaling and small brightness changes. Hashes go into a
+multi-index table so near neighbours are found without comparing every pair.
+
+Receipts from the same app share a layout and can hash alike even when the amount
+differs, so every hash match is confirmed by comparing larger thumbnails block by block:
+a changed digit shows up as one strongly different block, re-encoding noise doesn't.
+"""
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DHASH_SIZE = 8
+VERIFY_WIDTH = 512
+VERIFY_BLOCK = 8
+# Aspect ratios further apart than this are never the same receipt
+MAX_ASPECT_DIFFERENCE = 0.02
+# Verification thumbnails kept per find_duplicates call (~0.5MB each at VERIFY_WIDTH)
+THUMBNAIL_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def dhash(image_path, size=DHASH_SIZE):
+    """Difference hash: one bit per horizontally adjacent pixel pair of a (size+1) x size thumbnail."""
+    from PIL import Image
+    with Image.open(image_path) as img:
+        # JPEG decodes straight to a reduced scale; other formats ignore the hint
+        img.draft('L', (size * 16, size * 16))
+        thumbnail = img.convert('L').resize((size + 1, size), Image.Resampling.BOX)
+    pixels = thumbnail.tobytes()
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+class HashIndex:
+    """
+    Near-neighbour index for 64-bit hashes under Hamming distance (multi-index hashing).
+    Hashes are split into max_distance + 1 bands; two hashes within max_distance bits
+    must agree exactly on at least one band, so only same-band entries are compared.
+    """
+
+    def __init__(self, max_distance=4, bits=64):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        widths = [bits // bands + (1 if i < bits % bands else 0) for i in range(bands)]
+        self._bands = []
+        shift = 0
+        for width in widths:
+            self._bands.append((shift, (1 << width) - 1))
+            shift += width
+        self._tables = [defaultdict(list) for _ in self._bands]
+
+    def add(self, value, item):
+        for table, (shift, mask) in zip(self._tables, self._bands):
+            table[(value >> shift) & mask].append((value, item))
+
+    def query(self, value):
+        """Items within max_distance of value, closest first."""
+        found = {}
+        for table, (shift, mask) in zip(self._tables, self._bands):
+            for other, item in table.get((value >> shift) & mask, ()):
+                distance = (value ^ other).bit_count()
+                if distance <= self.max_distance:
+                    found[item] = distance
+        return sorted(found, key=found.get)
+
+
+def _verify_thumbnail(image_path):
+    """Grayscale copy at most VERIFY_WIDTH wide, and the image's aspect ratio (height / width)."""
+    from PIL import Image
+    # No draft() here: a JPEG decoded at reduced scale resamples differently from a full-size
+    # PNG of the same receipt, which is exactly the noise this comparison has to ignore
+    with Image.open(image_path) as img:
+        gray = img.convert('L')
+    aspect = gray.height / gray.width
+    if gray.width > VERIFY_WIDTH:
+        gray = gray.resize((VERIFY_WIDTH, max(VERIFY_BLOCK, round(VERIFY_WIDTH * aspect))), Image.Resampling.BOX)
+    return gray, aspect
+
+
+class ThumbnailCache:
+    """
+    Verification thumbnails by path, so an image matched against many others (receipts from
+    one app all hash alike) is decoded once. Past max_bytes, new thumbnails aren't kept.
+    """
+
+    def __init__(self, max_bytes=THUMBNAIL_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._bytes = 0
+        self._thumbnails = {}
+
+    def get(self, image_path):
+        found = self._thumbnails.get(image_path)
+        if found is None:
+            found = _verify_thumbnail(image_path)
+            size = found[0].width * found[0].height
+            if self._bytes + size <= self.max_bytes:
+                self._thumbnails[image_path] = found
+                self._bytes += size
+        return found
+
+
+def looks_identical(path_a, path_b, tolerance, thumbnails=None):
+    """
+    Confirms a hash match: same aspect ratio, and no 8x8 block of the two images, scaled to
+    a common width of at most VERIFY_WIDTH, differs by more than `tolerance` (mean absolute
+    difference, 0-255). Never upscaling keeps resampling blur from hiding small changes.
+    thumbnails is an optional ThumbnailCache.
+    """
+    from PIL import Image, ImageChops
+    load = thumbnails.get if thumbnails is not None else _verify_thumbnail
+    (img_a, aspect_a), (img_b, aspect_b) = load(path_a), load(path_b)
+    if abs(aspect_a - aspect_b) > MAX_ASPECT_DIFFERENCE * max(aspect_a, aspect_b):
+        return False
+    width = min(img_a.width, img_b.width)
+    size = (width, max(VERIFY_BLOCK, round(width * aspect_a)))
+    thumb_a = img_a if img_a.size == size else img_a.resize(size, Image.Resampling.BOX)
+    thumb_b = img_b if img_b.size == size else img_b.resize(size, Image.Resampling.BOX)
+    blocks = ImageChops.difference(thumb_a, thumb_b).reduce(VERIFY_BLOCK)
+    return blocks.getextrema()[1] <= tolerance
+
+
+def find_duplicates(image_paths, max_distance=4, tolerance=40, jobs=1, hash_cache=None, key=None):
+    """
+    Finds near-duplicate images. Returns {duplicate_path: original_path}, where the original
+    is the first of its copies in `key` order (default: by path), so the roles don't depend
+    on directory listing order.
+    hash_cache, if given, provides get_dhash(path) / set_dhash(path, value) to skip rehashing.
+    """
+    image_paths = sorted(image_paths, key=key)
+
+    def hash_one(image_path):
+        if hash_cache is not None:
+            cached = hash_cache.get_dhash(image_path)
+            if cached is not None:
+                return cached
+        try:
+            value = dhash(image_path)
+        except Exception as e:
+            logger.warning(f"Could not hash {image_path} for duplicate detection: {e}")
+            return None
+        if hash_cache is not None:
+            hash_cache.set_dhash(image_path, value)
+        return value
+
+    if jobs > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            hashes = list(executor.map(hash_one, image_paths))
+    else:
+        hashes = [hash_one(image_path) for image_path in image_paths]
+
+    index = HashIndex(max_distance)
+    thumbnails = ThumbnailCache()
+    duplicates = {}
+    for image_path, value in zip(image_paths, hashes):
+        if value is None:
+            continue
+        original = None
+        for candidate in index.query(value):
+            try:
+                if looks_identical(candidate, image_path, tolerance, thumbnails):
+                    original = candidate
+                    break
+            except Exception as e:
+                logger.warning(f"Could not compare {candidate} and {image_path}: {e}")
+        if original is not None:
+            duplicates[image_path] = original
+            logger.debug(f"{image_path} duplicates {original}")
+        else:
+            index.add(value, image_path)
+    return duplicates
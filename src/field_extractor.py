@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Single-pass receipt field extraction.
+
+Produces the same (receipt_type, date, time, amount) as classify_receipt, find_date,
+find_time and find_amount in receipt_parser, but splits and lowercases the OCR text
+once, uses module-level precompiled patterns, and looks up receipt types in a rule
+registry instead of an if/elif chain.
+"""
+import logging
+import re
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# --- Precompiled patterns (kept in the same priority order as receipt_parser) ---
+_DATE_PATTERNS = [
+    (re.compile(r'(20\d{2})[.\-/년\s]+(\d{1,2})[.\-/월\s]+(\d{1,2})일?'), ''),
+    (re.compile(r'(\d{2})[.\-/년\s]+(\d{1,2})[.\-/월\s]+(\d{1,2})일?'), '20'),
+]
+
+_TIME_KEYWORDS = ['승인시간', '결제시간', '거래시간', '시간', '결제일시', '승인일시']
+_TIME_KEYWORD_PATTERNS = [
+    re.compile(rf'{keyword}[:\s]*(\d{{1,2}})[:\s시](\d{{2}})[:\s분]?(\d{{2}})?초?')
+    for keyword in _TIME_KEYWORDS
+]
+_AMPM_PATTERN = re.compile(r'(오전|오후)\s*(\d{1,2})[:\s시](\d{2})[:\s분]?(\d{2})?초?')
+_HMS_PATTERN = re.compile(r'(\d{1,2}):(\d{2}):(\d{2})')
+_HM_PATTERN = re.compile(r'(\d{1,2}):(\d{2})(?!\d|:)')
+_KOREAN_TIME_PATTERN = re.compile(r'(\d{1,2})시\s*(\d{2})분(?:\s*(\d{2})초)?')
+
+_WON_AMOUNT_PATTERN = re.compile(r'([\d,]+)\s*원')
+_LINE_AMOUNT_PATTERN = re.compile(r'(\d{1,3}(?:[.,]\d{3})*)')
+
+_AMOUNT_KEYWORDS = ['승인금액', '결제금액', '결제 금액', '합계', '승인 금액']
+_AMOUNT_KEYWORD_PATTERN = re.compile('|'.join(re.escape(keyword) for keyword in _AMOUNT_KEYWORDS))
+
+
+# --- Amount strategies: (lines, lowered_lines) -> amount string or None ---
+def _line_amount(line):
+    """Numeric part of a potential amount in a line, handling commas and periods."""
+    match = _LINE_AMOUNT_PATTERN.search(line)
+    if match:
+        amount_str = match.group(1).replace(',', '').replace('.', '')
+        if amount_str.isdigit():
+            return amount_str
+    return None
+
+
+def _amount_above_marker(marker):
+    """First amount over 100 on the lines above the first line containing `marker`."""
+    def strategy(lines, lowered_lines):
+        for idx, lowered in enumerate(lowered_lines):
+            if marker in lowered:
+                for line in reversed(lines[:idx]):
+                    amount = _line_amount(line)
+                    if amount and int(amount) > 100:
+                        return amount
+                return None
+        return None
+    return strategy
+
+
+def _amount_max_won(lines, lowered_lines):
+    """Largest 'X,XXX 원' amount in the text."""
+    best = None
+    for line in lines:
+        match = _WON_AMOUNT_PATTERN.search(line)
+        if match:
+            amount_str = match.group(1).replace(',', '')
+            if amount_str.isdigit() and (best is None or int(amount_str) > best):
+                best = int(amount_str)
+    return None if best is None else str(best)
+
+
+def _amount_by_keyword(lines):
+    """Amount on the first line holding the highest-priority amount keyword that has one."""
+    found = {}
+    for line in lines:
+        if not _AMOUNT_KEYWORD_PATTERN.search(line):
+            continue
+        amount = None
+        for keyword in _AMOUNT_KEYWORDS:
+            if keyword not in found and keyword in line:
+                if amount is None:
+                    amount = _line_amount(line)
+                    if amount is None:
+                        break
+                found[keyword] = amount
+        if _AMOUNT_KEYWORDS[0] in found:
+            break
+    for keyword in _AMOUNT_KEYWORDS:
+        if keyword in found:
+            return found[keyword]
+    return None
+
+
+# --- Receipt type registry ---
+# Rules are tried in order and the first one with a matching keyword wins.
+# keywords are matched against the lowercased text, raw_keywords against the text as-is.
+# amount_strategy runs before the generic keyword search; None skips straight to it.
+ReceiptRule = namedtuple('ReceiptRule', ['name', 'keywords', 'raw_keywords', 'amount_strategy'])
+
+RECEIPT_RULES = [
+    ReceiptRule('커피빈', ('coffee bean', '커피빈'), (), None),
+    ReceiptRule('스타벅스', ('starbucks', '스타벅스'), (), None),
+    ReceiptRule('신한카드', ('deep on',), (), _amount_above_marker('deep on')),
+    ReceiptRule('하나카드', ('hana card', '하나카드'), ('5181-85',), _amount_max_won),
+    ReceiptRule('삼성카드', ('samsung card', '삼성카드'), (), _amount_max_won),
+]
+DEFAULT_RECEIPT_TYPE = '기타'
+
+
+def register_receipt_rule(rule, before=None):
+    """Adds a receipt type rule, optionally ahead of the rule named `before`."""
+    global _type_keyword_pattern
+    if before is None:
+        RECEIPT_RULES.append(rule)
+    else:
+        names = [existing.name for existing in RECEIPT_RULES]
+        RECEIPT_RULES.insert(names.index(before), rule)
+    _type_keyword_pattern = _compile_type_keywords()
+
+
+def _compile_type_keywords():
+    """One alternation over every rule keyword, used to skip texts that match no rule."""
+    keywords = {keyword for rule in RECEIPT_RULES for keyword in rule.keywords}
+    keywords.update(keyword.lower() for rule in RECEIPT_RULES for keyword in rule.raw_keywords)
+    return re.compile('|'.join(re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True)))
+
+
+_type_keyword_pattern = _compile_type_keywords()
+
+
+def _classify(text, lowered):
+    """Returns the first matching ReceiptRule, or None for the default type."""
+    if not _type_keyword_pattern.search(lowered):
+        return None
+    for rule in RECEIPT_RULES:
+        if any(keyword in lowered for keyword in rule.keywords) or \
+                any(keyword in text for keyword in rule.raw_keywords):
+            return rule
+    return None
+
+
+def _find_date(text):
+    for pattern, century in _DATE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            year, month, day = match.groups()
+            return f"{century}{year}-{month.zfill(2)}-{day.zfill(2)}"
+    return "Not found"
+
+
+def _find_time(text):
+    for pattern in _TIME_KEYWORD_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            hour, minute, second = match.groups()
+            return f"{hour.zfill(2)}:{minute.zfill(2)}:{(second or '00').zfill(2)}"
+
+    match = _AMPM_PATTERN.search(text)
+    if match:
+        ampm, hour, minute, second = match.groups()
+        hour = int(hour)
+        if ampm == '오후' and hour != 12:
+            hour += 12
+        elif ampm == '오전' and hour == 12:
+            hour = 0
+        return f"{str(hour).zfill(2)}:{minute.zfill(2)}:{(second or '00').zfill(2)}"
+
+    match = _HMS_PATTERN.search(text)
+    if match:
+        hour, minute, second = match.groups()
+        if 0 <= int(hour) <= 23 and 0 <= int(minute) <= 59 and 0 <= int(second) <= 59:
+            return f"{hour.zfill(2)}:{minute.zfill(2)}:{second.zfill(2)}"
+
+    match = _HM_PATTERN.search(text)
+    if match:
+        hour, minute = match.groups()
+        if 0 <= int(hour) <= 23 and 0 <= int(minute) <= 59:
+            return f"{hour.zfill(2)}:{minute.zfill(2)}:00"
+
+    match = _KOREAN_TIME_PATTERN.search(text)
+    if match:
+        hour, minute, second = match.groups()
+        if 0 <= int(hour) <= 23 and 0 <= int(minute) <= 59:
+            return f"{hour.zfill(2)}:{minute.zfill(2)}:{(second or '00').zfill(2)}"
+
+    return "00:00:00"
+
+
+def extract_fields(text):
+    """
+    Extracts every field from OCR text in one pass over its lines.
+    Returns (receipt_type, date, time, amount) with the same values and 'Not found' /
+    '00:00:00' defaults as the individual receipt_parser functions.
+    """
+    lowered = text.lower()
+    rule = _classify(text, lowered)
+    receipt_type = rule.name if rule else DEFAULT_RECEIPT_TYPE
+
+    lines = text.split('\n')
+    amount = None
+    if rule is not None and rule.amount_strategy is not None:
+        amount = rule.amount_strategy(lines, lowered.split('\n'))
+    if amount is None:
+        amount = _amount_by_keyword(lines)
+    if amount is None:
+        logger.warning("Could not find amount in receipt.")
+        amount = "Not found"
+
+    date = _find_date(text)
+    time = _find_time(text)
+    logger.debug(f"Extracted type={receipt_type}, date={date}, time={time}, amount={amount}")
+    return receipt_type, date, time, amount
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Measures CLI startup cost: `python -X importtime` of main plus wall time of `main.py --version`.
+
+    python -m src.import_bench --repeat 10
+    python -m src.import_bench --output import_bench.json
+
+Also reports whether the heavy modules (numpy, PIL) were pulled in at startup.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ('numpy', 'PIL')
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(stderr):
+    """Parses -X importtime output into {module: (self_us, cumulative_us)} for top-level entries."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.setdefault(name.strip(), (int(self_us), int(cumulative_us)))
+    return modules
+
+
+def measure_importtime(module='main'):
+    """Imports `module` in a fresh interpreter and returns its parsed importtime table."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=REPO_DIR, capture_output=True, text=True, check=True
+    )
+    return parse_importtime(result.stderr)
+
+
+def measure_version_wall():
+    """Wall time of `python main.py --version` in a fresh interpreter."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, 'main.py', '--version'], cwd=REPO_DIR,
+                   capture_output=True, check=True)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CLI import/startup time benchmark")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="출력할 가장 느린 모듈 수")
+    parser.add_argument("--output", default=None, help="결과를 저장할 JSON 파일 경로")
+    args = parser.parse_args(argv)
+
+    imports = [measure_importtime() for _ in range(args.repeat)]
+    walls = [measure_version_wall() for _ in range(args.repeat)]
+
+    main_us = statistics.median(run['main'][1] for run in imports)
+    heavy = {name: any(name in run for run in imports) for name in HEAVY_MODULES}
+    slowest = sorted(imports[-1].items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+
+    print(f"import main (median of {args.repeat}): {main_us / 1000:.1f}ms")
+    print(f"main.py --version (median of {args.repeat}): {statistics.median(walls) * 1000:.1f}ms")
+    print("heavy modules at startup: " + ", ".join(f"{name}={'yes' if hit else 'no'}" for name, hit in heavy.items()))
+    print(f"{'module':<40}{'self(ms)':>10}{'cumul(ms)':>12}")
+    for name, (self_us, cumulative_us) in slowest:
+        print(f"{name:<40}{self_us / 1000:>10.1f}{cumulative_us / 1000:>12.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'python': sys.version.split()[0],
+                'import_main_ms': round(main_us / 1000, 2),
+                'version_wall_ms': [round(wall * 1000, 2) for wall in walls],
+                'heavy_modules_loaded': heavy,
+                'slowest': [{'module': name, 'self_ms': self_us / 1000, 'cumulative_ms': cumulative_us / 1000}
+                            for name, (self_us, cumulative_us) in slowest],
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the knapsack solvers in bill_calculator.
+
+Sweeps synthetic receipt workloads over item counts and limits and records wall time,
+peak traced memory and solution quality per solver into a JSON file, so results can be
+diffed across versions:
+
+    python -m src.knapsack_bench --output knapsack_bench.json
+    python -m src.knapsack_bench --quick --compare knapsack_bench.json
+    python -m src.knapsack_bench --quick --batch 5000 --jobs 4
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from functools import reduce
+
+import numpy as np
+
+from src.bill_calculator import (
+    DP_MAX_TABLE_BYTES,
+    MITM_MAX_ITEMS,
+    solve_knapsack_auto,
+    solve_knapsack_batch,
+    solve_knapsack_bnb,
+    solve_knapsack_dp,
+    solve_knapsack_mitm
+)
+
+ITEM_COUNTS = [10, 30, 100, 1000, 10000]
+LIMITS = [50_000, 500_000, 5_000_000, 50_000_000]
+QUICK_ITEM_COUNTS = [10, 30, 100, 1000]
+QUICK_LIMITS = [50_000, 500_000, 5_000_000]
+
+# Amount distributions: (name, step). 100 matches what validate_amounts sees in practice;
+# 10 and 1 exercise smaller GCDs and therefore larger DP tables.
+DISTRIBUTIONS = [('step100', 100), ('step10', 10), ('step1', 1)]
+MIN_AMOUNT = 1000
+MAX_AMOUNT = 99999
+
+SOLVERS = ['dp', 'mitm', 'bnb', 'auto']
+
+
+def generate_amounts(count, step, rng):
+    """Receipt-like amounts between MIN_AMOUNT and MAX_AMOUNT in multiples of `step`, skewed towards small tickets."""
+    amounts = []
+    for _ in range(count):
+        # Log-uniform: most receipts are coffee-sized, a few are large
+        value = math.exp(rng.uniform(math.log(MIN_AMOUNT), math.log(MAX_AMOUNT)))
+        amounts.append(max(MIN_AMOUNT, min(MAX_AMOUNT // step * step, int(value) // step * step)))
+    return amounts
+
+
+def _is_feasible(solver, amounts, limit):
+    """Skips solver/workload pairs that would not finish or would not fit in memory."""
+    if solver == 'mitm':
+        return len(amounts) <= MITM_MAX_ITEMS
+    if solver == 'dp':
+        usable = [amount for amount in amounts if amount <= limit]
+        if not usable:
+            return True
+        capacity = limit // reduce(math.gcd, usable)
+        return len(usable) * (capacity + 1) // 8 + 4 * (capacity + 1) <= DP_MAX_TABLE_BYTES
+    return True
+
+
+def _run_solver(solver, amounts, item_ids, limit, time_budget):
+    """Runs one solver and returns (best_sum, included_ids, optimal)."""
+    if solver == 'dp':
+        best_sum, included = solve_knapsack_dp(amounts, item_ids, limit)
+        return best_sum, included, True
+    if solver == 'mitm':
+        best_sum, included = solve_knapsack_mitm(amounts, item_ids, limit)
+        return best_sum, included, True
+    if solver == 'bnb':
+        return solve_knapsack_bnb(amounts, item_ids, limit, time_budget)
+    result = solve_knapsack_auto(amounts, item_ids, limit, time_budget)
+    return result.best_sum, result.included_ids, result.optimal
+
+
+def benchmark_case(amounts, limit, time_budget, measure_memory=True):
+    """Benchmarks every feasible solver on one workload."""
+    item_ids = list(range(1, len(amounts) + 1))
+    rows = []
+    for solver in SOLVERS:
+        if not _is_feasible(solver, amounts, limit):
+            rows.append({'solver': solver, 'skipped': True})
+            continue
+
+        start = time.perf_counter()
+        best_sum, included, optimal = _run_solver(solver, amounts, item_ids, limit, time_budget)
+        wall = time.perf_counter() - start
+
+        peak_bytes = None
+        if measure_memory:
+            # Separate run: tracemalloc slows pure-Python solvers down considerably
+            tracemalloc.start()
+            _run_solver(solver, amounts, item_ids, limit, time_budget)
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        rows.append({
+            'solver': solver,
+            'skipped': False,
+            'wall_seconds': round(wall, 6),
+            'peak_bytes': peak_bytes,
+            'best_sum': best_sum,
+            'item_count': len(included),
+            'optimal': optimal,
+        })
+
+    # Quality relative to the best proven sum (or the trivial upper bound if none is proven)
+    proven = [row['best_sum'] for row in rows if not row['skipped'] and row['optimal']]
+    reference = max(proven) if proven else min(limit, sum(amounts))
+    for row in rows:
+        if not row['skipped']:
+            row['quality'] = round(row['best_sum'] / reference, 6) if reference else 1.0
+    return rows
+
+
+def run_suite(item_counts, limits, distributions, time_budget, seed, measure_memory=True):
+    """Runs the full sweep and returns a list of result rows."""
+    results = []
+    for dist_name, step in distributions:
+        for count in item_counts:
+            rng = random.Random(f"{seed}-{dist_name}-{count}")
+            amounts = generate_amounts(count, step, rng)
+            for limit in limits:
+                for row in benchmark_case(amounts, limit, time_budget, measure_memory):
+                    row.update({'distribution': dist_name, 'items': count, 'limit': limit})
+                    results.append(row)
+                    _print_row(row)
+    return results
+
+
+def _print_row(row):
+    label = f"{row['distribution']:<8}{row['items']:>7}{row['limit']:>12,} {row['solver']:<5}"
+    if row['skipped']:
+        print(f"{label}  skipped")
+        return
+    peak = f"{row['peak_bytes'] / 1e6:9.1f}MB" if row['peak_bytes'] is not None else "        -"
+    print(f"{label}{row['wall_seconds']:10.4f}s {peak} quality={row['quality']:.4f}"
+          f"{'' if row['optimal'] else ' (time budget)'}")
+
+
+def benchmark_batch(group_count, jobs, time_budget, seed):
+    """
+    Month-end workload: many small groups (3-40 receipts, limits of 50,000-300,000),
+    solved one call at a time and through solve_knapsack_batch.
+    """
+    rng = random.Random(f"{seed}-batch")
+    groups = [(generate_amounts(rng.randint(3, 40), 100, rng), rng.choice([50_000, 100_000, 150_000, 300_000]))
+              for _ in range(group_count)]
+
+    start = time.perf_counter()
+    single = [solve_knapsack_auto(amounts, list(range(len(amounts))), limit, time_budget) for amounts, limit in groups]
+    single_wall = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = solve_knapsack_batch(groups, time_budget, jobs)
+    batch_wall = time.perf_counter() - start
+
+    row = {
+        'groups': group_count,
+        'jobs': jobs,
+        'single_seconds': round(single_wall, 6),
+        'batch_seconds': round(batch_wall, 6),
+        'identical': batch == single,
+    }
+    print(f"batch {group_count:,} groups: single calls {single_wall:.3f}s "
+          f"({group_count / single_wall:,.0f}/s), batch -j {jobs} {batch_wall:.3f}s "
+          f"({group_count / batch_wall:,.0f}/s), identical={row['identical']}")
+    return row
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def compare(previous_path, results, tolerance):
+    """Prints cases whose wall time grew by more than `tolerance` or whose quality dropped."""
+    with open(previous_path, encoding='utf-8') as f:
+        previous = json.load(f)
+    key = lambda row: (row['distribution'], row['items'], row['limit'], row['solver'])
+    before = {key(row): row for row in previous['results'] if not row['skipped']}
+    regressions = 0
+    for row in results:
+        old = before.get(key(row))
+        if row['skipped'] or old is None:
+            continue
+        slower = row['wall_seconds'] > old['wall_seconds'] * (1 + tolerance) and row['wall_seconds'] > 0.01
+        worse = row['quality'] < old['quality']
+        if slower or worse:
+            regressions += 1
+            print(f"REGRESSION {key(row)}: {old['wall_seconds']:.4f}s -> {row['wall_seconds']:.4f}s, "
+                  f"quality {old['quality']:.4f} -> {row['quality']:.4f}")
+    print(f"{regressions} regression(s) against {previous_path} ({previous.get('git_revision')})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Knapsack solver benchmark suite")
+    parser.add_argument("--output", default="knapsack_bench.json", help="결과를 저장할 JSON 파일 경로")
+    parser.add_argument("--quick", action="store_true", help="작은 규모로만 실행합니다")
+    parser.add_argument("--items", type=int, nargs='+', default=None, help="항목 수 목록")
+    parser.add_argument("--limits", type=int, nargs='+', default=None, help="한도 금액 목록")
+    parser.add_argument("--time-budget", type=float, default=10.0, help="solver별 시간 제한 (초)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-memory", action="store_true", help="tracemalloc 측정을 건너뜁니다")
+    parser.add_argument("--compare", metavar="PREVIOUS_JSON", help="이전 결과와 비교해 회귀를 출력합니다")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="허용 시간 증가율 (기본값: 0.25)")
+    parser.add_argument("--batch", type=int, default=0, metavar="GROUPS",
+                        help="작은 문제 GROUPS개를 개별 호출과 solve_knapsack_batch 로 풀어 비교합니다")
+    parser.add_argument("--jobs", type=int, default=1, help="--batch 의 작업 프로세스 수 (기본값: 1)")
+    args = parser.parse_args(argv)
+
+    item_counts = args.items or (QUICK_ITEM_COUNTS if args.quick else ITEM_COUNTS)
+    limits = args.limits or (QUICK_LIMITS if args.quick else LIMITS)
+    distributions = DISTRIBUTIONS[:1] if args.quick else DISTRIBUTIONS
+
+    results = run_suite(item_counts, limits, distributions, args.time_budget, args.seed, not args.no_memory)
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'seed': args.seed,
+        'time_budget': args.time_budget,
+        'results': results,
+    }
+    if args.batch > 0:
+        report['batch'] = benchmark_batch(args.batch, args.jobs, args.time_budget, args.seed)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"결과 저장: {args.output}")
+
+    if args.compare:
+        return 1 if compare(args.compare, results, args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only receipt ledger.
+
+Every finished run appends one row per receipt to a JSONL partition for the month of the
+receipt's date (ledger/2026-01.jsonl; receipts without a readable date go to
+ledger/undated.jsonl), then one line to ledger/runs.jsonl, the run index. Nothing already
+written is read or rewritten, so a run costs O(its own rows) however long the history is:
+
+    {"run": "20261017-093012-118204-4242", "seq": 0, "sha256": "...", "input_dir": "/data/2026-01",
+     "file": "1.PNG", "date": "2026-01-03", "time": "12:40:00", "amount": 61000,
+     "type": "하나카드", "status": "included", "no": 1, "period": "", "limit": 100000,
+     "duplicate_of": null}
+
+Rows are keyed by image content hash: query_ledger reports the latest run's row for each
+image unless asked for every run, so re-running a folder doesn't count a receipt twice.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+STATUS_INCLUDED = 'included'
+STATUS_EXCLUDED = 'excluded'
+STATUS_DUPLICATE = 'duplicate'
+STATUSES = (STATUS_INCLUDED, STATUS_EXCLUDED, STATUS_DUPLICATE)
+
+RUNS_NAME = "runs.jsonl"
+UNDATED_PARTITION = "undated"
+
+
+def new_run_id():
+    """Run id that sorts by start time (to the microsecond, as watch mode can run twice a second)."""
+    return f"{datetime.now():%Y%m%d-%H%M%S-%f}-{os.getpid()}"
+
+
+def _partition(date):
+    try:
+        return datetime.strptime(date, '%Y-%m-%d').strftime('%Y-%m')
+    except (TypeError, ValueError):
+        return UNDATED_PARTITION
+
+
+def ledger_row(record, run_id, seq, sha256, input_dir, limit):
+    """The ledger row of a finished ReceiptRecord; seq is its position in the run's CSV."""
+    if record.duplicate_of is not None:
+        status = STATUS_DUPLICATE
+    else:
+        status = STATUS_EXCLUDED if record.excluded else STATUS_INCLUDED
+    return {
+        'run': run_id, 'seq': seq, 'sha256': sha256, 'input_dir': os.path.abspath(input_dir),
+        'file': record.filename, 'date': record.date, 'time': record.time, 'amount': record.amount,
+        'type': record.receipt_type, 'status': status, 'no': record.no, 'period': record.period,
+        'limit': limit,
+        'duplicate_of': record.duplicate_of.filename if record.duplicate_of is not None else None,
+    }
+
+
+def _append_lines(path, items):
+    with open(path, 'a', encoding='utf-8') as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def append_run(ledger_dir, run, rows):
+    """
+    Appends a run's rows to their month partitions, then the run itself (a dict with at
+    least 'run') to the run index; a run listed in the index has all of its rows written.
+    """
+    os.makedirs(ledger_dir, exist_ok=True)
+    partitions = {}
+    for row in rows:
+        partitions.setdefault(_partition(row['date']), []).append(row)
+    for name, partition_rows in sorted(partitions.items()):
+        _append_lines(os.path.join(ledger_dir, f"{name}.jsonl"), partition_rows)
+    _append_lines(os.path.join(ledger_dir, RUNS_NAME), [run])
+
+
+def _image_key(row):
+    # Rows whose file could not be hashed fall back to their path
+    return row['sha256'] or os.path.join(row['input_dir'], row['file'])
+
+
+def _read_lines(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a torn last line; everything before it is intact
+                logger.warning(f"Ignoring unreadable ledger line in {path}")
+
+
+def read_runs(ledger_dir):
+    """The run index, oldest first."""
+    path = os.path.join(ledger_dir, RUNS_NAME)
+    return list(_read_lines(path)) if os.path.exists(path) else []
+
+
+def _partition_paths(ledger_dir, date_from, date_to):
+    """Partitions that can hold dates in [date_from, date_to]; undated rows only without a date filter."""
+    if not os.path.isdir(ledger_dir):
+        return []
+    names = sorted(name[:-len(".jsonl")] for name in os.listdir(ledger_dir)
+                   if name.endswith(".jsonl") and name != RUNS_NAME)
+    selected = []
+    for name in names:
+        if name == UNDATED_PARTITION:
+            if date_from is None and date_to is None:
+                selected.append(name)
+        elif (date_from is None or name >= date_from[:7]) and (date_to is None or name <= date_to[:7]):
+            selected.append(name)
+    return [os.path.join(ledger_dir, f"{name}.jsonl") for name in selected]
+
+
+def query_ledger(ledger_dir, date_from=None, date_to=None, receipt_type=None, status=None, run=None,
+                 latest=True):
+    """
+    Yields the rows matching every given filter (dates as YYYY-MM-DD, inclusive), partition
+    by partition, without holding the history in memory. Partitions outside the date range
+    are not read for rows. With latest, only the most recent run's row of each image counts;
+    that takes an extra pass over every partition keeping one run id per image, because a
+    later run may have read the image's date differently and filed it under another month.
+    """
+    paths = _partition_paths(ledger_dir, date_from, date_to)
+    latest_run = None
+    if latest and run is None:
+        latest_run = {}
+        for path in _partition_paths(ledger_dir, None, None):
+            for row in _read_lines(path):
+                key = _image_key(row)
+                if row['run'] > latest_run.get(key, ''):
+                    latest_run[key] = row['run']
+
+    for path in paths:
+        for row in _read_lines(path):
+            if latest_run is not None and latest_run[_image_key(row)] != row['run']:
+                continue
+            if run is not None and row['run'] != run:
+                continue
+            if date_from is not None and not (row['date'] >= date_from):
+                continue
+            if date_to is not None and not (row['date'] <= date_to):
+                continue
+            if receipt_type is not None and row['type'] != receipt_type:
+                continue
+            if status is not None and row['status'] != status:
+                continue
+            yield row
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Manifest of already processed receipt images.
+
+Entries are keyed by content hash, so a receipt is recognized after it has been renamed
+to N.PNG or copied. Each entry also remembers the (device, inode, size, mtime) of the
+files it was seen as; renames keep all four, so known files are matched with one stat()
+and never re-read, let alone re-OCRed.
+"""
+import json
+import logging
+import os
+
+from src.ocr_cache import hash_image_file
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def stat_key(path):
+    """Identity of a file that survives renames but not content changes."""
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class Manifest:
+    """
+    Parsed fields per image content hash, persisted as JSON.
+    settings_key must change whenever the OCR settings or parser change the fields;
+    a manifest written under other settings is ignored.
+    """
+
+    def __init__(self, path, settings_key):
+        self.path = path
+        self.settings_key = settings_key
+        self._entries = {}   # sha256 -> {'fields': [type, date, time, amount], 'stats': set of stat keys}
+        self._by_stat = {}   # stat key -> sha256
+        self._dhashes = {}   # stat key -> perceptual hash (duplicate detection)
+        self._seen = set()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable manifest {self.path}: {e}")
+            return
+        if data.get('version') != MANIFEST_VERSION or data.get('settings') != self.settings_key:
+            logger.info("OCR settings changed since the manifest was written; starting a new one.")
+            return
+        for sha, entry in data['entries'].items():
+            stats = {tuple(key) for key in entry['stats']}
+            self._entries[sha] = {'fields': entry['fields'], 'stats': stats}
+            for key in stats:
+                self._by_stat[key] = sha
+        for *key, value in data.get('dhashes', ()):
+            self._dhashes[tuple(key)] = value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, path):
+        """Returns the stored (receipt_type, date, time, amount) for the file at path, or None."""
+        key = stat_key(path)
+        sha = self._by_stat.get(key)
+        if sha is None:
+            return None
+        self._seen.add(key)
+        return tuple(self._entries[sha]['fields'])
+
+    def content_hash(self, path):
+        """SHA-256 of the file at path if it is a known file (matched by stat alone), else None."""
+        return self._by_stat.get(stat_key(path))
+
+    def add(self, path, fields):
+        """Records the parsed fields for the file at path (hashing it once)."""
+        key = stat_key(path)
+        sha = hash_image_file(path)
+        entry = self._entries.setdefault(sha, {'fields': None, 'stats': set()})
+        entry['fields'] = list(fields)
+        entry['stats'].add(key)
+        self._by_stat[key] = sha
+        self._seen.add(key)
+
+    def get_dhash(self, path):
+        """Perceptual hash remembered for the file at path, or None."""
+        key = stat_key(path)
+        value = self._dhashes.get(key)
+        if value is not None:
+            self._seen.add(key)
+        return value
+
+    def set_dhash(self, path, value):
+        key = stat_key(path)
+        self._dhashes[key] = value
+        self._seen.add(key)
+
+    def save(self):
+        """Writes the manifest, keeping only files looked up or added since it was loaded."""
+        entries = {}
+        for sha, entry in self._entries.items():
+            stats = entry['stats'] & self._seen
+            if stats:
+                entries[sha] = {'fields': entry['fields'], 'stats': sorted(stats)}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            dhashes = [[*key, value] for key, value in self._dhashes.items() if key in self._seen]
+            json.dump({'version': MANIFEST_VERSION, 'settings': self.settings_key, 'entries': entries,
+                       'dhashes': dhashes}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Memory budget for concurrent image decodes.
+
+A fixed worker count bounds how many images are decoded at once, not how much memory
+that takes: eight workers on 40-megapixel scans need far more than eight on phone
+screenshots. Workers instead reserve their estimated decode size from a shared budget
+and wait while it is used up, so peak RSS follows the budget whatever the image sizes.
+"""
+import threading
+from contextlib import contextmanager
+
+from src.metrics import METRICS
+
+
+class MemoryBudget:
+    """
+    Byte budget shared by threads. A reservation larger than the whole budget is still
+    granted once nothing else is reserved, so an oversized image runs alone instead of never.
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes
+        self.in_use = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+    def _fits(self, nbytes):
+        return self.in_use == 0 or self.in_use + nbytes <= self.limit
+
+    def acquire(self, nbytes):
+        with self._condition:
+            if not self._fits(nbytes):
+                METRICS.add('decode_budget_waits')
+                with METRICS.stage('decode_wait'):
+                    self._condition.wait_for(lambda: self._fits(nbytes))
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+
+    def release(self, nbytes):
+        with self._condition:
+            self.in_use -= nbytes
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        """Holds nbytes of the budget for the enclosed block, waiting until they are free."""
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight per-stage timing and resource instrumentation.
+
+Code on the hot path wraps work in `METRICS.stage(name)`; when metrics are disabled
+(the default) that costs one attribute check. Enabled, every stage records wall and
+thread CPU time, and the report adds percentiles, byte counters and peak RSS.
+"""
+import json
+import math
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _peak_rss_bytes(who):
+    """Peak resident set size of this process or of its (waited-for) children."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(who)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+def summarize(values):
+    """count/total/mean/max and PERCENTILES of a list of numbers."""
+    values = sorted(values)
+    summary = {
+        'count': len(values),
+        'total': round(sum(values), 6),
+        'mean': round(sum(values) / len(values), 6),
+        'max': round(values[-1], 6),
+    }
+    for pct in PERCENTILES:
+        summary[f'p{pct}'] = round(_percentile(values, pct), 6)
+    return summary
+
+
+class Metrics:
+    """Thread-safe collector for stage timings, byte counters and per-image records."""
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._wall = defaultdict(list)
+            self._cpu = defaultdict(list)
+            self._counters = defaultdict(int)
+            self._images = []
+            self._started = time.perf_counter()
+            self._cpu_started = time.process_time()
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed block as one sample of stage `name`."""
+        if not self.enabled:
+            yield
+            return
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.thread_time() - cpu_start
+            with self._lock:
+                self._wall[name].append(wall)
+                self._cpu[name].append(cpu)
+
+    def add(self, counter, value=1):
+        """Adds to a named counter such as 'bytes_read' or 'bytes_written'."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[counter] += value
+
+    def record_image(self, filename, **fields):
+        """Stores a per-image record (timings, sizes, outcome) for the report."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._images.append({'filename': filename, **fields})
+
+    def report(self):
+        """Builds the report dict: per-stage wall/CPU percentiles, counters, RSS and images."""
+        with self._lock:
+            stages = {
+                name: {'wall': summarize(self._wall[name]), 'cpu': summarize(self._cpu[name])}
+                for name in self._wall
+            }
+            counters = dict(self._counters)
+            images = list(self._images)
+            elapsed = time.perf_counter() - self._started
+            cpu = time.process_time() - self._cpu_started
+
+        children_cpu = None
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            children_cpu = round(usage.ru_utime + usage.ru_stime, 6)
+        return {
+            'wall_seconds': round(elapsed, 6),
+            'cpu_seconds': round(cpu, 6),
+            'children_cpu_seconds': children_cpu,
+            'peak_rss_bytes': _peak_rss_bytes(resource.RUSAGE_SELF) if resource else None,
+            'children_peak_rss_bytes': _peak_rss_bytes(resource.RUSAGE_CHILDREN) if resource else None,
+            'counters': counters,
+            'stages': stages,
+            'images': images,
+        }
+
+    def write(self, path):
+        """Writes the report as JSON, or as JSONL (one record per line) if path ends in .jsonl."""
+        report = self.report()
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                run = {key: value for key, value in report.items() if key not in ('stages', 'images')}
+                f.write(json.dumps({'type': 'run', **run}, ensure_ascii=False) + "\n")
+                for name, summary in report['stages'].items():
+                    f.write(json.dumps({'type': 'stage', 'stage': name, **summary}, ensure_ascii=False) + "\n")
+                for image in report['images']:
+                    f.write(json.dumps({'type': 'image', **image}, ensure_ascii=False) + "\n")
+            else:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
+
+
+METRICS = Metrics()
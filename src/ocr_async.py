@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio OCR orchestrator.
+
+Every image gets its own tesseract child (asyncio.create_subprocess_exec) under a
+concurrency limit and a per-attempt timeout. When an attempt times out or fails, the
+image is retried a bounded number of times with lighter settings (the preprocessed image
+downscaled to each of retry_widths), and after that it yields "" like any other OCR
+failure. Cancellation (Ctrl-C, or the pipeline stopping) kills the children and removes
+any temporary files, so a batch never waits longer than its timeouts allow.
+"""
+import asyncio
+import logging
+import os
+import subprocess
+import tempfile
+
+from src import receipt_parser
+from src.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Widths (px) to downscale to on each retry; widths at or above the image width are skipped
+RETRY_WIDTHS = (1600, 1000)
+
+
+async def _run_tesseract_async(source, input_bytes, timeout):
+    """Runs one tesseract child and returns its text; kills it on timeout or cancellation."""
+    process = await asyncio.create_subprocess_exec(
+        *receipt_parser.tesseract_command(source),
+        stdin=asyncio.subprocess.PIPE if input_bytes is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(input_bytes), timeout)
+    except BaseException:
+        # Timeout or cancellation: never leave a tesseract process behind
+        if process.returncode is None:
+            process.kill()
+            await asyncio.shield(process.wait())
+        raise
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, 'tesseract', stdout, stderr)
+    return stdout.decode('utf-8')
+
+
+async def _ocr_attempt_via_file(img, timeout):
+    """OCRs a preprocessed image through a temporary PNG file."""
+    fd, path = tempfile.mkstemp(suffix="_processed.png")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(img.save, path)
+        return await _run_tesseract_async(path, None, timeout)
+    finally:
+        os.remove(path)
+
+
+async def _ocr_attempt(img, timeout):
+    """
+    OCRs a preprocessed image over stdin, or through a temporary file if stdin is unsupported;
+    like the synchronous path, a failed stdin read is retried via a file once and stdin
+    is then disabled for the whole process.
+    """
+    with METRICS.stage('tesseract'):
+        if receipt_parser.stdin_enabled():
+            data = receipt_parser.encode_pgm(img)
+            METRICS.add('bytes_piped', len(data))
+            try:
+                return await _run_tesseract_async('stdin', data, timeout)
+            except subprocess.CalledProcessError as e:
+                logger.debug(f"Reading the image from stdin failed, retrying via a temporary file: {e}")
+                text = await _ocr_attempt_via_file(img, timeout)
+                receipt_parser.disable_stdin()
+                return text
+        return await _ocr_attempt_via_file(img, timeout)
+
+
+def _downscale(img, width):
+    from PIL import Image
+    return img.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS)
+
+
+async def ocr_image_async(image_path, timeout=None, retry_widths=RETRY_WIDTHS):
+    """
+    Preprocesses and OCRs one image with retries. Returns (text, attempt), where attempt is
+    0 for the normal settings and n for the n-th lighter retry; text is "" if all attempts failed.
+    """
+    timeout = timeout or receipt_parser.OCR_TIMEOUT
+    img = await asyncio.to_thread(receipt_parser._preprocess_image, image_path)
+    if img is None:
+        return "", 0
+
+    attempts = [None] + [width for width in sorted(retry_widths, reverse=True) if width < img.width]
+    for attempt, width in enumerate(attempts):
+        candidate = img if width is None else await asyncio.to_thread(_downscale, img, width)
+        try:
+            text = await _ocr_attempt(candidate, timeout)
+        except asyncio.TimeoutError:
+            METRICS.add('ocr_timeouts')
+            logger.warning(f"OCR of {image_path} timed out after {timeout}s (attempt {attempt + 1}/{len(attempts)}).")
+            continue
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.warning(f"OCR of {image_path} failed (attempt {attempt + 1}/{len(attempts)}): {e}")
+            continue
+        if attempt:
+            METRICS.add('ocr_retries_succeeded')
+            logger.info(f"  - {os.path.basename(image_path)}: {width}px 재시도로 OCR 성공")
+        logger.debug(f"Successfully extracted text from {image_path}:\n---START TEXT---\n{text}\n---END TEXT---")
+        return text, attempt
+
+    logger.error(f"Giving up on {image_path} after {len(attempts)} OCR attempts.")
+    return "", len(attempts) - 1
+
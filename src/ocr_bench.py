@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Compares per-image tesseract runs against batched runs on a folder of receipts;
+--roi adds the region-of-interest mode (config.ROI_TEMPLATES).
+
+    python -m src.ocr_bench ./receipt_images --batch-sizes 4 8 16 --repeat 3 --roi
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from src.receipt_parser import (
+    extract_text_from_image,
+    extract_texts_from_images,
+    get_tesseract_version,
+    read_receipt_roi
+)
+
+
+def _time_per_file(image_paths):
+    """OCRs every image with its own tesseract process."""
+    start = time.perf_counter()
+    texts = [extract_text_from_image(image_path) for image_path in image_paths]
+    return time.perf_counter() - start, texts
+
+
+def _time_batched(image_paths, batch_size):
+    """OCRs the images in batches of batch_size per tesseract process."""
+    start = time.perf_counter()
+    texts = []
+    for i in range(0, len(image_paths), batch_size):
+        texts.extend(extract_texts_from_images(image_paths[i:i + batch_size]))
+    return time.perf_counter() - start, texts
+
+
+def _time_roi(image_paths, roi):
+    """Region OCR of every image, with the full-image OCR fallback; returns (seconds, fallbacks)."""
+    templates, header_fraction, header_scale = roi
+    start = time.perf_counter()
+    fallbacks = 0
+    for image_path in image_paths:
+        if read_receipt_roi(image_path, templates, header_fraction, header_scale) is None:
+            fallbacks += 1
+            extract_text_from_image(image_path)
+    return time.perf_counter() - start, fallbacks
+
+
+def _normalize(text):
+    """Ignores the trailing form feed/whitespace that differs between tesseract output modes."""
+    return text.strip().strip('\f').strip()
+
+
+def run_benchmark(image_paths, batch_sizes, repeat, roi=None):
+    """
+    Runs each mode `repeat` times and returns a list of result dicts.
+    roi is (templates, header_fraction, header_scale) to also time region OCR; its texts
+    are not comparable, so it reports the images that fell back to full OCR instead.
+    """
+    results = []
+    baseline_texts = None
+    modes = [('per-file', None)] + [(f'batch-{size}', size) for size in batch_sizes]
+    for name, batch_size in modes:
+        timings = []
+        for _ in range(repeat):
+            if batch_size is None:
+                elapsed, texts = _time_per_file(image_paths)
+            else:
+                elapsed, texts = _time_batched(image_paths, batch_size)
+            timings.append(elapsed)
+        if baseline_texts is None:
+            baseline_texts = [_normalize(text) for text in texts]
+        mismatches = sum(1 for a, b in zip(baseline_texts, texts) if a != _normalize(b))
+        median = statistics.median(timings)
+        results.append({
+            'mode': name,
+            'batch_size': batch_size or 1,
+            'images': len(image_paths),
+            'median_seconds': round(median, 4),
+            'ms_per_image': round(median / len(image_paths) * 1000, 2),
+            'runs': [round(t, 4) for t in timings],
+            'text_mismatches_vs_per_file': mismatches,
+        })
+    if roi is not None:
+        timings = []
+        for _ in range(repeat):
+            elapsed, fallbacks = _time_roi(image_paths, roi)
+            timings.append(elapsed)
+        median = statistics.median(timings)
+        results.append({
+            'mode': 'roi',
+            'batch_size': 1,
+            'images': len(image_paths),
+            'median_seconds': round(median, 4),
+            'ms_per_image': round(median / len(image_paths) * 1000, 2),
+            'runs': [round(t, 4) for t in timings],
+            'roi_fallbacks': fallbacks,
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-file vs batched tesseract benchmark")
+    parser.add_argument("image_dir", help="영수증 이미지 디렉토리")
+    parser.add_argument("--batch-sizes", type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--limit", type=int, default=None, help="사용할 최대 이미지 수")
+    parser.add_argument("--output", default=None, help="결과를 저장할 JSON 파일 경로")
+    parser.add_argument("--roi", action="store_true", help="config.ROI_TEMPLATES 영역 OCR도 측정 (전체 OCR 대체 포함)")
+    args = parser.parse_args(argv)
+
+    image_paths = sorted(
+        os.path.join(args.image_dir, f) for f in os.listdir(args.image_dir)
+        if f.lower().endswith(('.png', '.jpg', '.jpeg'))
+    )[:args.limit]
+    if not image_paths:
+        print(f"{args.image_dir} 에서 이미지 파일을 찾을 수 없습니다.", file=sys.stderr)
+        return 1
+
+    roi = None
+    if args.roi:
+        import config
+        roi = (config.ROI_TEMPLATES, config.ROI_HEADER_FRACTION, config.ROI_HEADER_SCALE)
+    results = run_benchmark(image_paths, args.batch_sizes, args.repeat, roi)
+    baseline = results[0]['median_seconds']
+    print(f"tesseract: {get_tesseract_version()}, 이미지: {len(image_paths)}개, 반복: {args.repeat}회")
+    print(f"{'mode':<12}{'median(s)':>12}{'ms/image':>12}{'speedup':>10}{'mismatch':>10}")
+    for row in results:
+        speedup = baseline / row['median_seconds'] if row['median_seconds'] else float('inf')
+        print(f"{row['mode']:<12}{row['median_seconds']:>12.3f}{row['ms_per_image']:>12.1f}"
+              f"{speedup:>9.2f}x{row.get('text_mismatches_vs_per_file', '-'):>10}")
+    if roi is not None:
+        print(f"roi: 전체 OCR로 대체된 이미지 {results[-1]['roi_fallbacks']}개 (시간에 포함)")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'tesseract': get_tesseract_version(), 'results': results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_image_file(image_path):
+    """Returns the SHA-256 hex digest of an image file's bytes."""
+    digest = hashlib.sha256()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class OcrCache:
+    """
+    Persistent OCR result cache backed by SQLite.
+    Entries are keyed by the image content hash plus the OCR settings, so they
+    survive file renames and are invalidated when tesseract or preprocessing changes.
+    """
+
+    def __init__(self, db_path, settings_key, parser_version):
+        self.db_path = db_path
+        self.settings_key = settings_key
+        self.parser_version = parser_version
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL keeps per-result commits cheap so progress survives an interrupted run
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS ocr_results (
+                key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                receipt_type TEXT,
+                date TEXT,
+                time TEXT,
+                amount TEXT,
+                parser_version INTEGER,
+                created_at TEXT
+            )"""
+        )
+        self._conn.commit()
+
+    def key_for(self, image_path):
+        """Builds the cache key for an image from its bytes and the OCR settings."""
+        settings_digest = hashlib.sha256(self.settings_key.encode('utf-8')).hexdigest()[:16]
+        return f"{hash_image_file(image_path)}:{settings_digest}"
+
+    @staticmethod
+    def content_hash(key):
+        """The image's SHA-256 from a key made by key_for, so callers needn't hash the file again."""
+        return key.split(':', 1)[0]
+
+    def get(self, key):
+        """
+        Looks up a cached OCR result.
+        Returns (text, parsed) where parsed is (receipt_type, date, time, amount), or
+        None if parsed fields came from an older parser version. Returns None on a miss.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, receipt_type, date, time, amount, parser_version "
+                "FROM ocr_results WHERE key = ?",
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        text, receipt_type, date, time, amount, parser_version = row
+        if parser_version != self.parser_version:
+            return text, None
+        return text, (receipt_type, date, time, amount)
+
+    def put(self, key, text, parsed):
+        """Stores the OCR text and parsed (receipt_type, date, time, amount) for a key."""
+        receipt_type, date, time, amount = parsed
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, text, receipt_type, date, time, amount,
+                 self.parser_version, datetime.now().isoformat(timespec='seconds'))
+            )
+            self._conn.commit()
+
+    def close(self):
+        """Closes the underlying database connection."""
+        with self._lock:
+            self._conn.close()
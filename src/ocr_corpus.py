@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Recorded OCR corpus for parser regression tests.
+
+A run with --record appends one JSON line per OCRed image: its content hash, file name,
+raw OCR text and the fields parsed from it. `replay` runs the parsers over every
+recorded text again, with no images and no tesseract, and diffs the fields against the
+recording; fields listed in an entry's optional "expected" object (hand-corrected
+values) take precedence over the recorded ones:
+
+    {"sha256": "...", "file": "IMG_6203.PNG", "text": "...",
+     "parsed": {"receipt_type": "하나카드", "date": "2026-01-06", "time": "12:40:40", "amount": "12000"},
+     "expected": {"amount": "12500"}}
+
+Paths ending in .gz are read and written gzip-compressed.
+"""
+import json
+import os
+import time
+from collections import Counter, namedtuple
+
+from src.ocr_cache import hash_image_file
+from src.receipt_parser import (
+    PARSER_VERSION, classify_receipt, find_amount, find_date, find_time, parse_receipt_text
+)
+
+FIELDS = ('receipt_type', 'date', 'time', 'amount')
+
+# diffs: [(entry index, file name, field, expected, got)]; field_diffs: Counter of field names
+ReplayResult = namedtuple('ReplayResult', ['receipts', 'seconds', 'diffs', 'field_diffs'])
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        import gzip
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def read_corpus(path):
+    """Yields the corpus entries in file order."""
+    with _open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class CorpusWriter:
+    """Appends recognized receipts to a corpus, skipping images whose content is already in it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._known = set()
+        if os.path.exists(path):
+            self._known = {entry['sha256'] for entry in read_corpus(path)}
+        self._file = _open(path, 'a')
+        self.added = 0
+
+    def record(self, image_path, filename, text, parsed, sha256=None):
+        """Adds one receipt; sha256 is the image's content hash if the caller already has it."""
+        sha = sha256 or hash_image_file(image_path)
+        if sha in self._known:
+            return
+        self._known.add(sha)
+        entry = {'sha256': sha, 'file': filename, 'text': text,
+                 'parsed': dict(zip(FIELDS, parsed)), 'parser_version': PARSER_VERSION}
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.added += 1
+
+    def __contains__(self, sha):
+        """Whether an image with this content hash is already in the corpus."""
+        return sha in self._known
+
+    def close(self):
+        self._file.close()
+
+
+def parse_reference(text):
+    """The per-field parsers one by one, as opposed to the single-pass parse_receipt_text."""
+    receipt_type = classify_receipt(text)
+    return receipt_type, find_date(text), find_time(text), find_amount(text, receipt_type)
+
+
+def replay_corpus(entries, parse=parse_receipt_text):
+    """
+    Parses every entry's text with `parse` and compares each field with the entry's
+    expected value, or its recorded one. Only the parsing is timed.
+    """
+    entries = list(entries)
+    start = time.perf_counter()
+    results = [parse(entry['text']) for entry in entries]
+    seconds = time.perf_counter() - start
+
+    diffs = []
+    field_diffs = Counter()
+    for idx, (entry, got) in enumerate(zip(entries, results)):
+        want = {**entry['parsed'], **entry.get('expected', {})}
+        for field, value in zip(FIELDS, got):
+            if str(want[field]) != str(value):
+                diffs.append((idx, entry['file'], field, want[field], value))
+                field_diffs[field] += 1
+    return ReplayResult(len(entries), seconds, diffs, field_diffs)
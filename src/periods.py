@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Budget periods for multi-period allocation (--period).
+
+Each period has its own limit and an optional window of receipt dates it accepts, given
+on the command line as LIMIT[:START[:END]] with dates as YYYY-MM-DD; either end of the
+window may be left empty. Receipts not claimed in their own month carry over when a
+later period's window still covers their date:
+
+    --period 100000::2026-01-31 --period 100000::2026-02-28
+"""
+from collections import namedtuple
+from datetime import datetime
+
+# start/end: 'YYYY-MM-DD' bounds of the accepted receipt dates (inclusive), None if open
+Period = namedtuple('Period', ['limit', 'start', 'end'])
+
+
+def _parse_date(value):
+    """Normalizes a YYYY-MM-DD date so that dates compare as strings; raises ValueError."""
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+
+
+def parse_period(spec):
+    """Parses LIMIT[:START[:END]]; raises ValueError on a malformed spec."""
+    parts = spec.split(':')
+    if len(parts) > 3 or not parts[0].isdigit():
+        raise ValueError(f"기간은 한도[:시작일[:종료일]] 형식이어야 합니다: {spec}")
+    try:
+        start, end = (_parse_date(part) for part in (parts[1:] + ['', ''])[:2])
+    except ValueError:
+        raise ValueError(f"날짜는 YYYY-MM-DD 형식이어야 합니다: {spec}") from None
+    if start and end and start > end:
+        raise ValueError(f"시작일이 종료일보다 늦습니다: {spec}")
+    return Period(int(parts[0]), start, end)
+
+
+def describe_period(period):
+    """'2026-01-01 ~ 2026-01-31', with open ends left blank, or '전체 기간' without a window."""
+    if period.start is None and period.end is None:
+        return "전체 기간"
+    return f"{period.start or ''} ~ {period.end or ''}".strip()
+
+
+def eligible_periods(date, periods):
+    """
+    Indexes of the periods whose window covers date ('YYYY-MM-DD'). A receipt whose date
+    could not be read only goes to periods without a window.
+    """
+    try:
+        date = _parse_date(date)
+    except ValueError:
+        date = None
+    if date is None:
+        return [idx for idx, period in enumerate(periods) if period.start is None and period.end is None]
+    return [idx for idx, period in enumerate(periods)
+            if (period.start is None or period.start <= date) and (period.end is None or date <= period.end)]
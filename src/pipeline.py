@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming extraction pipeline: image discovery -> cache lookup -> recognition
+(preprocess, OCR, parse) -> caller-side validation, connected by bounded queues.
+
+Only `queue_depth` batches of work and `queue_depth` finished results are ever in
+flight, so memory is bounded by the queue depth and worker count instead of the
+folder size, and each result reaches the caller the moment it is parsed.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from src.metrics import METRICS
+from src.receipt_parser import (
+    extract_text_from_image,
+    extract_texts_from_images,
+    parse_receipt_text,
+    read_receipt_cascade,
+    read_receipt_roi
+)
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# batch_size: images per tesseract run for full-image OCR
+# roi_templates/roi_header_fraction/roi_header_scale: region-of-interest OCR (None disables)
+# cascade_widths/amount_range: multi-resolution cascade (None disables)
+# async_ocr/retry_widths: one asyncio tesseract child per image, retried downscaled to retry_widths
+OcrOptions = namedtuple('OcrOptions', [
+    'batch_size', 'roi_templates', 'roi_header_fraction', 'roi_header_scale',
+    'cascade_widths', 'amount_range', 'async_ocr', 'retry_widths'
+], defaults=(False, ()))
+
+_DONE = object()
+
+
+def list_image_files(input_dir):
+    """Lists receipt image file names in directory order."""
+    return [f for f in os.listdir(input_dir) if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def ocr_options_key(options):
+    """Describes the OCR mode options that change the OCR text, for the OCR cache key."""
+    key = ""
+    if options.roi_templates:
+        key += (
+            f"|roi3={sorted(options.roi_templates.items())}"
+            f"|header={options.roi_header_fraction}x{options.roi_header_scale}"
+        )
+    if options.cascade_widths:
+        low, high = options.amount_range
+        key += f"|cascade={sorted(options.cascade_widths)}|amount={low}-{high}"
+    return key
+
+
+def recognize_receipts(image_paths, options):
+    """
+    OCRs and parses a group of receipt images, using one tesseract run for the whole group.
+    With ROI templates, each image is first read region by region and only the ones that
+    fail to parse go through full-image OCR. With cascade widths, full-image OCR starts at
+    reduced resolutions and only escalates when the fields don't check out.
+    Returns one (text, parsed) per image, or None where no text was found.
+    """
+    results = [None] * len(image_paths)
+    full_ocr = []
+    for idx, image_path in enumerate(image_paths):
+        logger.info(f"  - 처리 중: {os.path.basename(image_path)}")
+        start = time.perf_counter()
+        if options.roi_templates:
+            results[idx] = read_receipt_roi(
+                image_path, options.roi_templates, options.roi_header_fraction, options.roi_header_scale
+            )
+            if results[idx] is not None:
+                METRICS.record_image(os.path.basename(image_path), mode='roi', seconds=time.perf_counter() - start)
+                continue
+        if options.cascade_widths:
+            results[idx] = read_receipt_cascade(image_path, options.cascade_widths, options.amount_range)
+            METRICS.record_image(os.path.basename(image_path), mode='cascade', seconds=time.perf_counter() - start)
+            continue
+        full_ocr.append(idx)
+
+    start = time.perf_counter()
+    if not full_ocr:
+        texts = []
+    elif len(full_ocr) == 1:
+        texts = [extract_text_from_image(image_paths[full_ocr[0]])]
+    else:
+        texts = extract_texts_from_images([image_paths[idx] for idx in full_ocr])
+    for idx, text in zip(full_ocr, texts):
+        results[idx] = (text, parse_receipt_text(text)) if text else None
+    # A batch shares one tesseract run, so each image is charged an equal share
+    share = (time.perf_counter() - start) / max(1, len(full_ocr))
+    for idx in full_ocr:
+        METRICS.record_image(os.path.basename(image_paths[idx]), mode='full', seconds=share, batch=len(full_ocr))
+    return results
+
+
+async def recognize_receipt_async(image_path, options):
+    """
+    Async counterpart of recognize_receipts for one image. Returns (result, cacheable):
+    results from a lighter retry are not cached, so a later run can try full settings again.
+    ROI and cascade modes run their synchronous path in a worker thread.
+    """
+    # asyncio (and the ssl it pulls in) is only loaded for --async-ocr and serve
+    import asyncio
+    from src.ocr_async import ocr_image_async
+
+    if options.roi_templates or options.cascade_widths:
+        results = await asyncio.to_thread(recognize_receipts, [image_path], options)
+        return results[0], True
+
+    logger.info(f"  - 처리 중: {os.path.basename(image_path)}")
+    start = time.perf_counter()
+    text, attempt = await ocr_image_async(image_path, retry_widths=options.retry_widths)
+    result = (text, parse_receipt_text(text)) if text else None
+    METRICS.record_image(os.path.basename(image_path), mode='async', seconds=time.perf_counter() - start,
+                         attempt=attempt)
+    return result, attempt == 0
+
+
+def _get(source_queue, stop_event):
+    """Gets from a queue, returning None once stop_event is set."""
+    while not stop_event.is_set():
+        try:
+            return source_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return None
+
+
+async def _recognize_stream(work_queue, result_queue, stop_event, options, jobs):
+    """
+    Recognition stage for async_ocr: runs up to `jobs` images concurrently on one event loop.
+    Work is only taken from the queue when a slot is free, so the queue stays the backpressure point.
+    """
+    import asyncio
+
+    slots = asyncio.Semaphore(jobs)
+    running = set()
+
+    async def handle(index, filename, image_path, key):
+        try:
+            result, cacheable = await recognize_receipt_async(image_path, options)
+            item = (index, filename, result, False, key, cacheable)
+            await asyncio.to_thread(_put, result_queue, item, stop_event)
+        finally:
+            slots.release()
+
+    async def acquire_slot():
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(slots.acquire(), 0.1)
+                return True
+            except asyncio.TimeoutError:
+                continue
+        return False
+
+    try:
+        while not stop_event.is_set():
+            batch = await asyncio.to_thread(_get, work_queue, stop_event)
+            if batch is None or batch is _DONE:
+                break
+            for index, filename, image_path, key in batch:
+                if not await acquire_slot():
+                    break
+                task = asyncio.create_task(handle(index, filename, image_path, key))
+                running.add(task)
+                task.add_done_callback(running.discard)
+        while running and not stop_event.is_set():
+            await asyncio.wait(running, timeout=0.1)
+    finally:
+        # Stopping early cancels in-flight OCR, which kills the tesseract children
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+def _put(target_queue, item, stop_event):
+    """Puts into a bounded queue, giving up once stop_event is set. Returns False if stopped."""
+    while not stop_event.is_set():
+        try:
+            target_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def stream_receipts(input_dir, image_files, options, jobs=1, cache=None, queue_depth=16):
+    """
+    Runs the extraction pipeline over image_files and yields (index, filename, result, from_cache,
+    sha256) as soon as each image is parsed; result is (text, parsed) or None if no text was found,
+    and sha256 is the content hash the cache lookup computed (None without a cache).
+    Results arrive in completion order; `index` is the position in image_files.
+    Closing the generator early (e.g. on a fail-fast validation error) stops the
+    discovery and recognition stages and waits for in-flight work to wind down.
+    """
+    jobs = max(1, jobs)
+    queue_depth = max(1, queue_depth)
+    stop_event = threading.Event()
+    work_queue = queue.Queue(maxsize=queue_depth)
+    result_queue = queue.Queue(maxsize=queue_depth)
+
+    # Never make batches so large that some workers are left without one
+    batch_size = max(1, min(options.batch_size, -(-len(image_files) // jobs)))
+
+    def discover():
+        batch = []
+        try:
+            for index, filename in enumerate(image_files):
+                if stop_event.is_set():
+                    return
+                image_path = os.path.join(input_dir, filename)
+                key = None
+                if cache is not None:
+                    with METRICS.stage('cache_lookup'):
+                        key = cache.key_for(image_path)
+                        cached = cache.get(key)
+                    METRICS.add('bytes_read', os.path.getsize(image_path))
+                    if cached is not None:
+                        text, parsed = cached
+                        if parsed is None:
+                            parsed = parse_receipt_text(text)
+                            cache.put(key, text, parsed)
+                        METRICS.record_image(filename, mode='cache')
+                        if not _put(result_queue, (index, filename, (text, parsed), True, key, False), stop_event):
+                            return
+                        continue
+                batch.append((index, filename, image_path, key))
+                if len(batch) >= batch_size:
+                    if not _put(work_queue, batch, stop_event):
+                        return
+                    batch = []
+            if batch:
+                _put(work_queue, batch, stop_event)
+        except Exception:
+            logger.exception("Image discovery failed")
+            stop_event.set()
+        finally:
+            for _ in range(1 if options.async_ocr else jobs):
+                _put(work_queue, _DONE, stop_event)
+
+    def recognize_async():
+        import asyncio
+        try:
+            asyncio.run(_recognize_stream(work_queue, result_queue, stop_event, options, jobs))
+        except Exception:
+            logger.exception("Receipt recognition failed")
+            stop_event.set()
+        finally:
+            _put(result_queue, _DONE, stop_event)
+
+    def recognize():
+        try:
+            while not stop_event.is_set():
+                try:
+                    batch = work_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if batch is _DONE:
+                    break
+                results = recognize_receipts([image_path for _, _, image_path, _ in batch], options)
+                for (index, filename, _, key), result in zip(batch, results):
+                    if not _put(result_queue, (index, filename, result, False, key, True), stop_event):
+                        return
+        except Exception:
+            logger.exception("Receipt recognition failed")
+            stop_event.set()
+        finally:
+            _put(result_queue, _DONE, stop_event)
+
+    threads = [threading.Thread(target=discover, name="receipt-discover", daemon=True)]
+    if options.async_ocr:
+        # One event loop runs all `jobs` tesseract children
+        workers = 1
+        threads.append(threading.Thread(target=recognize_async, name="receipt-ocr-async", daemon=True))
+    else:
+        workers = jobs
+        threads += [threading.Thread(target=recognize, name=f"receipt-ocr-{i}", daemon=True) for i in range(jobs)]
+    for thread in threads:
+        thread.start()
+
+    finished_workers = 0
+    try:
+        while finished_workers < workers:
+            try:
+                item = result_queue.get(timeout=0.1)
+            except queue.Empty:
+                if stop_event.is_set():
+                    raise RuntimeError("영수증 추출 파이프라인이 오류로 중단되었습니다.")
+                continue
+            if item is _DONE:
+                finished_workers += 1
+                continue
+            index, filename, result, from_cache, key, store = item
+            if result is not None and key is not None and store:
+                cache.put(key, *result)
+            yield index, filename, result, from_cache, cache.content_hash(key) if key is not None else None
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
@@ -2,47 +2,287 @@
 import subprocess
 import re
 import os
+import io
 import logging
-from PIL import Image, ImageEnhance
+import functools
+import contextlib
+import ctypes
+import math
+import tempfile
+import threading
+from src.field_extractor import extract_fields
+from src.metrics import METRICS
+from src.memory_budget import MemoryBudget
 
 logger = logging.getLogger(__name__)
 
+# Pillow is imported inside the functions that touch images, so importing this module
+# (and starting the CLI) doesn't pay for it until the first image is decoded
+
+# OCR settings; anything that changes the OCR text must be part of ocr_settings_key()
+OCR_LANGUAGE = 'kor+eng'
+OCR_PSM = '6'
+CONTRAST_FACTOR = 2.0
+# Images above this many pixels are decoded at a reduced scale (JPEG in the DCT domain); 0 = never
+DECODE_MAX_PIXELS = 20_000_000
+
+# MemoryBudget that concurrent decodes reserve their estimated peak from; None = no limit
+DECODE_BUDGET = None
+
+# Seconds a single image may take in tesseract before the run is killed (batches get one share per page)
+OCR_TIMEOUT = 60
+
+# Hand preprocessed images to tesseract over stdin instead of through a temporary file
+OCR_VIA_STDIN = True
+_stdin_supported = True
+
+# Per-stage attempts/hits of the multi-resolution cascade, shared by all OCR workers
+_cascade_stats = {}
+_cascade_stats_lock = threading.Lock()
+
+# Marker tesseract writes between pages when several images are OCRed in one run
+OCR_PAGE_SEPARATOR = '<<<RECEIPT-PAGE-BREAK>>>'
+
+# White pixels between the template regions stacked into one image for region OCR
+ROI_GAP = 24
+
+# Bump whenever classify_receipt/find_* (and field_extractor) change so cached parse results are refreshed
+PARSER_VERSION = 1
+
+def set_decode_budget(limit_bytes):
+    """Caps the memory of concurrent decodes at limit_bytes (0 or None removes the cap)."""
+    global DECODE_BUDGET
+    if not limit_bytes and DECODE_BUDGET is None:
+        return
+    from PIL import Image
+    DECODE_BUDGET = MemoryBudget(limit_bytes) if limit_bytes else None
+    # Pool freed image blocks in Pillow: left to malloc, each worker thread's arena keeps
+    # its own high-water mark resident and RSS grows past the budget
+    Image.core.set_blocks_max(limit_bytes // Image.core.get_block_size() if limit_bytes else 0)
+
+def _contrast_lut(histogram, factor):
+    """
+    Lookup table equivalent to ImageEnhance.Contrast(img).enhance(factor) for an 'L' image,
+    which blends with a flat gray image at the rounded mean (float32, truncated, clipped).
+    """
+    count = sum(histogram)
+    mean = int(sum(value * n for value, n in enumerate(histogram)) / count + 0.5) if count else 0
+    alpha = ctypes.c_float(factor).value
+    lut = []
+    for value in range(256):
+        blended = ctypes.c_float(mean + ctypes.c_float(alpha * (value - mean)).value).value
+        lut.append(0 if blended <= 0 else 255 if blended >= 255 else int(blended))
+    return lut
+
+def _decode_estimate(img):
+    """Rough peak bytes of decoding img and converting it to grayscale (Pillow keeps RGB as 4 bytes/pixel)."""
+    pixels = img.width * img.height
+    bytes_per_pixel = 1 if img.mode in ('1', 'L', 'P') else 4
+    return pixels * (bytes_per_pixel + 1)
+
 def _preprocess_image(image_path):
-    """Preprocesses the image for better OCR results."""
+    """
+    Preprocesses the image for better OCR results. Returns the processed image or None.
+    JPEGs decode straight to grayscale, at a reduced scale if larger than DECODE_MAX_PIXELS;
+    the decode waits for room in DECODE_BUDGET so parallel workers keep a bounded peak.
+    """
+    from PIL import Image
     try:
-        img = Image.open(image_path)
-        # Convert to grayscale
-        img = img.convert('L')
-        # Increase contrast
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(2.0)
-        
-        processed_image_path = os.path.splitext(image_path)[0] + "_processed.png"
-        img.save(processed_image_path)
-        return processed_image_path
+        with METRICS.stage('preprocess'):
+            METRICS.add('bytes_read', os.path.getsize(image_path))
+            img = Image.open(image_path)
+            scale = 1
+            if DECODE_MAX_PIXELS and img.width * img.height > DECODE_MAX_PIXELS:
+                scale = math.ceil(math.sqrt(img.width * img.height / DECODE_MAX_PIXELS))
+                METRICS.add('decodes_downscaled')
+            # JPEG: grayscale and DCT-domain scaling in the decoder; other formats ignore the hint
+            img.draft('L', (img.width // scale, img.height // scale))
+            budget = DECODE_BUDGET
+            with budget.reserve(_decode_estimate(img)) if budget is not None else contextlib.nullcontext():
+                if img.mode != 'L':
+                    img = img.convert('L')
+                else:
+                    img.load()
+                if img.width * img.height > DECODE_MAX_PIXELS > 0:
+                    # Formats without draft support are reduced after decoding
+                    img = img.reduce(math.ceil(math.sqrt(img.width * img.height / DECODE_MAX_PIXELS)))
+                # Increase contrast
+                return img.point(_contrast_lut(img.histogram(), CONTRAST_FACTOR))
     except Exception as e:
         logger.error(f"Error during image preprocessing for {image_path}: {e}")
         return None
 
+def tesseract_command(source, extra_args=()):
+    """The tesseract command line for a file path, a list file or 'stdin'."""
+    return ['tesseract', source, 'stdout', '-l', OCR_LANGUAGE, '--psm', OCR_PSM, *extra_args]
+
+def encode_pgm(img):
+    """Encodes a preprocessed image for tesseract's stdin; Pillow writes grayscale images as binary PGM (P5)."""
+    buffer = io.BytesIO()
+    img.save(buffer, format='PPM')
+    return buffer.getvalue()
+
+def _run_tesseract(source, input_bytes=None, extra_args=(), pages=1):
+    """
+    Runs tesseract on a file path or on 'stdin' with the given image bytes, returning its text.
+    Raises subprocess.TimeoutExpired (after killing tesseract) if it exceeds OCR_TIMEOUT per page.
+    """
+    with METRICS.stage('tesseract'):
+        try:
+            result = subprocess.run(
+                tesseract_command(source, extra_args),
+                input=input_bytes, capture_output=True, check=True,
+                timeout=OCR_TIMEOUT * pages if OCR_TIMEOUT else None
+            )
+        except subprocess.TimeoutExpired:
+            METRICS.add('ocr_timeouts')
+            raise
+    if input_bytes is not None:
+        METRICS.add('bytes_piped', len(input_bytes))
+    return result.stdout.decode('utf-8')
+
+def _ocr_image_via_file(img):
+    """Fallback path: writes the processed image to a temporary PNG and OCRs that file."""
+    fd, processed_image_path = tempfile.mkstemp(suffix="_processed.png")
+    os.close(fd)
+    try:
+        img.save(processed_image_path)
+        return _run_tesseract(processed_image_path)
+    finally:
+        if os.path.exists(processed_image_path):
+            os.remove(processed_image_path)
+
+def stdin_enabled():
+    """Whether images are piped to tesseract: OCR_VIA_STDIN, unless the build turned out not to read stdin."""
+    return OCR_VIA_STDIN and _stdin_supported
+
+def disable_stdin():
+    """
+    Records that tesseract could not read an image from stdin while a temporary file worked,
+    so every later image (sync or async path) goes straight to a temporary file.
+    """
+    global _stdin_supported
+    if _stdin_supported:
+        logger.warning("tesseract could not read the image from stdin; using temporary files from now on.")
+    _stdin_supported = False
+
+def _ocr_image(img, image_path):
+    """
+    OCRs an already preprocessed image.
+    The image is piped to tesseract as uncompressed PGM, avoiding a PNG encode/decode and
+    a temporary file; builds that cannot read stdin fall back to a temporary file.
+    """
+    try:
+        if stdin_enabled():
+            try:
+                return _run_tesseract('stdin', encode_pgm(img))
+            except subprocess.CalledProcessError as e:
+                logger.debug(f"Reading {image_path} from stdin failed, retrying via a temporary file: {e}")
+                text = _ocr_image_via_file(img)
+                disable_stdin()
+                return text
+        return _ocr_image_via_file(img)
+    except subprocess.TimeoutExpired as e:
+        logger.error(f"OCR of {image_path} timed out after {e.timeout}s; skipping it.")
+        return ""
+    except (subprocess.CalledProcessError, FileNotFoundError, OSError) as e:
+        logger.error(f"Error processing {image_path}: {e}")
+        return ""
+
 def extract_text_from_image(image_path):
     """Uses Tesseract to extract text from an image after preprocessing."""
-    processed_image_path = _preprocess_image(image_path)
-    if not processed_image_path:
+    img = _preprocess_image(image_path)
+    if img is None:
         return ""
 
+    result = _ocr_image(img, image_path)
+    if result:
+        logger.debug(f"Successfully extracted text from {image_path}:\n---START TEXT---\n{result}\n---END TEXT---")
+    return result
+
+def _split_batch_output(output, page_count):
+    """Splits batched tesseract output into per-page texts, or returns None if pages don't line up."""
+    pages = output.split(OCR_PAGE_SEPARATOR)
+    # tesseract 4 writes the separator after every page, tesseract 5 only between pages
+    if len(pages) == page_count + 1 and not pages[-1].strip():
+        pages.pop()
+    if len(pages) != page_count:
+        return None
+    return pages
+
+def extract_texts_from_images(image_paths):
+    """
+    OCRs several images with a single tesseract invocation.
+    The preprocessed images are listed in a file that tesseract reads page by page, so the
+    process start-up and traineddata loading are paid once per batch instead of per image.
+    Returns one text per input path, in order; images that fail get an empty string.
+    Falls back to one tesseract run per image if the batched output cannot be attributed.
+    """
+    texts = [""] * len(image_paths)
+    with tempfile.TemporaryDirectory(prefix="receipt_ocr_") as work_dir:
+        batch_indices = []
+        batch_files = []
+        for idx, image_path in enumerate(image_paths):
+            img = _preprocess_image(image_path)
+            if img is None:
+                continue
+            processed_image_path = os.path.join(work_dir, f"{idx}.pgm")
+            img.save(processed_image_path)
+            batch_indices.append(idx)
+            batch_files.append(processed_image_path)
+
+        if not batch_files:
+            return texts
+
+        list_path = os.path.join(work_dir, "pages.txt")
+        with open(list_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(batch_files) + "\n")
+
+        try:
+            output = _run_tesseract(list_path, extra_args=('-c', f'page_separator={OCR_PAGE_SEPARATOR}'),
+                                    pages=len(batch_files))
+            pages = _split_batch_output(output, len(batch_files))
+            if pages is None:
+                logger.error(f"Could not split batched OCR output into {len(batch_files)} pages.")
+        except (subprocess.SubprocessError, FileNotFoundError, OSError) as e:
+            logger.error(f"Batched OCR of {len(batch_files)} images failed: {e}")
+            pages = None
+
+        if pages is None:
+            logger.warning(f"Falling back to one tesseract run per image for {len(batch_files)} images.")
+            for idx in batch_indices:
+                texts[idx] = extract_text_from_image(image_paths[idx])
+            return texts
+
+    for idx, text in zip(batch_indices, pages):
+        texts[idx] = text
+        logger.debug(f"Successfully extracted text from {image_paths[idx]}:\n---START TEXT---\n{text}\n---END TEXT---")
+    return texts
+
+@functools.lru_cache(maxsize=None)
+def get_tesseract_version():
+    """Returns the first line of `tesseract --version`, or 'unknown' if it cannot be run."""
     try:
         result = subprocess.run(
-            ['tesseract', processed_image_path, 'stdout', '-l', 'kor+eng', '--psm', '6'],
+            ['tesseract', '--version'],
             capture_output=True, text=True, check=True, encoding='utf-8'
-        ).stdout
-        logger.debug(f"Successfully extracted text from {image_path}:\n---START TEXT---\n{result}\n---END TEXT---")
-        return result
+        )
     except (subprocess.CalledProcessError, FileNotFoundError) as e:
-        logger.error(f"Error processing {processed_image_path}: {e}")
-        return ""
-    finally:
-        if os.path.exists(processed_image_path):
-            os.remove(processed_image_path)
+        logger.error(f"Could not determine tesseract version: {e}")
+        return "unknown"
+    # Older releases print the version banner on stderr
+    output = (result.stdout or result.stderr).strip()
+    return output.splitlines()[0] if output else "unknown"
+
+def ocr_settings_key(extra=""):
+    """
+    Describes the preprocessing and tesseract settings that determine the OCR text.
+    `extra` carries caller-side options such as the region-of-interest templates.
+    """
+    return (
+        f"{get_tesseract_version()}|lang={OCR_LANGUAGE}|psm={OCR_PSM}"
+        f"|gray|maxpx={DECODE_MAX_PIXELS}|contrast={CONTRAST_FACTOR}{extra}"
+    )
 
 def classify_receipt(text):
     """Classifies the receipt based on a hierarchy of keywords and patterns."""
@@ -206,4 +446,146 @@ def find_amount(text, receipt_type):
                     return amount
     
     logger.warning("Could not find amount in receipt.")
-    return "Not found"
\ No newline at end of file
+    return "Not found"
+
+def parse_receipt_text(text):
+    """
+    Runs all field parsers over OCR text. Returns (receipt_type, date, time, amount).
+    Uses the single-pass engine in field_extractor, which gives the same results as
+    classify_receipt/find_date/find_time/find_amount.
+    """
+    with METRICS.stage('parse'):
+        return extract_fields(text)
+
+def _crop_fraction(img, box):
+    """Crops an image by a (left, top, right, bottom) box given as fractions of its size."""
+    width, height = img.size
+    left, top, right, bottom = box
+    return img.crop((int(left * width), int(top * height), int(right * width), int(bottom * height)))
+
+def _merge_boxes(boxes):
+    """Unions overlapping fractional boxes, so no pixel is OCRed twice; sorted top to bottom."""
+    merged = sorted(set(boxes), key=lambda box: (box[1], box[0]))
+    changed = True
+    while changed:
+        changed = False
+        for i, a in enumerate(merged):
+            for j in range(i + 1, len(merged)):
+                b = merged[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    merged[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+    return sorted(merged, key=lambda box: (box[1], box[0]))
+
+def _stack_images(parts):
+    """Stacks images top to bottom on a white sheet, ROI_GAP pixels apart, for a single OCR run."""
+    from PIL import Image
+    sheet = Image.new(parts[0].mode, (max(part.width for part in parts),
+                                      sum(part.height for part in parts) + ROI_GAP * (len(parts) - 1)), 255)
+    top = 0
+    for part in parts:
+        sheet.paste(part, (0, top))
+        top += part.height + ROI_GAP
+    return sheet
+
+def read_receipt_roi(image_path, templates, header_fraction=0.3, header_scale=0.5):
+    """
+    Two-pass OCR that only reads the regions where the fields live.
+    A downscaled crop of the header is OCRed and classified first; then the regions in
+    templates[receipt_type] (fractional boxes, clipped to below the header so no pixel is
+    read twice) are stacked into one image and OCRed in a second run.
+    Returns (text, parsed) or None when the type has no template or a field is missing,
+    in which case the caller should fall back to full-image OCR.
+    """
+    from PIL import Image
+    img = _preprocess_image(image_path)
+    if img is None:
+        return None
+
+    header = _crop_fraction(img, (0.0, 0.0, 1.0, header_fraction))
+    if header_scale != 1.0:
+        header = header.resize(
+            (max(1, int(header.width * header_scale)), max(1, int(header.height * header_scale))),
+            Image.Resampling.LANCZOS
+        )
+    header_text = _ocr_image(header, image_path)
+    receipt_type = classify_receipt(header_text)
+    regions = _merge_boxes([(left, max(top, header_fraction), right, bottom)
+                            for left, top, right, bottom in templates.get(receipt_type, ())
+                            if bottom > header_fraction])
+    if not regions:
+        logger.debug(f"No region template for '{receipt_type}' in {image_path}, using full-image OCR.")
+        return None
+
+    region_text = _ocr_image(_stack_images([_crop_fraction(img, box) for box in regions]), image_path)
+    text = header_text + "\n" + region_text
+    date = find_date(text)
+    time = find_time(text)
+    amount = find_amount(text, receipt_type)
+    if date == "Not found" or time == "00:00:00" or amount == "Not found":
+        logger.debug(f"Region OCR missed a field in {image_path} (date={date}, time={time}, amount={amount}), using full-image OCR.")
+        return None
+
+    logger.debug(f"Region OCR text from {image_path}:\n---START TEXT---\n{text}\n---END TEXT---")
+    return text, (receipt_type, date, time, amount)
+
+def _record_cascade_stage(stage, hit):
+    """Counts an attempt (and possibly a hit) for a cascade stage."""
+    with _cascade_stats_lock:
+        attempts, hits = _cascade_stats.get(stage, (0, 0))
+        _cascade_stats[stage] = (attempts + 1, hits + (1 if hit else 0))
+
+def cascade_stats():
+    """Returns {stage: (attempts, hits)} for the multi-resolution cascade so far."""
+    with _cascade_stats_lock:
+        return dict(_cascade_stats)
+
+def _is_plausible(parsed, amount_range):
+    """True if every field was found and the amount lies within amount_range (inclusive)."""
+    _, date, time, amount = parsed
+    if date == "Not found" or time == "00:00:00" or not amount.isdigit():
+        return False
+    return amount_range[0] <= int(amount) <= amount_range[1]
+
+def read_receipt_cascade(image_path, widths, amount_range):
+    """
+    Multi-resolution OCR with early exit.
+    The preprocessed image is OCRed at each target width in `widths` (smallest first) and the
+    result is accepted as soon as date, time and an in-range amount are all found.
+    Only otherwise does it escalate to the source resolution.
+    Returns (text, parsed) or None if no text was found at any stage.
+    """
+    from PIL import Image
+    img = _preprocess_image(image_path)
+    if img is None:
+        return None
+
+    for width in sorted(widths):
+        if width >= img.width:
+            break
+        stage = f"{width}px"
+        scaled = img.resize(
+            (width, max(1, round(img.height * width / img.width))),
+            Image.Resampling.LANCZOS, reducing_gap=2.0
+        )
+        text = _ocr_image(scaled, image_path)
+        parsed = parse_receipt_text(text) if text else None
+        hit = parsed is not None and _is_plausible(parsed, amount_range)
+        _record_cascade_stage(stage, hit)
+        if hit:
+            logger.debug(f"Cascade stage {stage} accepted for {image_path}:\n---START TEXT---\n{text}\n---END TEXT---")
+            return text, parsed
+        logger.debug(f"Cascade stage {stage} rejected for {image_path}, escalating.")
+
+    text = _ocr_image(img, image_path)
+    if not text:
+        _record_cascade_stage("full", False)
+        return None
+    parsed = parse_receipt_text(text)
+    _record_cascade_stage("full", _is_plausible(parsed, amount_range))
+    logger.debug(f"Successfully extracted text from {image_path}:\n---START TEXT---\n{text}\n---END TEXT---")
+    return text, parsed
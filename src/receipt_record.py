@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Compact receipt records and the summary CSV writer.
+
+The CLI sorts, filters and writes a few columns per receipt, which plain objects and
+the stdlib csv module handle without a DataFrame library.
+"""
+import csv
+import os
+from datetime import datetime
+
+CSV_COLUMNS = ['No.', 'Filename', 'Date', 'Time', 'Amount', 'Type', '제외유무']
+# Extra column written when duplicate detection is on: the file a duplicate was matched to
+DUPLICATE_COLUMN = '중복원본'
+# Extra column written with --period: the 1-based period an included receipt is claimed in
+PERIOD_COLUMN = '기간'
+# --alternatives CSV: one row per selection, compared with the applied one
+ALTERNATIVE_COLUMNS = ['순위', '합계', '개수', '최적 대비', '파레토', '추가 영수증', '빠지는 영수증']
+
+
+class ReceiptRecord:
+    """
+    One extracted receipt. `no` is its number among the included receipts ('' if excluded),
+    counted per period when `period` (1-based, '' otherwise) is set; duplicate_of is the
+    record of the receipt this one is a near-duplicate of, if any.
+    """
+
+    __slots__ = ('filename', 'date', 'time', 'amount', 'receipt_type', 'no', 'period', 'excluded', 'duplicate_of')
+
+    def __init__(self, filename, date, time, amount, receipt_type):
+        self.filename = filename
+        self.date = date
+        self.time = time
+        self.amount = amount
+        self.receipt_type = receipt_type
+        self.no = ''
+        self.period = ''
+        self.excluded = False
+        self.duplicate_of = None
+
+    @classmethod
+    def duplicate(cls, filename, original):
+        """A record for `filename` that reuses the fields of `original` and is always excluded."""
+        record = cls(filename, original.date, original.time, original.amount, original.receipt_type)
+        record.excluded = True
+        record.duplicate_of = original
+        return record
+
+    @classmethod
+    def from_ledger_row(cls, row):
+        """Rebuilds the record of a ledger row (src.ledger), enough to write its CSV row."""
+        record = cls(row['file'], row['date'], row['time'], row['amount'], row['type'])
+        record.no = row['no']
+        record.period = row['period']
+        record.excluded = row['status'] != 'included'
+        if row['duplicate_of'] is not None:
+            record.duplicate_of = cls(row['duplicate_of'], row['date'], row['time'], row['amount'], row['type'])
+        return record
+
+    def sort_key(self):
+        """Date and time as one string, matching the old DateTime sort column."""
+        return f"{self.date} {self.time}"
+
+    def final_name(self, ext):
+        """File name of an included receipt: '3.PNG', or '2-3.PNG' for the third of period 2."""
+        return f"{self.period}-{self.no}{ext}" if self.period else f"{self.no}{ext}"
+
+    def csv_row(self, with_duplicates=False, with_periods=False):
+        row = [self.no, self.filename, format_korean_date(self.date), self.time,
+               self.amount, self.receipt_type, 'Y' if self.excluded else 'N']
+        if with_periods:
+            row.append(self.period)
+        if with_duplicates:
+            row.append(self.duplicate_of.filename if self.duplicate_of is not None else '')
+        return row
+
+    def __repr__(self):
+        return f"ReceiptRecord({self.filename!r}, {self.date!r}, {self.time!r}, {self.amount!r}, {self.receipt_type!r})"
+
+
+def format_korean_date(date):
+    """Formats 'YYYY-MM-DD' as '1월 6일'; dates that don't parse are left as they are."""
+    try:
+        parsed = datetime.strptime(date, '%Y-%m-%d')
+    except ValueError:
+        return date
+    return f"{parsed.month}월 {parsed.day}일"
+
+
+def write_summary_csv(records, path, with_duplicates=False, with_periods=False):
+    """
+    Writes the summary CSV (UTF-8 with BOM so Excel opens it correctly).
+    with_periods adds the PERIOD_COLUMN and with_duplicates the DUPLICATE_COLUMN naming
+    the file each duplicate matched.
+    """
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        writer.writerow(CSV_COLUMNS + ([PERIOD_COLUMN] if with_periods else [])
+                        + ([DUPLICATE_COLUMN] if with_duplicates else []))
+        writer.writerows(record.csv_row(with_duplicates, with_periods) for record in records)
+
+
+def write_alternatives_csv(alternatives, applied, path):
+    """
+    Writes the --alternatives CSV. alternatives is [(rank, total, records, on_front)], rank ''
+    for selections that are only on the Pareto front; each row lists the files the selection
+    adds to and drops from the applied records, by their current file names.
+    """
+    applied_total = sum(record.amount for record in applied)
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        writer.writerow(ALTERNATIVE_COLUMNS)
+        for rank, total, records, on_front in alternatives:
+            added = [record.filename for record in records if record not in applied]
+            dropped = [record.filename for record in applied if record not in records]
+            writer.writerow([rank, total, len(records), total - applied_total, 'Y' if on_front else 'N',
+                             ' '.join(added), ' '.join(dropped)])
+
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only journal for the two-phase receipt rename.
+
+Before any file is touched, the whole plan (original, temporary and final name of every
+file) is appended and fsynced; each rename is then marked as it completes. After a crash
+the journal plus the directory contents tell exactly where every file is, so the run can
+be finished (resume_renames) or undone (rollback_renames).
+
+Each line is one JSON record: {"run": ..., "op": "begin"|"temp"|"final"|"commit"|
+"rollback"|"unfinal"|"untemp"|"rolled_back", ...}.
+
+Only the latest run is ever resumed or rolled back, so a new run moves a journal whose run
+has finished aside (to <journal>.1, replacing the one before); the journal stays one run long.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Per-file state transitions recorded by mark ops, and the op that records reaching a state
+_OP_STATE = {'temp': 'temp', 'final': 'final', 'unfinal': 'temp', 'untemp': 'orig'}
+_STATE_OP = {'temp': 'temp', 'final': 'final', 'orig': 'untemp'}
+
+
+class RenameJournal:
+    """Appends records for one rename run to the journal file."""
+
+    def __init__(self, path, run_id=None):
+        self.path = path
+        self.run_id = run_id or f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _write(self, record, sync=False):
+        self._file.write(json.dumps({'run': self.run_id, **record}, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def begin(self, input_dir, plan):
+        """Records the full plan, a list of (original, temp, final) names, before any rename."""
+        self._write({'op': 'begin', 'input_dir': os.path.abspath(input_dir),
+                     'plan': [list(entry) for entry in plan]}, sync=True)
+
+    def mark(self, op, index):
+        """Records that plan entry `index` completed step `op`."""
+        self._write({'op': op, 'i': index})
+
+    def event(self, op):
+        """Records a run-level event (commit, rollback, rolled_back) durably."""
+        self._write({'op': op}, sync=True)
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def load_last_run(path):
+    """
+    Reads the most recent run from the journal.
+    Returns a dict with run, input_dir, plan, states (per entry, from the marks) and status
+    ('in_progress', 'committed', 'rolling_back' or 'rolled_back'), or None if there is no run.
+    """
+    if not os.path.exists(path):
+        return None
+    run = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a torn last line; everything before it is intact
+                logger.warning(f"Ignoring unreadable journal line in {path}")
+                continue
+            op = record.get('op')
+            if op == 'begin':
+                run = {
+                    'run': record['run'],
+                    'input_dir': record['input_dir'],
+                    'plan': [tuple(entry) for entry in record['plan']],
+                    'states': ['orig'] * len(record['plan']),
+                    'status': 'in_progress',
+                }
+            elif run is None or record.get('run') != run['run']:
+                continue
+            elif op in _OP_STATE:
+                run['states'][record['i']] = _OP_STATE[op]
+            elif op == 'commit':
+                run['status'] = 'committed'
+            elif op == 'rollback':
+                run['status'] = 'rolling_back'
+            elif op == 'rolled_back':
+                run['status'] = 'rolled_back'
+    return run
+
+
+def _actual_states(run):
+    """
+    Corrects the journalled states for the one rename a crash may have left unmarked:
+    a file the journal still places at its previous name but which already moved on.
+    """
+    input_dir = run['input_dir']
+    exists = lambda name: os.path.lexists(os.path.join(input_dir, name))
+    forward = run['status'] in ('in_progress', 'committed')
+    states = []
+    for (orig, temp, final), state in zip(run['plan'], run['states']):
+        if state == 'orig' and exists(temp):
+            state = 'temp'
+        elif state == 'temp' and not exists(temp):
+            state = 'final' if forward else 'orig'
+        elif state == 'final' and not forward and exists(temp) and not exists(final):
+            state = 'temp'
+        states.append(state)
+    return states
+
+
+def _reconcile(journal, run):
+    """Journals any correction _actual_states made, so later recoveries start from a consistent log."""
+    states = _actual_states(run)
+    for index, (journalled, actual) in enumerate(zip(run['states'], states)):
+        if journalled != actual:
+            journal.mark(_STATE_OP[actual], index)
+    journal.sync()
+    return states
+
+
+def check_conflicts(input_dir, plan):
+    """Raises FileExistsError if a rename would overwrite a file that isn't part of the plan."""
+    originals = {orig for orig, _, _ in plan}
+    for orig, temp, final in plan:
+        if os.path.lexists(os.path.join(input_dir, temp)):
+            raise FileExistsError(f"임시 파일 {temp} 이(가) 이미 있습니다. 이전 작업이 중단되었다면 --resume 또는 --rollback 을 먼저 실행하세요.")
+        if final not in originals and os.path.lexists(os.path.join(input_dir, final)):
+            raise FileExistsError(f"{final} 이(가) 이미 있어 {orig} 의 이름을 변경하면 덮어쓰게 됩니다.")
+
+
+def _rename(input_dir, src, dst):
+    os.rename(os.path.join(input_dir, src), os.path.join(input_dir, dst))
+
+
+def _run_forward(journal, input_dir, plan, states):
+    """Moves every entry forward to its final name, first through its temp name."""
+    for index, (orig, temp, _) in enumerate(plan):
+        if states[index] == 'orig':
+            _rename(input_dir, orig, temp)
+            journal.mark('temp', index)
+    # Every file must have left its original name before any final name is taken
+    journal.sync()
+    for index, (_, temp, final) in enumerate(plan):
+        if states[index] != 'final':
+            _rename(input_dir, temp, final)
+            journal.mark('final', index)
+            logger.info(f"  - 파일 이름 변경: {plan[index][0]} → {final}")
+    journal.event('commit')
+
+
+def _run_backward(journal, input_dir, plan, states):
+    """Moves every entry back to its original name, first through its temp name."""
+    for index in reversed(range(len(plan))):
+        _, temp, final = plan[index]
+        if states[index] == 'final':
+            _rename(input_dir, final, temp)
+            journal.mark('unfinal', index)
+            states[index] = 'temp'
+    journal.sync()
+    for index in reversed(range(len(plan))):
+        orig, temp, _ = plan[index]
+        if states[index] == 'temp':
+            _rename(input_dir, temp, orig)
+            journal.mark('untemp', index)
+            logger.info(f"  - 이름 복원: {plan[index][2]} → {orig}")
+    journal.event('rolled_back')
+
+
+def _rotate_finished(journal_path):
+    """Moves the journal aside if its last run finished; an unfinished run stays for --resume/--rollback."""
+    run = load_last_run(journal_path)
+    if run is not None and run['status'] in ('committed', 'rolled_back'):
+        os.replace(journal_path, journal_path + ".1")
+
+
+def apply_renames(journal_path, input_dir, plan):
+    """Journals and performs the two-phase rename of `plan`, a list of (original, temp, final) names."""
+    check_conflicts(input_dir, plan)
+    _rotate_finished(journal_path)
+    journal = RenameJournal(journal_path)
+    try:
+        journal.begin(input_dir, plan)
+        _run_forward(journal, os.path.abspath(input_dir), plan, ['orig'] * len(plan))
+    finally:
+        journal.close()
+
+
+def resume_renames(journal_path):
+    """
+    Finishes an interrupted run from the journal (or an interrupted rollback).
+    Returns (run, done): the last run dict (None if the journal has none) and whether
+    anything was resumed; a run that already finished is left as it is.
+    """
+    run = load_last_run(journal_path)
+    if run is None or run['status'] in ('committed', 'rolled_back'):
+        return run, False
+    journal = RenameJournal(journal_path, run['run'])
+    try:
+        states = _reconcile(journal, run)
+        if run['status'] == 'rolling_back':
+            _run_backward(journal, run['input_dir'], run['plan'], states)
+        else:
+            _run_forward(journal, run['input_dir'], run['plan'], states)
+    finally:
+        journal.close()
+    return run, True
+
+
+def rollback_renames(journal_path):
+    """
+    Restores the original names of the most recent run, whether it finished or not.
+    Returns (run, done) like resume_renames; a run already rolled back is not touched again.
+    """
+    run = load_last_run(journal_path)
+    if run is None or run['status'] == 'rolled_back':
+        return run, False
+    journal = RenameJournal(journal_path, run['run'])
+    try:
+        states = _reconcile(journal, run)
+        if run['status'] != 'rolling_back':
+            journal.event('rollback')
+        _run_backward(journal, run['input_dir'], run['plan'], states)
+    finally:
+        journal.close()
+    return run, True
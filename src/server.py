@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP service around the receipt pipeline and the knapsack solver.
+
+The process stays up, so imports, the tesseract version probe and the OCR cache are
+paid for once; a fixed set of OCR worker threads takes images from a bounded queue.
+When the queue is full, requests are answered 503 with Retry-After immediately
+instead of piling up, so latency stays close to the OCR time itself.
+
+    POST /receipts   image bytes (or JSON {"path": "..."} under the path root) -> parsed fields
+    POST /knapsack   JSON {"amounts": [...], "limit": N} -> selection
+    GET  /health     queue and worker status
+    GET  /metrics    request counts and latency percentiles
+
+The knapsack runs on the request thread, so at most `knapsack_slots` solves run at once
+(each can take a DP table of up to DP_MAX_TABLE_BYTES) and the rest get the same 503.
+Requests are bounded in item count and limit, and every solve in finite time: a client's
+time_budget can only shorten the server's, which is always set. JSON paths are refused unless the
+server was given a path root, and then only for files under it.
+
+Only the standard library is used (http.server); bind it to localhost.
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.bill_calculator import solve_knapsack_auto
+from src.metrics import summarize
+from src.pipeline import recognize_receipt_async, recognize_receipts
+
+logger = logging.getLogger(__name__)
+
+# Latencies kept for the /metrics percentiles (a sliding window, so memory stays flat)
+LATENCY_WINDOW = 1000
+
+_STOP = object()
+
+
+class QueueFull(Exception):
+    """Raised by ReceiptService.submit when the request queue is at capacity."""
+
+
+class ReceiptService:
+    """
+    Warm OCR workers behind a bounded queue. submit() returns a Future of
+    (result, from_cache), where result is (text, parsed) or None if no text was found.
+    """
+
+    def __init__(self, options, jobs=1, cache=None, queue_depth=16):
+        self.options = options
+        self.cache = cache
+        self.jobs = max(1, jobs)
+        self.queue_depth = max(1, queue_depth)
+        self.started = time.time()
+        self._queue = queue.Queue(maxsize=self.queue_depth)
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._counters = {'receipts': 0, 'receipts_cached': 0, 'receipts_no_text': 0,
+                          'receipts_failed': 0, 'rejected_busy': 0, 'knapsack': 0}
+        self._latency = {'receipt': deque(maxlen=LATENCY_WINDOW), 'ocr': deque(maxlen=LATENCY_WINDOW),
+                         'knapsack': deque(maxlen=LATENCY_WINDOW)}
+        self._workers = [threading.Thread(target=self._work, name=f"serve-ocr-{i}", daemon=True)
+                         for i in range(self.jobs)]
+        for worker in self._workers:
+            worker.start()
+
+    def count(self, counter, latency_name=None, seconds=None):
+        with self._lock:
+            self._counters[counter] += 1
+            if latency_name is not None:
+                self._latency[latency_name].append(seconds)
+
+    def submit(self, image_path):
+        """Queues image_path for OCR; raises QueueFull instead of waiting when the queue is full."""
+        future = Future()
+        try:
+            self._queue.put_nowait((image_path, future))
+        except queue.Full:
+            self.count('rejected_busy')
+            raise QueueFull from None
+        return future
+
+    def _recognize(self, image_path):
+        key = None
+        if self.cache is not None:
+            key = self.cache.key_for(image_path)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached, True
+        if self.options.async_ocr:
+            result, cacheable = asyncio.run(recognize_receipt_async(image_path, self.options))
+        else:
+            result, cacheable = recognize_receipts([image_path], self.options)[0], True
+        if result is not None and key is not None and cacheable:
+            self.cache.put(key, *result)
+        return result, False
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            image_path, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self._lock:
+                self._busy += 1
+            start = time.perf_counter()
+            try:
+                future.set_result(self._recognize(image_path))
+            except Exception as e:
+                logger.exception(f"OCR of {image_path} failed")
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    self._latency['ocr'].append(time.perf_counter() - start)
+
+    def health(self):
+        with self._lock:
+            busy = self._busy
+        return {
+            'status': 'ok' if all(worker.is_alive() for worker in self._workers) else 'degraded',
+            'uptime_seconds': round(time.time() - self.started, 3),
+            'workers': self.jobs,
+            'busy_workers': busy,
+            'queued': self._queue.qsize(),
+            'queue_capacity': self.queue_depth,
+        }
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self._counters)
+            latency = {name: summarize(values) for name, values in self._latency.items() if values}
+        return {**self.health(), 'counters': counters, 'latency_seconds': latency}
+
+    def close(self):
+        """Lets queued images finish, then stops the workers."""
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+
+
+class ReceiptRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end of a ReceiptService (server.service)."""
+
+    server_version = "receipt-calculator"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status, payload, headers=()):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, headers=()):
+        self._send_json(status, {'error': message}, headers)
+
+    def _read_body(self):
+        """Returns the request body, or None after answering 411/413."""
+        length = self.headers.get('Content-Length')
+        if length is None or not length.isdigit():
+            self._error(HTTPStatus.LENGTH_REQUIRED, "Content-Length 헤더가 필요합니다.")
+            return None
+        if int(length) > self.server.max_body_bytes:
+            self._error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                        f"요청 크기가 {self.server.max_body_bytes:,}바이트를 넘습니다.")
+            self.close_connection = True
+            return None
+        return self.rfile.read(int(length))
+
+    def _read_json(self, body):
+        try:
+            payload = json.loads(body)
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            payload = None
+        if not isinstance(payload, dict):
+            self._error(HTTPStatus.BAD_REQUEST, "JSON 객체를 보내야 합니다.")
+            return None
+        return payload
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/health':
+            self._send_json(HTTPStatus.OK, service.health())
+        elif self.path == '/metrics':
+            self._send_json(HTTPStatus.OK, service.metrics())
+        else:
+            self._error(HTTPStatus.NOT_FOUND, f"알 수 없는 경로: {self.path}")
+
+    def do_POST(self):
+        if self.path not in ('/receipts', '/knapsack'):
+            self._error(HTTPStatus.NOT_FOUND, f"알 수 없는 경로: {self.path}")
+            return
+        body = self._read_body()
+        if body is None:
+            return
+        if self.path == '/receipts':
+            self._post_receipt(body)
+        else:
+            self._post_knapsack(body)
+
+    def _post_receipt(self, body):
+        service = self.server.service
+        start = time.perf_counter()
+        upload_path = None
+        if self.headers.get_content_type() == 'application/json':
+            payload = self._read_json(body)
+            if payload is None:
+                return
+            image_path = payload.get('path')
+            if self.server.path_root is None:
+                self._error(HTTPStatus.FORBIDDEN, "이 서버는 경로 요청을 받지 않습니다. 이미지 데이터를 보내세요.")
+                return
+            if not isinstance(image_path, str) or not _is_under(image_path, self.server.path_root):
+                self._error(HTTPStatus.FORBIDDEN, f"허용된 디렉토리 밖의 경로입니다: {image_path}")
+                return
+            if not os.path.isfile(image_path):
+                self._error(HTTPStatus.BAD_REQUEST, f"이미지 파일을 찾을 수 없습니다: {image_path}")
+                return
+        else:
+            if not body:
+                self._error(HTTPStatus.BAD_REQUEST, "이미지 데이터가 비어 있습니다.")
+                return
+            fd, upload_path = tempfile.mkstemp(prefix="receipt_upload_", dir=self.server.upload_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            image_path = upload_path
+
+        try:
+            try:
+                future = service.submit(image_path)
+            except QueueFull:
+                self._error(HTTPStatus.SERVICE_UNAVAILABLE, "처리 대기열이 가득 찼습니다. 잠시 후 다시 시도하세요.",
+                            [('Retry-After', '1')])
+                return
+            try:
+                result, from_cache = future.result()
+            except Exception as e:
+                service.count('receipts_failed')
+                self._error(HTTPStatus.INTERNAL_SERVER_ERROR, f"OCR 처리 중 오류가 발생했습니다: {e}")
+                return
+        finally:
+            if upload_path is not None:
+                os.remove(upload_path)
+
+        seconds = time.perf_counter() - start
+        if result is None:
+            service.count('receipts_no_text', 'receipt', seconds)
+            self._error(HTTPStatus.UNPROCESSABLE_ENTITY, "이미지에서 텍스트를 찾을 수 없습니다.")
+            return
+        service.count('receipts_cached' if from_cache else 'receipts', 'receipt', seconds)
+        receipt_type, date, time_, amount = result[1]
+        amount = int(amount) if amount.isascii() and amount.isdigit() else None
+        low, high = service.options.amount_range
+        self._send_json(HTTPStatus.OK, {
+            'receipt_type': receipt_type,
+            'date': date,
+            'time': time_,
+            'amount': amount,
+            'valid_amount': amount is not None and low <= amount <= high,
+            'cached': from_cache,
+            'seconds': round(seconds, 6),
+        })
+
+    def _post_knapsack(self, body):
+        payload = self._read_json(body)
+        if payload is None:
+            return
+        amounts, limit = payload.get('amounts'), payload.get('limit')
+        # JSON true/false arrive as bool, which is an int subclass
+        if (not isinstance(amounts, list) or not all(_is_count(a) for a in amounts) or not _is_count(limit)):
+            self._error(HTTPStatus.BAD_REQUEST, "amounts 는 0 이상의 정수 배열, limit 은 0 이상의 정수여야 합니다.")
+            return
+        if len(amounts) > self.server.knapsack_max_items or limit > self.server.knapsack_max_limit:
+            self._error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                        f"amounts 는 최대 {self.server.knapsack_max_items:,}개, "
+                        f"limit 은 최대 {self.server.knapsack_max_limit:,} 까지 받습니다.")
+            return
+        # A client may ask for less time than the server allows, never more
+        time_budget = self.server.time_budget
+        requested = payload.get('time_budget')
+        if isinstance(requested, (int, float)) and not isinstance(requested, bool) and requested > 0:
+            time_budget = min(requested, time_budget)
+
+        if not self.server.knapsack_slots.acquire(blocking=False):
+            self.server.service.count('rejected_busy')
+            self._error(HTTPStatus.SERVICE_UNAVAILABLE, "최적 합계 계산 요청이 많습니다. 잠시 후 다시 시도하세요.",
+                        [('Retry-After', '1')])
+            return
+        start = time.perf_counter()
+        try:
+            # Items are identified by their position in `amounts`
+            result = solve_knapsack_auto(amounts, list(range(len(amounts))), limit, time_budget)
+        except Exception as e:
+            logger.exception("Knapsack request failed")
+            self._error(HTTPStatus.INTERNAL_SERVER_ERROR, f"최적 합계 계산 중 오류가 발생했습니다: {e}")
+            return
+        finally:
+            self.server.knapsack_slots.release()
+        seconds = time.perf_counter() - start
+        self.server.service.count('knapsack', 'knapsack', seconds)
+        self._send_json(HTTPStatus.OK, {
+            'best_sum': result.best_sum,
+            'included': sorted(result.included_ids),
+            'optimal': result.optimal,
+            'method': result.method,
+            'seconds': round(seconds, 6),
+        })
+
+
+def _is_count(value):
+    """Whether a JSON value is a non-negative integer (true/false don't count)."""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _is_under(path, root):
+    """Whether path, with symlinks resolved, is root or inside it."""
+    path, root = os.path.realpath(path), os.path.realpath(root)
+    return os.path.commonpath([path, root]) == root
+
+
+def make_server(service, host, port, max_body_bytes, time_budget=10, upload_dir=None, knapsack_slots=1,
+                path_root=None, knapsack_max_items=1000, knapsack_max_limit=10 ** 9):
+    """
+    Creates (but does not start) the HTTP server for a ReceiptService. knapsack_slots bounds
+    concurrent /knapsack solves, and each one is limited to knapsack_max_items amounts, a
+    limit up to knapsack_max_limit and time_budget seconds (always finite); path_root
+    (None: refuse) is where JSON image paths may point.
+    """
+    server = ThreadingHTTPServer((host, port), ReceiptRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.max_body_bytes = max_body_bytes
+    server.time_budget = time_budget
+    server.upload_dir = upload_dir
+    server.knapsack_slots = threading.BoundedSemaphore(max(1, knapsack_slots))
+    server.knapsack_max_items = knapsack_max_items
+    server.knapsack_max_limit = knapsack_max_limit
+    server.path_root = path_root
+    return server
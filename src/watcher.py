@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Waiting for changes in the receipt directory.
+
+On Linux the directory is watched with inotify (through ctypes, no extra dependency);
+elsewhere, or if inotify is unavailable, it is polled. Either way wait() only says that
+something may have changed: callers compare directory_snapshot() results and wait for
+the snapshot to settle, which also debounces bursts of arrivals and half-copied files.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import sys
+import time
+
+from src.pipeline import IMAGE_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+def directory_snapshot(input_dir):
+    """
+    Identities (device, inode, size, mtime) of the receipt images in input_dir.
+    Names are left out on purpose, so the tool's own renames don't count as changes.
+    """
+    snapshot = set()
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot.add((st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns))
+    return frozenset(snapshot)
+
+
+class InotifyWatcher:
+    """Blocks until the kernel reports activity in the directory."""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch failed for {path}")
+
+    def wait(self, timeout=None):
+        """Returns True once events arrived (all pending ones are consumed), False on timeout."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        while True:
+            try:
+                if not os.read(self._fd, 64 * 1024):
+                    break
+            except BlockingIOError:
+                break
+        return True
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Fallback that simply wakes up every `interval` seconds."""
+
+    def __init__(self, path, interval):
+        self.interval = interval
+
+    def wait(self, timeout=None):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        return True
+
+    def close(self):
+        pass
+
+
+def open_watcher(path, poll_interval, use_inotify=True):
+    """Returns an InotifyWatcher where possible, otherwise a PollingWatcher."""
+    if use_inotify and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable ({e}); polling every {poll_interval}s instead.")
+    return PollingWatcher(path, poll_interval)
+
+
+def wait_until_settled(input_dir, snapshot, debounce):
+    """Waits until the directory snapshot stops changing for `debounce` seconds and returns it."""
+    while True:
+        time.sleep(debounce)
+        current = directory_snapshot(input_dir)
+        if current == snapshot:
+            return snapshot
+        snapshot = current